@@ -10,20 +10,119 @@ import pyroomacoustics as pra
 import os # To do up file export portion
 import time
 import yaml
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Fields of the room parameter table (1 row per RIR)
+# Everything that is randomised about a room is drawn up front into this table,
+# so that the parameter space can be inspected (and sharded) before spending hours on compute_rir
+ROOM_PARAMETER_DTYPE = np.dtype([
+    ("index", np.int64),
+    # (1) Room Dimensions
+    ("base_length", np.float64),
+    ("base_width", np.float64),
+    ("entrance_depth", np.float64),
+    ("entrance_length", np.float64),
+    ("radius_curve", np.float64),
+    ("height", np.float64),
+    # (2) Materials
+    ("scattering_mat", "U40"),
+    ("curved_walls_mat", "U40"),
+    ("entrance_mat", "U40"),
+    ("entrance_scattering", np.float64),
+    ("curtain_walls_mat", "U40"),
+    ("curtain_scattering", np.float64),
+    ("ceiling_mat", "U40"),
+    ("ceiling_scattering", np.float64),
+    ("floor_mat", "U40"),
+    ("floor_scattering", np.float64),
+    # (3) Source and mic
+    ("source_x", np.float64),
+    ("source_y", np.float64),
+    ("source_height", np.float64),
+    ("mic_x", np.float64),
+    ("mic_y", np.float64),
+    ("mic_height", np.float64),
+    ("mic_p", np.float64),
+    ("azimuth", np.float64),
+    ("colatitude", np.float64),
+    # (4) RIR durations
+    ("rir_simulated_duration", np.float64),
+    ("rir_total_duration", np.float64),
+])
 
 def rir_generate(quantity,
                  config_file,
                  master_seed,
                  output_folder,
                  preview_mode,
+                 workers=None,
+                 sample_only=False,
+                 parameters_file=None,
+                 chunk_size=16,
                  ):
-    
+
     print(f"Welcome to the Amazing RIR Generator! You have ordered {quantity} RIRs!...")
-    
+
     ## Extract parameters from config file
     with open(config_file, 'r') as file:
         parameters = yaml.safe_load(file)
 
+    ## Draw the parameters of every room up front, and save them with the output
+    # The table sits next to the output folder rather than inside it, so that the folder only holds RIRs
+    room_parameters = sample_room_parameters(quantity, parameters, master_seed)
+    if parameters_file is None:
+        parameters_file = os.path.normpath(output_folder) + "_room_parameters.npy"
+    np.save(parameters_file, room_parameters)
+    print(f"Room parameters of {quantity} RIRs saved to {parameters_file}")
+
+    if sample_only:
+        print("Sample Only Mode is On... No RIR simulated!")
+        return room_parameters
+
+    if not os.path.isdir(output_folder):
+        os.mkdir(output_folder)
+
+    # RIR k is always written to rir_{k}.npy, and seeded from (master_seed, k)
+    # So a crashed (or partial) run can be resumed by simply skipping the indices that are already present
+    # and the RIRs do not depend on the order (or the process) in which they are generated
+    to_generate = [k for k in range(quantity) if not os.path.isfile(os.path.join(output_folder, f"rir_{k}.npy"))]
+    print(f"{quantity - len(to_generate)} RIRs already present in {output_folder}; generating {len(to_generate)}...")
+
+    if preview_mode:
+        if to_generate:
+            rir_chunk(room_parameters[to_generate[:1]], parameters, output_folder, preview_mode)
+        print("Preview Mode is On... Generating only 1 RIR!")
+        return room_parameters
+
+    # Start Timer
+    start_time = time.perf_counter()
+
+    # Each RIR is independent; spread chunks of them over a pool of processes (defaults to 1 per core)
+    # Within a chunk, the late tails are synthesised together in 1 batched call
+    chunks = [to_generate[i:i + chunk_size] for i in range(0, len(to_generate), chunk_size)]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(rir_chunk, room_parameters[chunk], parameters, output_folder, False) for chunk in chunks]
+
+        for future in as_completed(futures):
+            done += len(future.result())
+
+            elapsed_time = (time.perf_counter() - start_time) / 60
+            rate = done / max(elapsed_time, 1e-9)
+            print(f"{done} out of {len(to_generate)} RIR generated... Elapsed time: {elapsed_time:.1f} minutes ({rate:.1f} RIRs/minute)")
+
+    return room_parameters
+
+
+def sample_room_parameters(quantity,
+                           parameters,
+                           master_seed,
+                           ):
+    """
+    Draws the room, material, source/mic and duration parameters of RIRs 0 to quantity-1 into a structured array
+    (see ROOM_PARAMETER_DTYPE). All random draws of row k come from generators seeded with (master_seed, k),
+    so row k is the same however many rooms are drawn, and whichever process simulates it.
+    """
     # (1) Room Dimensions
     base_length_upper, base_length_lower = parameters["room_dimensions"]["base_length_upper"], parameters["room_dimensions"]["base_length_lower"]
     base_width_upper, base_width_lower = parameters["room_dimensions"]["base_width_upper"], parameters["room_dimensions"]["base_width_lower"]
@@ -31,7 +130,6 @@ def rir_generate(quantity,
     entrance_length_upper, entrance_length_lower = parameters["room_dimensions"]["entrance_length_upper"], parameters["room_dimensions"]["entrance_length_lower"]
     radius_curve_upper, radius_curve_lower = parameters["room_dimensions"]["radius_curve_upper"], parameters["room_dimensions"]["radius_curve_lower"]
     height_upper, height_lower = parameters["room_dimensions"]["height_upper"], parameters["room_dimensions"]["height_lower"]
-    curved_panels = 8
     margin = parameters["room_dimensions"]["margin"]
 
     # (2) Materials
@@ -46,148 +144,218 @@ def rir_generate(quantity,
     soft_scattering_upper, soft_scattering_lower = parameters["room_materials"]["scattering_values"]["soft_scattering_upper"], parameters["room_materials"]["scattering_values"]["soft_scattering_lower"]
 
     # (3) source and mic (including polar pattern values) parameters
-    source_height_upper, source_height_lower = parameters["source"]["source_height_upper"],parameters["source"]["source_height_lower"] 
+    source_height_upper, source_height_lower = parameters["source"]["source_height_upper"],parameters["source"]["source_height_lower"]
     mic_height_upper, mic_height_lower = parameters["mic"]["mic_height_upper"],parameters["mic"]["mic_height_lower"]
     mic_p_upper, mic_p_lower = parameters["mic"]["mic_p_upper"],parameters["mic"]["mic_p_lower"]
 
-    # Start Timer
-    start_time = time.perf_counter()
+    # (4) RIR durations
+    rir_simulated_duration_upper = parameters["acoustics"]["rir_simulated_duration_upper"]
+    rir_simulated_duration_lower = parameters["acoustics"]["rir_simulated_duration_lower"]
+    rir_total_duration_upper = parameters["acoustics"]["rir_total_duration_upper"]
+    rir_total_duration_lower = parameters["acoustics"]["rir_total_duration_lower"]
 
-    for loop in range(quantity):
+    room_parameters = np.zeros(quantity, dtype=ROOM_PARAMETER_DTYPE)
 
+    for k in range(quantity):
         # Set seed value
-        # We set a seed number for each loop beginning with the master seed number
-        # this is to facilitate the resumption of RIR generation in the event when something crashes
-        # we will count the number of files in output folder and then add to the master seed each round
-        # TODO: this makes the function non-idempotent, which is likely a bug
-        # consider using the hash of a file as its seed instead
-        seed = master_seed + len(os.listdir(output_folder))
-        np.random.seed(seed)
-
-        ### A. Create Room
+        seed_sequence = np.random.SeedSequence([master_seed, k])
+        rng = np.random.default_rng(seed_sequence)
+        py_rng = random.Random(int(seed_sequence.generate_state(1)[0]))
+        row = room_parameters[k]
+        row["index"] = k
 
         ## Randomise room dimensions
-        base_length = np.random.uniform(base_length_upper, base_length_lower)
-        base_width = np.random.uniform(base_width_upper, base_width_lower)
-        entrance_depth = np.random.uniform(entrance_depth_upper, entrance_depth_lower)
-        entrance_length = np.random.uniform(entrance_length_upper, entrance_length_lower)
-        radius_curve = np.random.uniform(radius_curve_upper, radius_curve_lower)
-        height = np.random.uniform(height_upper, height_lower)
+        base_length = rng.uniform(base_length_upper, base_length_lower)
+        base_width = rng.uniform(base_width_upper, base_width_lower)
+        row["base_length"], row["base_width"] = base_length, base_width
+        row["entrance_depth"] = rng.uniform(entrance_depth_upper, entrance_depth_lower)
+        row["entrance_length"] = rng.uniform(entrance_length_upper, entrance_length_lower)
+        radius_curve = rng.uniform(radius_curve_upper, radius_curve_lower)
+        row["radius_curve"] = radius_curve
+        row["height"] = rng.uniform(height_upper, height_lower)
+
+        ## Choose materials
+        row["scattering_mat"] = py_rng.choice(scattering_mat)
+        row["curved_walls_mat"] = py_rng.choice(curved_walls_mat)
+        row["entrance_mat"] = py_rng.choice(entrance_mat)
+        row["entrance_scattering"] = rng.uniform(hard_scattering_upper, hard_scattering_lower) # hard surface
+        row["curtain_walls_mat"] = py_rng.choice(curtain_walls_mat)
+        row["curtain_scattering"] = rng.uniform(soft_scattering_upper, soft_scattering_lower) # soft surface
+        row["ceiling_mat"] = py_rng.choice(ceiling_mat)
+        row["ceiling_scattering"] = rng.uniform(hard_scattering_upper, hard_scattering_lower) # hard surface
+        row["floor_mat"] = py_rng.choice(floor_mat)
+        row["floor_scattering"] = rng.uniform(soft_scattering_upper, soft_scattering_lower) # soft surface
+
+        ## Source and mic position
+        row["source_height"] = rng.uniform(source_height_lower, source_height_upper)
+        row["source_x"] = radius_curve + rng.uniform(margin*base_length, base_length*(1-margin))
+        row["source_y"] = rng.uniform(margin*base_length, base_width*(1-margin))
+        row["mic_height"] = rng.uniform(mic_height_lower, mic_height_upper)
+        row["mic_x"] = radius_curve + rng.uniform(margin * base_length, base_length*(1-margin))
+        row["mic_y"] = rng.uniform(margin * base_width, base_width*(1-margin))
 
-        width_outside_curve = (base_width - (radius_curve*2))/2
-        length_outside_entrance = (base_length - entrance_length)/2
+        # mic polar pattern and mic directivity
+        row["mic_p"] = rng.uniform(mic_p_lower, mic_p_upper)
+        row["azimuth"] = rng.uniform(0, 2 * np.pi)
+        row["colatitude"] = rng.uniform(0, np.pi)
 
-        # A-I. Left Wall
-        coordinate_1 = [radius_curve,0]
-        coordinate_2 = [radius_curve,width_outside_curve]
-        # start curve side 1
-        coordinate_3 = [np.round(radius_curve-radius_curve*np.sin(np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_4 = [np.round(radius_curve-radius_curve*np.sin(2*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(2*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_5 = [np.round(radius_curve-radius_curve*np.sin(3*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(3*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_6 = [np.round(radius_curve-radius_curve*np.sin(4*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(4*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_7 = [np.round(radius_curve-radius_curve*np.sin(5*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(5*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_8 = [np.round(radius_curve-radius_curve*np.sin(6*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(6*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_9 = [np.round(radius_curve-radius_curve*np.sin(7*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(7*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_10 = [np.round(radius_curve-radius_curve*np.sin(8*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(8*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        # end curve side 1
-        coordinate_11 = [radius_curve, base_width]
+        ## RIR durations
+        row["rir_simulated_duration"] = rng.uniform(rir_simulated_duration_lower, rir_simulated_duration_upper)
+        row["rir_total_duration"] = rng.uniform(rir_total_duration_lower, rir_total_duration_upper) # Also known as T60
+
+    return room_parameters
 
+
+def room_corners(radius_curve,
+                 base_length,
+                 base_width,
+                 entrance_depth,
+                 entrance_length,
+                 curved_panels=8,
+                 ):
+    """
+    Builds the [x, y] corners of the floor plan: a left wall with a curve of curved_panels panels,
+    a top wall with the entrance, a right wall with the mirrored curve, and a bottom wall.
+    Takes scalars (returns [n_corners, 2]) or arrays of N rooms (returns [N, n_corners, 2]);
+    n_corners is 26 for the default 8 curved panels.
+    """
+    radius_curve, base_length, base_width, entrance_depth, entrance_length = np.broadcast_arrays(
+        *[np.asarray(x, dtype=np.float64) for x in (radius_curve, base_length, base_width, entrance_depth, entrance_length)])
+
+    width_outside_curve = (base_width - (radius_curve*2))/2
+    length_outside_entrance = (base_length - entrance_length)/2
+
+    # Curve angles pi/curved_panels, 2pi/curved_panels, ..., pi, along a trailing axis
+    angles = np.arange(1, curved_panels + 1) * np.pi / curved_panels
+    r = radius_curve[..., None]
+    curve_x = np.round(r - r*np.sin(angles), decimals=2)
+    curve_y = np.round(r - r*np.cos(angles) + width_outside_curve[..., None], decimals=2)
+
+    def corner(x, y):
+        return np.stack(np.broadcast_arrays(x, y), axis=-1)[..., None, :]
+
+    corners = np.concatenate([
+        # A-I. Left Wall
+        corner(radius_curve, 0),
+        corner(radius_curve, width_outside_curve),
+        # curve side 1
+        np.stack([curve_x, curve_y], axis=-1),
+        corner(radius_curve, base_width),
         # A-II. top wall (entrance)
-        coordinate_12 = [radius_curve+length_outside_entrance, base_width]
-        coordinate_13 = [radius_curve+length_outside_entrance, base_width + entrance_depth]
-        coordinate_14 = [radius_curve+length_outside_entrance + entrance_length, base_width + entrance_depth]
-        coordinate_15 = [radius_curve+length_outside_entrance + entrance_length, base_width]
-        coordinate_16 = [radius_curve+base_length, base_width]
-
-        ## A-III. Right Wall
-        # start curve side 2
-        coordinate_17 = [radius_curve + base_length, base_width - width_outside_curve]
-        coordinate_18 = [radius_curve + base_length + np.round(radius_curve*np.sin(7*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(7*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_19 = [radius_curve + base_length + np.round(radius_curve*np.sin(6*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(6*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_20 = [radius_curve + base_length + np.round(radius_curve*np.sin(5*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(5*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_21 = [radius_curve + base_length + np.round(radius_curve*np.sin(4*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(4*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_22 = [radius_curve + base_length + np.round(radius_curve*np.sin(3*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(3*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_23 = [radius_curve + base_length + np.round(radius_curve*np.sin(2*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(2*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-        coordinate_24 = [radius_curve + base_length + np.round(radius_curve*np.sin(1*np.pi/curved_panels), decimals=2), np.round(radius_curve - radius_curve*np.cos(1*np.pi/curved_panels) + width_outside_curve, decimals=2)]
-
-        ## A-IV. Bottom Wall
-        coordinate_25 = [radius_curve + base_length, width_outside_curve]
-        coordinate_26 = [radius_curve + base_length, 0]
-
-        
-        
-        ### B. Choose materials; prepare material list
-        scattering_mat_chosen = random.choice(scattering_mat)
-        
+        corner(radius_curve + length_outside_entrance, base_width),
+        corner(radius_curve + length_outside_entrance, base_width + entrance_depth),
+        corner(radius_curve + length_outside_entrance + entrance_length, base_width + entrance_depth),
+        corner(radius_curve + length_outside_entrance + entrance_length, base_width),
+        corner(radius_curve + base_length, base_width),
+        # A-III. Right Wall
+        corner(radius_curve + base_length, base_width - width_outside_curve),
+        # curve side 2; mirrors angles (curved_panels-1)pi/curved_panels down to pi/curved_panels
+        np.stack([(radius_curve + base_length)[..., None] + np.round(r*np.sin(angles[-2::-1]), decimals=2),
+                  curve_y[..., -2::-1]], axis=-1),
+        # A-IV. Bottom Wall
+        corner(radius_curve + base_length, width_outside_curve),
+        corner(radius_curve + base_length, 0),
+    ], axis=-2)
+
+    return corners
+
+
+def late_tails(last_samples,
+               rir_simulated_durations,
+               rir_total_durations,
+               tail_lengths,
+               fs,
+               ):
+    """
+    Approximates the long tails of many RIRs at once using exponential decay.
+
+    Arguments:
+    - array like    last_samples            : The last sample of each simulated (truncated) RIR; tails start from its magnitude
+    - array like    rir_simulated_durations : The simulated duration of each RIR
+    - array like    rir_total_durations     : The total duration of each RIR (also known as T60)
+    - array like    tail_lengths            : The number of samples of each tail
+    - int           fs                      : The sampling rate
+
+    Returns:
+    - list of numpy arrays, tail i being of length tail_lengths[i]
+    """
+    last_samples = np.abs(np.asarray(last_samples, dtype=np.float64))[:, None]
+    rir_simulated_durations = np.asarray(rir_simulated_durations, dtype=np.float64)[:, None]
+    rir_total_durations = np.asarray(rir_total_durations, dtype=np.float64)[:, None]
+    tail_lengths = np.maximum(np.asarray(tail_lengths, dtype=np.int64), 0)
+
+    # 1 [N, longest tail] matrix; each row is then cut to its own length
+    time_tail = np.arange(tail_lengths.max(initial=0)) / fs
+    # TODO: validate that we really only want to scale based on the last sample value
+    # you might want to average (maybe rms) the last few percent of the array instead
+    tails = last_samples * np.exp(-6.91 * (time_tail[None, :] + rir_simulated_durations/fs) / rir_total_durations) # note scaling
+
+    return [tails[i, :tail_lengths[i]] for i in range(len(tail_lengths))]
+
+
+def rir_chunk(room_parameters,
+              parameters,
+              output_folder,
+              preview_mode,
+              ):
+    """
+    Simulates the RIRs of a chunk of rows of the room parameter table (see sample_room_parameters),
+    and exports RIR k to rir_{k}.npy in output_folder.
+    Returns the list of exported paths.
+    """
+    fs = parameters["acoustics"]["sampling_rate"]
+    rirs_full = []
+    rirs_simulated_truncated = []
+
+    for row in room_parameters:
+        ### A. Create Room
+        corners = room_corners(row["radius_curve"], row["base_length"], row["base_width"],
+                               row["entrance_depth"], row["entrance_length"]).T  # [x,y]
+
+        ### B. Prepare material list
         # B-I: walls
-        curved_walls_mat_0to11_13to24 = pra.Material(random.choice(curved_walls_mat), scattering = scattering_mat_chosen)
-        entrance_mat_12 = pra.Material(random.choice(entrance_mat), scattering = np.random.uniform(hard_scattering_upper, hard_scattering_lower)) # hard surface
-        curtain_walls_mat_25 = pra.Material(random.choice(curtain_walls_mat), scattering = np.random.uniform(soft_scattering_upper, soft_scattering_lower)) # soft surface
+        curved_walls_mat_0to11_13to24 = pra.Material(str(row["curved_walls_mat"]), scattering = str(row["scattering_mat"]))
+        entrance_mat_12 = pra.Material(str(row["entrance_mat"]), scattering = float(row["entrance_scattering"])) # hard surface
+        curtain_walls_mat_25 = pra.Material(str(row["curtain_walls_mat"]), scattering = float(row["curtain_scattering"])) # soft surface
         wall_materials = [curved_walls_mat_0to11_13to24 for i in range(12)] + [entrance_mat_12] + [curved_walls_mat_0to11_13to24 for i in range(12)] + [curtain_walls_mat_25]
-        
+
         # B-II: ceiling and floor
-        ceiling_mat_27 = pra.Material(random.choice(ceiling_mat))
-        ceiling_scattering = np.random.uniform(hard_scattering_upper, hard_scattering_lower) # hard surface
-        floor_mat_26 = pra.Material(random.choice(floor_mat))
-        floor_scattering = np.random.uniform(soft_scattering_upper, soft_scattering_lower) # soft surface
+        ceiling_mat_27 = pra.Material(str(row["ceiling_mat"]))
+        floor_mat_26 = pra.Material(str(row["floor_mat"]))
 
-        
-        
         ### C.Create room in pyroomacoustics
         # C-I: Create 2-D room
-        corners = np.array([coordinate_1, coordinate_2, coordinate_3, coordinate_4, coordinate_5, 
-                    coordinate_6, coordinate_7, coordinate_8, coordinate_9, coordinate_10,
-                    coordinate_11, coordinate_12, coordinate_13, coordinate_14, coordinate_15,
-                    coordinate_16, coordinate_17, coordinate_18, coordinate_19, coordinate_20,
-                    coordinate_21, coordinate_22, coordinate_23, coordinate_24, coordinate_25,
-                    coordinate_26]).T  # [x,y]
-        
-        room = pra.Room.from_corners(corners, 
-                                     fs = parameters["acoustics"]["sampling_rate"],
+        room = pra.Room.from_corners(corners,
+                                     fs = fs,
                                      materials = wall_materials,
                                      max_order = parameters["acoustics"]["rir_simulation_order"])
 
         # C-II. Extrude into 3-D rooms
-        room.extrude(height = height)
+        room.extrude(height = row["height"])
         room.walls[-2].absorption = floor_mat_26.absorption_coeffs.copy() # floor
-        room.walls[-2].scatter = [ceiling_scattering] # floor 
+        room.walls[-2].scatter = [row["ceiling_scattering"]] # floor
         room.walls[-1].absorption = ceiling_mat_27.absorption_coeffs.copy() # ceiling
-        room.walls[-1].scatter = [floor_scattering]# ceiling
-        
+        room.walls[-1].scatter = [row["floor_scattering"]]# ceiling
+
         # Inspect materials
         # for count, i in enumerate(room.walls):
         #     print(count, i.absorption, i.scatter)
 
         ### D. Set up Source and Mic position
-        # source
-        source_height = np.random.uniform(source_height_lower, source_height_upper)
-        source_x = radius_curve + np.random.uniform(margin*base_length, base_length*(1-margin))
-        source_y = np.random.uniform(margin*base_length, base_width*(1-margin))
-        
-        room.add_source([source_x, source_y, source_height])
-
-        # mic position
-        mic_height = np.random.uniform(mic_height_lower, mic_height_upper)
-        mic_x = radius_curve + np.random.uniform(margin * base_length, base_length*(1-margin))
-        mic_y = np.random.uniform(margin * base_width, base_width*(1-margin))
-        mic_pos = np.array([[mic_x, mic_y, mic_height]]).T
-
-        # mic polar pattern and mic directivity
-        mic_p = np.random.uniform(mic_p_lower, mic_p_upper)
-        azimuth = np.random.uniform(0, 2 * np.pi)
-        colatitude = np.random.uniform(0, np.pi)
+        room.add_source([row["source_x"], row["source_y"], row["source_height"]])
 
+        mic_pos = np.array([[row["mic_x"], row["mic_y"], row["mic_height"]]]).T
         directivity = pra.directivities.CardioidFamily(
-            orientation=pra.directivities.DirectionVector(azimuth=azimuth, colatitude=colatitude, degrees=False),  # (azimuth, colatitude) in rads
-            p = mic_p
+            orientation=pra.directivities.DirectionVector(azimuth=row["azimuth"], colatitude=row["colatitude"], degrees=False),  # (azimuth, colatitude) in rads
+            p = row["mic_p"]
             )
-        
-        my_mic = pra.MicrophoneArray(mic_pos, fs=parameters["acoustics"]["sampling_rate"], directivity=directivity)
+
+        my_mic = pra.MicrophoneArray(mic_pos, fs=fs, directivity=directivity)
         room.add_microphone_array(my_mic)
 
         if preview_mode:
-            print(f"Source position: {source_x}, {source_y}, {source_height}")
-            print(f"Mic position: {mic_x}, {mic_y}, {mic_height}")
+            print(f"Source position: {row['source_x']}, {row['source_y']}, {row['source_height']}")
+            print(f"Mic position: {row['mic_x']}, {row['mic_y']}, {row['mic_height']}")
 
             fig = plt.figure()
             ax = fig.add_subplot(111, projection='3d') # default to first grid position (row, column, index)
@@ -199,25 +367,23 @@ def rir_generate(quantity,
         # Run Simulation;
         room.compute_rir()
         rir = room.rir[0][0]
+        if preview_mode:
+            rirs_full.append(rir)
 
         # Step 1: Generate and generated RIR of a moderate order up to first 0.2s
-        rir_simulated_duration_upper = parameters["acoustics"]["rir_simulated_duration_upper"]
-        rir_simulated_duration_lower = parameters["acoustics"]["rir_simulated_duration_lower"]
-        rir_simulated_duration = np.random.uniform(rir_simulated_duration_lower, rir_simulated_duration_upper)
-        rir_simulated_truncated_length = int(rir_simulated_duration * room.fs)
-        rir_simulated_truncated = rir[:rir_simulated_truncated_length]
-
-        # Step 2: Approximate long tail of RIR using exponential decay (i.e. total 0.6 seconds)
-        rir_total_duration_upper = parameters["acoustics"]["rir_total_duration_upper"]
-        rir_total_duration_lower = parameters["acoustics"]["rir_total_duration_lower"]
-        rir_total_duration = np.random.uniform(rir_total_duration_lower, rir_total_duration_upper) # Also known as T60
-        
-        tail_length = int(rir_total_duration * room.fs - rir_simulated_truncated_length)
-        time_tail = np.arange(tail_length) / room.fs
-        # TODO: validate that we really only want to scale based on the last sample value
-        # you might want to average (maybe rms) the last few percent of the array instead
-        late_tail = np.abs(rir_simulated_truncated[-1]) * np.exp(-6.91 * (time_tail + rir_simulated_duration/room.fs) / rir_total_duration) # note scaling
-        
+        rir_simulated_truncated_length = int(row["rir_simulated_duration"] * fs)
+        rirs_simulated_truncated.append(rir[:rir_simulated_truncated_length])
+
+    # Step 2: Approximate long tail of the RIRs using exponential decay (i.e. total 0.6 seconds); all tails of the chunk at once
+    tails = late_tails([rir_simulated_truncated[-1] for rir_simulated_truncated in rirs_simulated_truncated],
+                       room_parameters["rir_simulated_duration"],
+                       room_parameters["rir_total_duration"],
+                       [int(row["rir_total_duration"] * fs - len(rir_simulated_truncated))
+                        for row, rir_simulated_truncated in zip(room_parameters, rirs_simulated_truncated)],
+                       fs)
+
+    rir_paths = []
+    for count, (row, rir_simulated_truncated, late_tail) in enumerate(zip(room_parameters, rirs_simulated_truncated, tails)):
         # Step 3: Concatenante RIR segments
         rir_final = np.concatenate([rir_simulated_truncated, late_tail])
 
@@ -225,13 +391,13 @@ def rir_generate(quantity,
 
         if preview_mode:
             # Time axis for rir_full
-            t_full = np.arange(len(rir)) / room.fs
+            t_full = np.arange(len(rirs_full[count])) / fs
             # Time axis for rir_final
-            t_final = np.arange(len(rir_final)) / room.fs
+            t_final = np.arange(len(rir_final)) / fs
 
             # Plot
             plt.figure(figsize=(10,5))
-            plt.plot(t_full, rir, label='Full RIR with moderate order', alpha=0.8, linewidth = 0.7)
+            plt.plot(t_full, rirs_full[count], label='Full RIR with moderate order', alpha=0.8, linewidth = 0.7)
             plt.plot(t_final, rir_final, label='Early + Late Tail', alpha=0.8)
             plt.xlabel('Time [s]')
             plt.ylabel('Amplitude [dB]')
@@ -240,30 +406,26 @@ def rir_generate(quantity,
             plt.legend()
             plt.show()
 
-        ### F. Export RIR; Must to prevent overwriting what have been generated (in case this was after a crash)
-        rir_filename = f"rir_{len(os.listdir(output_folder))}.npy"
-        if not os.path.isdir(output_folder):
-            os.mkdir(output_folder)
-        np.save(os.path.join(output_folder, rir_filename), rir_final)
-
-        if preview_mode:
-            print("Preview Mode is On... Generating only 1 RIR!")
-            break
-
-        if (loop+1)%10 == 0:
-            end_time = time.perf_counter()
-            elapsed_time = (end_time - start_time) / 60
-            print(f"{loop+1} out of {quantity} RIR generated... Elapsed time: {elapsed_time:.1f} minutes")
+        ### F. Export RIR; write to a temporary file first, so a crash never leaves a partial rir_{k}.npy behind
+        rir_path = os.path.join(output_folder, f"rir_{row['index']}.npy")
+        temp_path = os.path.join(output_folder, f"rir_{row['index']}.tmp.npy")
+        np.save(temp_path, rir_final)
+        os.replace(temp_path, rir_path)
+        rir_paths.append(rir_path)
 
-    return (None)
+    return rir_paths
 
-if __name__ == "__main__":    
+if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Your RIR Generator")
     parser.add_argument("--quantity", type=int, default=500, help="Number of RIRs to Generate")
     parser.add_argument("--config_file", type=str, default = "./config.yaml", help="The config yaml file to refer to")
     parser.add_argument("--master_seed", type=int, default = 42, help="Set initial seed")
     parser.add_argument("--output_folder", type=str, default = "./simulated_RIRs", help="Set output folder")
     parser.add_argument("--preview_mode", type = bool, default=False, help="Generate only 1 RIR, albeit with illustrative schematics if True")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes to generate RIRs with (defaults to 1 per core)")
+    parser.add_argument("--sample_only", action="store_true", help="Only draw and save the room parameters of all RIRs; no RIR is simulated")
+    parser.add_argument("--parameters_file", type=str, default=None, help="Where to save the room parameters (defaults to <output_folder>_room_parameters.npy)")
+    parser.add_argument("--chunk_size", type=int, default=16, help="Number of RIRs simulated (and tails synthesised) per task")
 
     args = parser.parse_args()
 
@@ -271,4 +433,8 @@ if __name__ == "__main__":
                  args.config_file,
                  args.master_seed,
                  args.output_folder,
-                 args.preview_mode)
+                 args.preview_mode,
+                 args.workers,
+                 args.sample_only,
+                 args.parameters_file,
+                 args.chunk_size)
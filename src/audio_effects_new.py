@@ -18,9 +18,12 @@
 import random
 
 import numpy as np
-import pyrubberband
-import torch
-from scipy import signal
+
+from src.numeric_policy import to_numpy
+from src.numeric_policy import to_working
+from src.numeric_policy import working_np_dtype
+from src.sos_filter import design_sos
+from src.sos_filter import sos_filter
 
 
 def audio_effector(audio_wav,
@@ -73,7 +76,9 @@ def audio_effector(audio_wav,
         # if you intend to convert the audio to mono, merge the channels instead
         # TODO: rubberband can stretch multichannel audio
         # stretching each channel individually can cause artifacts
-        audio_wav = audio_wav.numpy()[0]
+        audio_wav = audio_wav[0]
+    # In the working dtype (see src.numeric_policy); shares memory with the input where it can
+    audio_wav = to_numpy(audio_wav)
 
     # Set up parameters log
     paras = {}
@@ -113,11 +118,16 @@ def audio_effector(audio_wav,
     # II. Implement change of temp
     ## Effect tempo change
 
+    if tempo_change or pitch_shift:
+        import pyrubberband
+
     if tempo_change:
         tempo_change_rate = random.uniform(tempo_range[0], tempo_range[1])
         audio_wav = pyrubberband.pyrb.time_stretch(audio_wav,
                                                    sr=sr,
                                                    rate=tempo_change_rate)
+        # rubberband hands back float64
+        audio_wav = to_numpy(audio_wav)
 
         # log parameters
         paras["tempo_change_rate"] = tempo_change_rate
@@ -125,7 +135,7 @@ def audio_effector(audio_wav,
     # III. Implement pitchshift
     if pitch_shift:
         n_steps = random.randint(pitch_shift_range[0], pitch_shift_range[1])
-        audio_wav = pyrubberband.pyrb.pitch_shift(audio_wav, sr=sr, n_steps=n_steps)
+        audio_wav = to_numpy(pyrubberband.pyrb.pitch_shift(audio_wav, sr=sr, n_steps=n_steps))
 
         paras["pitch_shift"] = n_steps
 
@@ -135,13 +145,13 @@ def audio_effector(audio_wav,
         low_pass_order = random.randint(low_pass_order[0], low_pass_order[1])
         low_pass_cutoff = random.randint(low_pass_cutoff[0], low_pass_cutoff[1])
 
-        b, a = signal.butter(N=low_pass_order,
-                             Wn=low_pass_cutoff,
-                             btype="low",
-                             analog=False,
-                             fs=sr)
+        # Second-order sections are numerically stable at higher orders; designs are cached across calls
+        sos = design_sos(order=low_pass_order,
+                         cutoff=low_pass_cutoff,
+                         sr=sr,
+                         btype="low")
         # Apply filter
-        audio_wav = signal.lfilter(b, a, audio_wav)
+        audio_wav = sos_filter(audio_wav, sos, dtype=working_np_dtype())
 
         # log parameters; convert to list for json-ification
         paras["low_pass"] = {"low_pass_order":  low_pass_order,
@@ -149,7 +159,7 @@ def audio_effector(audio_wav,
 
     # V. Convert back to torch tensor for downstream processing
     ## We have to expand the dimension and then convert to torch tensor since we are back to dealing with torchaudio
-    audio_wav = torch.from_numpy(np.expand_dims(audio_wav, axis=0))
+    audio_wav = to_working(np.expand_dims(audio_wav, axis=0))
 
     return audio_wav, sr, paras
 
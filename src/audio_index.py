@@ -0,0 +1,217 @@
+## AJS's Corpus Index
+# This module keeps an index of the audio files of a folder (speech or noise), probed from their headers only
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# Folders used to be listed again for every pick, e.g. random.choice(os.listdir(audio_repo)) retried until "wav"
+# was in the name (hanging on an empty folder, and accepting e.g. `not-a-wav-file.txt` or a corrupt file)
+# An index is therefore built once per folder and stored alongside the audio files:
+# (1) audio_index.json : per valid audio file, its duration, sampling rate, channels, size and mtime,
+#                      : read from the file header (nothing is decoded), plus the files rejected by the probe
+# The index is refreshed incrementally: only files which are new, or whose mtime or size changed, are probed again
+# Within a session, indexes are cached and only refreshed when the folder itself changes (i.e. its mtime)
+
+# Files are then drawn from a sampling table (see corpus_table / draw_audio):
+# (A) uniformly, with random.choice, as before
+# (B) weighted, e.g. by duration, in O(1) per draw (Walker's alias method)
+# Either can be restricted to a range of durations, so files which would be rejected are never decoded
+
+import json
+import os
+import random
+
+INDEX_JSON = "audio_index.json"
+AUDIO_EXTENSIONS = (".wav", ".flac")
+
+# (folder mtime, index, sampling tables) per folder, for the rest of the session
+_indexes = {}
+
+
+def probe_audio(audio_path):
+    """
+    Reads the header of an audio file, without decoding it.
+
+    Returns:
+    - dict with keys "duration_s", "sampling_rate", "channels", "frames" and "format",
+      or None if the file is not valid audio (or holds no samples)
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(audio_path)
+    except Exception:
+        return None
+    if info.frames <= 0 or info.samplerate <= 0:
+        return None
+
+    return {"duration_s":    info.frames / info.samplerate,
+            "sampling_rate": info.samplerate,
+            "channels":      info.channels,
+            "frames":        info.frames,
+            "format":        info.format}
+
+
+def build_audio_index(audio_repo, extensions=AUDIO_EXTENSIONS, refresh=False):
+    """
+    Builds (or incrementally refreshes) the index of the audio files in a folder,
+    and stores it alongside the audio files as audio_index.json (if the folder is writable).
+
+    Arguments:
+    - str   audio_repo  : The folder containing the audio files
+    - tuple extensions  : The file extensions considered (case-insensitive)
+    - bool  refresh     : If True, every file is probed again
+
+    Returns:
+    - dict with keys "files" (per valid audio file: probe results, "size" and "mtime")
+      and "rejected" (per rejected file: "size" and "mtime")
+    """
+    json_path = os.path.join(audio_repo, INDEX_JSON)
+    previous = {"files": {}, "rejected": {}}
+    if not refresh and os.path.isfile(json_path):
+        with open(json_path, "r") as f:
+            previous = json.load(f)
+
+    index = {"files": {}, "rejected": {}}
+    changed = False
+    with os.scandir(audio_repo) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if not entry.is_file() or not entry.name.lower().endswith(tuple(extensions)):
+                continue
+            stat = entry.stat()
+
+            # Reuse the probe of files which have not changed (whether they were valid or not)
+            for section in ("files", "rejected"):
+                known = previous[section].get(entry.name)
+                if known is not None and known["mtime"] == stat.st_mtime and known["size"] == stat.st_size:
+                    index[section][entry.name] = known
+                    break
+            else:
+                changed = True
+                probe = probe_audio(entry.path)
+                if probe is None:
+                    index["rejected"][entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+                else:
+                    index["files"][entry.name] = {**probe, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    # Files which were removed also change the index
+    changed = changed or set(index["files"]) != set(previous["files"]) or set(index["rejected"]) != set(previous["rejected"])
+    if changed:
+        try:
+            temp_path = f"{json_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(temp_path, json_path)
+        except OSError:
+            # A read-only folder is indexed all the same; the index just lives for the session
+            pass
+
+    return index
+
+
+def load_audio_index(audio_repo, extensions=AUDIO_EXTENSIONS):
+    """
+    Returns the index of a folder (see build_audio_index), cached for the session.
+    The index is refreshed whenever files are added to, or removed from, the folder.
+    """
+    key = (os.path.abspath(audio_repo), tuple(extensions))
+    if key not in _indexes or _indexes[key][0] != os.stat(audio_repo).st_mtime:
+        index = build_audio_index(audio_repo, extensions=extensions)
+        # Stat the folder after the build, as writing audio_index.json changes its mtime
+        _indexes[key] = (os.stat(audio_repo).st_mtime, index, {})
+    return _indexes[key][1]
+
+
+def list_audio(audio_repo, min_duration_s=None, max_duration_s=None, extensions=AUDIO_EXTENSIONS):
+    """
+    Lists the valid audio files of a folder (sorted), optionally within a range of durations.
+    """
+    files = load_audio_index(audio_repo, extensions=extensions)["files"]
+    return [name for name, entry in files.items()
+            if (min_duration_s is None or entry["duration_s"] >= min_duration_s)
+            and (max_duration_s is None or entry["duration_s"] <= max_duration_s)]
+
+
+def _alias_table(weights):
+    ## Walker's alias method (Vose's variant): O(n) to build, O(1) per draw
+    n = len(weights)
+    total = float(sum(weights))
+    scaled = [weight * n / total for weight in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        (small if scaled[more] < 1.0 else large).append(more)
+
+    return prob, alias
+
+
+def corpus_table(audio_repo, weight=None, min_duration_s=None, max_duration_s=None):
+    """
+    Returns a sampling table over the valid audio files of a folder, to draw files from with draw_audio.
+    Tables are cached with the index of the folder, so this is free after the first call.
+
+    Arguments:
+    - str   audio_repo      : The folder containing the audio files
+    - str   weight          : None for uniform draws, or "duration" to draw files in proportion to their duration
+    - float min_duration_s  : Files shorter than this are never drawn
+    - float max_duration_s  : Files longer than this are never drawn
+
+    Returns:
+    - dict with keys "names", "prob" and "alias" ("prob" and "alias" are None for uniform draws)
+    raises ValueError : if no valid audio file is left to draw from
+    """
+    index = load_audio_index(audio_repo)
+    tables = _indexes[(os.path.abspath(audio_repo), AUDIO_EXTENSIONS)][2]
+    key = (weight, min_duration_s, max_duration_s)
+    if key in tables:
+        return tables[key]
+
+    names = list_audio(audio_repo, min_duration_s=min_duration_s, max_duration_s=max_duration_s)
+    if not names:
+        raise ValueError(f"No valid audio files to draw from in {audio_repo}")
+
+    tables[key] = sampling_table({name: index["files"][name]["duration_s"] for name in names}, weight=weight)
+    return tables[key]
+
+
+def sampling_table(durations, weight=None):
+    """
+    Returns a sampling table over files (see corpus_table), given their durations in seconds, keyed by name.
+    """
+    names = list(durations)
+    if weight is None:
+        return {"names": names, "prob": None, "alias": None}
+    if weight == "duration":
+        prob, alias = _alias_table([durations[name] for name in names])
+        return {"names": names, "prob": prob, "alias": alias}
+    raise ValueError('please input a correct weight: None or "duration"')
+
+
+def draw_audio(table, rng=random):
+    """
+    Draws the name of an audio file from a sampling table (see corpus_table), in O(1).
+    """
+    if table["prob"] is None:
+        return rng.choice(table["names"])
+    i = rng.randrange(len(table["names"]))
+    return table["names"][i] if rng.random() < table["prob"][i] else table["names"][table["alias"][i]]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the audio index of folders of audio files")
+    parser.add_argument("audio_repos", type=str, nargs="+", help="The folders of audio files to index")
+    parser.add_argument("--refresh", action="store_true", help="Probe every file again")
+
+    args = parser.parse_args()
+
+    for audio_repo in args.audio_repos:
+        index = build_audio_index(audio_repo, refresh=args.refresh)
+        hours = sum(entry["duration_s"] for entry in index["files"].values()) / 3600
+        print(f"{audio_repo}: {len(index['files'])} audio files ({hours:.2f} h), {len(index['rejected'])} rejected")
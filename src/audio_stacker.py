@@ -7,13 +7,37 @@ import torchaudio.functional as F
 
 def audio_noise_stack(audio_1_data,
                       audio_2_data,
-                      SNR
+                      SNR,
+                      energy_1=None,
+                      energy_2=None
                       ):
+    """
+    Stacks audio_2_data onto audio_1_data at the given SNR, then peak-normalises the result.
+
+    Arguments:
+    - torch tensor  audio_1_data    : The audio (signal) data, of dimension (1, n_samples)
+    - torch tensor  audio_2_data    : The noise data, of the same dimension as audio_1_data
+    - float         SNR             : Signal-to-Noise Ratio in dB, as per torchaudio.functional.add_noise
+    - float         energy_1        : Optional known energy (sum of squares) of audio_1_data, e.g. from src.energy_stats
+    - float         energy_2        : Optional known energy of audio_2_data; either saves a pass over the audio
+
+    Returns:
+    - torch tensor of dimension (1, n_samples)
+    """
     if (audio_1_data.shape != audio_2_data.shape):
         # TODO: consider truncation or padding instead, within some reasonable difference (a few audio samples)
         raise ValueError("The shape of the audio and noise data do not match!")
 
-    stack_data = F.add_noise(audio_1_data, audio_2_data, torch.tensor([SNR]))
+    if energy_1 is None and energy_2 is None:
+        stack_data = F.add_noise(audio_1_data, audio_2_data, torch.tensor([SNR], dtype=audio_1_data.dtype))
+    else:
+        # Same scaling as F.add_noise, skipping the power computation of whichever energy is already known
+        if energy_1 is None:
+            energy_1 = torch.linalg.vector_norm(audio_1_data, ord=2) ** 2
+        if energy_2 is None:
+            energy_2 = torch.linalg.vector_norm(audio_2_data, ord=2) ** 2
+        scale = (energy_1 / energy_2) ** 0.5 * 10 ** (-SNR / 20)
+        stack_data = audio_1_data + scale * audio_2_data
 
     # normalise audio after this
     max_value = stack_data.abs().max()
@@ -21,3 +45,60 @@ def audio_noise_stack(audio_1_data,
         stack_data = stack_data / max_value
 
     return stack_data
+
+
+def noise_layer_gains(noise_layers, NNR_dbs, layer_energies=None):
+    """
+    Computes the per-layer gains that reproduce stacking noise_layers one by one with F.add_noise,
+    where layer k is added onto the running stack of layers [0, k) at NNR_dbs[k - 1].
+
+    F.add_noise scales the noise by sqrt(P_stack / P_noise) * 10^(-NNR/20), and the power of the running stack
+    only depends on the gains so far and on the Gram matrix of the layers (w^T G w),
+    so all gains are solved on an [L, L] matrix instead of on full length temporaries.
+
+    Arguments:
+    - torch tensor  noise_layers    : The sized noise layers, of dimension (L, n_samples)
+    - list          NNR_dbs         : The L - 1 Noise-to-Noise-Ratios used to stack layers 1 to L - 1 onto the stack
+    - list          layer_energies  : Optional known energy of each layer (None where unknown), e.g. from src.energy_stats
+                                    : Only used if every layer's is known; with 2 layers, no pass over the layers is needed
+
+    Returns:
+    - torch tensor of dimension (L,), where gains[0] = 1 (the "base" of the stack)
+    """
+    if len(NNR_dbs) != noise_layers.shape[0] - 1:
+        raise ValueError("Please provide 1 NNR for every noise layer stacked onto the base layer")
+
+    # Gram matrix of the layers; diagonal holds the energy of each layer
+    # Cross terms are only needed from the 3rd layer onwards
+    if layer_energies is not None and None not in layer_energies:
+        energies = torch.tensor(layer_energies, dtype=noise_layers.dtype)
+        gram = noise_layers @ noise_layers.T if noise_layers.shape[0] > 2 else torch.diag(energies)
+        gram.diagonal().copy_(energies)
+    else:
+        gram = noise_layers @ noise_layers.T
+    gains = torch.zeros(noise_layers.shape[0], dtype=noise_layers.dtype)
+    gains[0] = 1
+
+    for k in range(1, noise_layers.shape[0]):
+        # Energy of the stack built so far, i.e. ||sum_i w_i * n_i||^2 for i < k
+        energy_stack = gains[:k] @ gram[:k, :k] @ gains[:k]
+        gains[k] = torch.sqrt(energy_stack / gram[k, k]) * 10 ** (-NNR_dbs[k - 1] / 20)
+
+    return gains
+
+
+def noise_layer_mix(noise_layers, NNR_dbs, layer_energies=None):
+    """
+    Mixes sized noise layers in a single weighted reduction, matching sequential F.add_noise stacking.
+
+    Arguments:
+    - torch tensor  noise_layers    : The sized noise layers, of dimension (L, n_samples)
+    - list          NNR_dbs         : The L - 1 Noise-to-Noise-Ratios used to stack layers 1 to L - 1 onto the stack
+    - list          layer_energies  : Optional known energy of each layer (see noise_layer_gains)
+
+    Returns:
+    - torch tensor of dimension (1, n_samples)
+    """
+    gains = noise_layer_gains(noise_layers, NNR_dbs, layer_energies=layer_energies)
+
+    return (gains @ noise_layers).unsqueeze(0)
@@ -0,0 +1,78 @@
+## AJS's Batch Scheduler
+# This module groups items into batches of similar duration, for batched (vectorised) stages of the pipeline
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# Clips in 00_raw_speech vary wildly in length (from ~2s to several minutes)
+# A batched stage pads every clip of a batch to the longest one, so batching a 2s clip with a 3min clip
+# spends ~99% of the work (and memory) of the 2s clip on padding
+# Items are therefore:
+# (1) put into duration buckets, where the longest clip of a bucket is at most bucket_ratio x the shortest
+# (2) batched within their bucket, so that the padded size of a batch (n_items x longest clip) stays under max_batch_s
+# Items keep their serial numbers, so batching only changes the order in which they are synthesised
+# A batched stage may still change the output of a clip through its padding (e.g. filter transients running into it);
+# such stages log what replay needs to reproduce it (e.g. the padded length of "phone_batched")
+
+import math
+
+
+def duration_buckets(durations, bucket_ratio=1.25, min_duration_s=0.5):
+    """
+    Puts items into geometric duration buckets: bucket k holds durations in [min_duration_s * r^k, min_duration_s * r^(k+1)).
+
+    Arguments:
+    - dict  durations       : The duration (in seconds) of each item, keyed by serial number
+    - float bucket_ratio    : The ratio of the longest to the shortest duration a bucket may hold (> 1)
+    - float min_duration_s  : Durations below this all go into bucket 0
+
+    Returns:
+    - dict of lists of serial numbers (sorted by duration, then serial), keyed by bucket number
+    """
+    if bucket_ratio <= 1:
+        raise ValueError("bucket_ratio must be greater than 1")
+
+    buckets = {}
+    for serial in sorted(durations, key=lambda serial: (durations[serial], serial)):
+        duration = max(durations[serial], min_duration_s)
+        bucket = int(math.floor(math.log(duration / min_duration_s, bucket_ratio)))
+        buckets.setdefault(bucket, []).append(serial)
+
+    return buckets
+
+
+def schedule_batches(durations, max_batch_s=600.0, bucket_ratio=1.25, max_batch_items=None):
+    """
+    Groups items into batches of similar duration, so that little of a batched stage is spent on padding.
+
+    Arguments:
+    - dict  durations       : The duration (in seconds) of each item, keyed by serial number
+    - float max_batch_s     : The most padded audio a batch may hold, i.e. n_items x longest duration, in seconds
+                            : An item longer than this forms a batch of its own
+    - float bucket_ratio    : The ratio of the longest to the shortest duration within a batch (see duration_buckets)
+    - int   max_batch_items : The most items a batch may hold (no limit if None)
+
+    Returns:
+    - list of batches (lists of serial numbers), shortest buckets first; every item is in exactly 1 batch
+    """
+    batches = []
+    for bucket in sorted(duration_buckets(durations, bucket_ratio=bucket_ratio).values(), key=lambda b: durations[b[0]]):
+        batch = []
+        for serial in bucket:
+            # Items are sorted by duration within a bucket, so the item being added is the longest of the batch
+            full = max_batch_items is not None and len(batch) >= max_batch_items
+            if batch and (full or (len(batch) + 1) * durations[serial] > max_batch_s):
+                batches.append(batch)
+                batch = []
+            batch.append(serial)
+        if batch:
+            batches.append(batch)
+
+    return batches
+
+
+def padding_ratio(batches, durations):
+    """
+    Returns the share of the padded size of batches which is padding, i.e. wasted by a batched stage (0 is no waste).
+    """
+    padded = sum(len(batch) * max(durations[serial] for serial in batch) for batch in batches)
+    used = sum(durations[serial] for batch in batches for serial in batch)
+    return 1 - used / padded if padded > 0 else 0.0
@@ -2,20 +2,30 @@
 # Also it makes more sense to simply implement bulk_generation_simple as a call on bulk_generation with possibly fixed params?
 
 
-import json
-import random
-import tempfile
-from datetime import datetime
-import torchaudio
-
-from src.audio_effects_new import audio_effector
-from src.audio_stacker import audio_noise_stack
-from src.encoding_scripts.opus import decode_opus
-from src.encoding_scripts.opus import encode_opus
-from src.utils.loader import load_audio_with_pytorch
-from src.ir_convolve import ir_convolve
-from src.noise_builder import noise_builder
-from src.post_convo_sizer import post_convo_sizer
+from src.pipeline import device_stages
+from src.pipeline import run_pipeline
+from src.pipeline import speech_noise_stages
+
+
+def bulk_pipeline_config(speech_folder="./data/00_raw_speech/",
+                         room_ir_folder="./data/Impulse_Responses/room_IRs/",
+                         noise_stationary_folder="./data/01_stationary_noise/",
+                         noise_nonstationary_folder="./data/02_non-stationary_noise/",
+                         fabric_ir_folder="./data/Impulse_Responses/fabric_IRs/",
+                         handphone_ir_folder="./data/Impulse_Responses/handphone_IRs/",
+                         output_sink="loose",
+                         output_folder="./output",
+                         shard_size_mb=1024,
+                         dirty_format="wav",
+                         speech_store=None,
+                         segment_seconds=None):
+    """
+    Returns the pipeline config (see src.pipeline) of bulk generation: stages III-A to III-G.
+    """
+    return {"output": {"sink": output_sink, "folder": output_folder, "shard_size_mb": shard_size_mb},
+            "stages": speech_noise_stages(speech_folder, room_ir_folder, noise_stationary_folder, noise_nonstationary_folder,
+                                          speech_store=speech_store, segment_seconds=segment_seconds)
+                      + device_stages(fabric_ir_folder, handphone_ir_folder, dirty_format=dirty_format)}
 
 
 def bulk_generation(number_of_audios=10,
@@ -24,163 +34,44 @@ def bulk_generation(number_of_audios=10,
                     noise_stationary_folder="./data/01_stationary_noise/",
                     noise_nonstationary_folder="./data/02_non-stationary_noise/",
                     fabric_ir_folder="./data/Impulse_Responses/fabric_IRs/",
-                    handphone_ir_folder="./data/Impulse_Responses/handphone_IRs/"):
-    # Set up experiment log (for reproducibility)
-    experiment_log = []
-
-    for i in range(number_of_audios):
-        # (Re)set up parameters log for audio
-        parameters_log = {"serial":                i,
-                          "file_name":             None,
-                          "original_speech_file":  None,
-                          "sampling_rate":         None,
-                          "sample_len":            None,
-                          "generate_clean_speech": None,
-                          "add_room_reverb":       None,
-                          "stationary_noise":      None,
-                          "nonstationary_noise":   None,
-                          "combine_speech_noise":  None,
-                          "simulate_fabric":       None,
-                          "simulate_mobile":       None,
-                          "simulate_codec":        None,
-                          "phone_lowpass":         None}
-
-        ## Stage III-A: Generate Clean Speech
-        # Load random audio from raw speech folder
-        # TODO: crashes if this randomly chooses a non-audio file like `.DS_Store`
-        speech_file = random.choice(os.listdir(speech_folder))
-        sample_data, sr = load_audio_with_pytorch(os.path.join(speech_folder, speech_file))
-        # Implement efects on speech data (only tempo and pitch shift)
-        sample_data, sr, paras = audio_effector(sample_data,
-                                                tempo_change=True,
-                                                pitch_shift=True)
-
-        # Clean speech generated
-        torchaudio.save(f"./output/clean_samples/{i}.wav",
-                        src=sample_data,
-                        format="wav",
-                        encoding="PCM_S",
-                        sample_rate=sr,
-                        bits_per_sample=16)
-
-        # Log III-A Parameters:
-        parameters_log["original_speech_file"] = speech_file
-        parameters_log["sampling_rate"] = sr
-        parameters_log["sample_len"] = sample_data.shape[1]
-        parameters_log["generate_clean_speech"] = paras
-
-        torchaudio.save("test_preroom.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-B: Synthesising Speech with Room Reverberation 
-        # Convolve data with random room IR
-        sample_data, sr, size_orig, IR_applied, paras = ir_convolve(sample_data, sr,
-                                                                    mode="random_single",
-                                                                    ir_repo=room_ir_folder)
-
-        # Rightsize convolved data
-        sample_data = post_convo_sizer(audio_data=sample_data,
-                                       size_orig=size_orig,
-                                       convo_type="room",
-                                       IR_applied=IR_applied)
-
-        # Log III-B Parameters:
-        parameters_log["add_room_reverb"] = paras
-        torchaudio.save("test_postroom.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-C: Synthesising Noise
-        noise_stationary_data, sr, noise_stationary_paras = noise_builder(sample_data,
-                                                                          noise_stationary_folder,
-                                                                          echo=True,
-                                                                          no_of_audio=random.randint(1, 2),
-                                                                          low_pass=True,
-                                                                          mode="stationary")
-        noise_nonstationary_data, sr, noise_nonstationary_paras = noise_builder(sample_data,
-                                                                                noise_nonstationary_folder,
-                                                                                no_of_audio=random.randint(0, 2),
-                                                                                echo=True,
-                                                                                mode="non-stationary")
-
-        # Log III-C Parameters:
-        parameters_log["stationary_noise"] = noise_stationary_paras
-        parameters_log["nonstationary_noise"] = noise_nonstationary_paras
-
-        ## Stage III-D: Combining Speech and Noise
-        stationary_nonstationary_NNR = random.uniform(-5, 20)
-        speech_noise_SNR = random.uniform(-5, 20)
-
-        combined_noise_data = audio_noise_stack(noise_stationary_data,
-                                                noise_nonstationary_data,
-                                                stationary_nonstationary_NNR
-                                                )
-        sample_data = audio_noise_stack(sample_data,
-                                        combined_noise_data,
-                                        speech_noise_SNR
-                                        )
-
-        # Log III-D Parameters:
-        parameters_log["combine_speech_noise"] = {"stationary_nonstationary_NNR": stationary_nonstationary_NNR,
-                                                  "speech_noise_SNR":             speech_noise_SNR}
-
-        torchaudio.save("test_postnoise.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-E: Simulating Passing of Audio through Fabric
-        # 90% chance of mixing IRs, 10% chance of single random IR
-        mode = random.choice(["random_mix"] * 9 + ["random_single"] * 1)
-        sample_data, sr, size_orig, IR_applied, paras = ir_convolve(sample_data,
-                                                                    sr,
-                                                                    mode=mode,
-                                                                    ir_repo=fabric_ir_folder)
-
-        sample_data = post_convo_sizer(audio_data=sample_data,
-                                       size_orig=size_orig,
-                                       convo_type="fabric",
-                                       IR_applied=IR_applied)
-
-        # Log III-E Parameters:
-        parameters_log["simulate_fabric"] = paras
-
-        torchaudio.save("test_postfabric.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-F: Simulating Recording of Audio by Mobile Phones
-        sample_data, sr, size_orig, IR_applied, paras = ir_convolve(sample_data,
-                                                                    sr,
-                                                                    mode="random_mix",
-                                                                    ir_repo=handphone_ir_folder)
-
-        sample_data = post_convo_sizer(audio_data=sample_data,
-                                       size_orig=size_orig,
-                                       convo_type="mobile",
-                                       IR_applied=IR_applied)
-        torchaudio.save("test_postmobile.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        # Log III-F Parameters:
-        parameters_log["simulate_mobile"] = paras
-
-        ## Stage III-G. Simulating Degradation of Audio from Mobile CODEC Encoding/Decoding
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            temp_file_path = os.path.join(tmpdirname, "sample_audio.wav")
-            torchaudio.save(temp_file_path, sample_data, sample_rate=sr, encoding="PCM_S", bits_per_sample=16)
-            ## Encode and Decode audio
-            opus_encoded_path = encode_opus(wav_path=temp_file_path,
-                                            tmp_folder=tmpdirname)
-            opus_decoded_path = decode_opus(opus_encoded_path=opus_encoded_path,
-                                            output_folder="./output/dirty_samples", count=str(i))
-
-            print(f"audio {opus_decoded_path} generated!")
-
-            # log parameters: file name
-            parameters_log["file_name"] = opus_decoded_path.split('/')[-1]
-            parameters_log["simulate_codec"] = "opus"
-
-        # Append parameters to experiment log
-        experiment_log.append(parameters_log)
-
-    # Export parameters log as json
-    # Use datetime module to serialise log file
-    now = datetime.now()
-    timestamp = now.strftime("%y%m%d_%H%M%S")
-
-    with open(os.path.join("./output", f"experiment_log_{timestamp}.json"), "w") as f:
-        json.dump(experiment_log, f, indent=2)
+                    handphone_ir_folder="./data/Impulse_Responses/handphone_IRs/",
+                    output_sink="loose",
+                    output_folder="./output",
+                    shard_size_mb=1024,
+                    dirty_format="wav",
+                    async_writers=2,
+                    async_queue=32,
+                    debug_dumps=False,
+                    debug_taps=None,
+                    speech_store=None,
+                    segment_seconds=None):
+    """
+    Arguments:
+    - str   output_sink     : "loose" for loose clean/dirty files, "tar" for tar shards (see src.output_sink)
+    - str   output_folder   : The folder which the samples and the experiment log are written to
+    - float shard_size_mb   : For "tar", the size at which shards roll over
+    - str   dirty_format    : "wav" to keep the decoded dirty audio, "opus" to keep the opus encoded audio instead
+    - int   async_writers   : The number of background threads writing files (see src.output_sink.AsyncWriter)
+                            : 0 writes everything synchronously
+    - int   async_queue     : The number of writes which may be waiting before the pipeline blocks
+    - bool  debug_dumps     : If True, writes the intermediates as test_<point>.wav (see src.debug_taps.WavFileTap)
+    - list  debug_taps      : Taps to register for this run (see src.debug_taps), e.g. [MemoryTap()]
+    - str   speech_store    : A speech store to read speech from instead of speech_folder (see src.speech_store)
+    - float segment_seconds : If given, only a random segment of this many seconds of each speech file is used
+                            : (its start is logged, for regeneration)
+    """
+    # The stages, their probabilities and ranges are declared in the pipeline config (see src.pipeline)
+    config = bulk_pipeline_config(speech_folder, room_ir_folder, noise_stationary_folder, noise_nonstationary_folder,
+                                  fabric_ir_folder, handphone_ir_folder,
+                                  output_sink=output_sink, output_folder=output_folder,
+                                  shard_size_mb=shard_size_mb, dirty_format=dirty_format,
+                                  speech_store=speech_store, segment_seconds=segment_seconds)
+
+    run_pipeline(config,
+                 number_of_audios=number_of_audios,
+                 debug_taps=debug_taps,
+                 debug_dumps=debug_dumps,
+                 async_writers=async_writers,
+                 async_queue=async_queue)
 
     return None
@@ -2,146 +2,76 @@
 # Add rng seed
 # Should probably allow for log output dir/name to be customised
 
-import json
-import random
-from datetime import datetime
+from src.pipeline import run_pipeline
+from src.pipeline import speech_noise_stages
 
-from src.audio_effects_new import audio_effector
-from src.audio_stacker import audio_noise_stack
-from src.utils.loader import load_audio_with_pytorch
-from src.ir_convolve import ir_convolve
-from src.noise_builder import noise_builder
-from src.phone_lowpass import phone_augment
-from src.post_convo_sizer import post_convo_sizer
+
+def simple_pipeline_config(speech_folder="./data/00_raw_speech/",
+                           room_ir_folder="./data/Impulse_Responses/room_IRs/",
+                           noise_stationary_folder="./data/01_stationary_noise/",
+                           noise_nonstationary_folder="./data/02_non-stationary_noise/",
+                           phone_channel_config=None,
+                           output_sink="loose",
+                           output_folder="./output",
+                           shard_size_mb=1024,
+                           speech_store=None,
+                           segment_seconds=None):
+    """
+    Returns the pipeline config (see src.pipeline) of simple bulk generation: stages III-A to III-D, then the phone channel.
+    """
+    return {"output": {"sink": output_sink, "folder": output_folder, "shard_size_mb": shard_size_mb},
+            "stages": speech_noise_stages(speech_folder, room_ir_folder, noise_stationary_folder, noise_nonstationary_folder,
+                                          speech_store=speech_store, segment_seconds=segment_seconds)
+                      + [{"stage": "phone", "channel": phone_channel_config}]}
 
 
 def bulk_generation_simple(number_of_audios=10,
                            speech_folder="./data/00_raw_speech/",
                            room_ir_folder="./data/Impulse_Responses/room_IRs/",
                            noise_stationary_folder="./data/01_stationary_noise/",
-                           noise_nonstationary_folder="./data/02_non-stationary_noise/"
+                           noise_nonstationary_folder="./data/02_non-stationary_noise/",
+                           phone_channel_config=None,
+                           output_sink="loose",
+                           output_folder="./output",
+                           shard_size_mb=1024,
+                           async_writers=2,
+                           async_queue=32,
+                           debug_dumps=False,
+                           debug_taps=None,
+                           speech_store=None,
+                           segment_seconds=None
                            ):
-    # Set up experiment log (for reproducibility)
-    experiment_log = []
-
-    for i in range(number_of_audios):
-        # (Re)set up parameters log for audio
-        parameters_log = {"serial":                i,
-                          "file_name":             None,
-                          "original_speech_file":  None,
-                          "sampling_rate":         None,
-                          "sample_len":            None,
-                          "generate_clean_speech": None,
-                          "add_room_reverb":       None,
-                          "stationary_noise":      None,
-                          "nonstationary_noise":   None,
-                          "combine_speech_noise":  None,
-                          "simulate_fabric":       None,
-                          "simulate_mobile":       None,
-                          "simulate_codec":        None,
-                          "phone_lowpass":         None}
-
-        ## Stage III-A: Generate Clean Speech
-        # Load random audio from raw speech folder
-        speech_file = random.choice(os.listdir(speech_folder))
-        sample_data, sr = load_audio_with_pytorch(os.path.join(speech_folder, speech_file))
-        # Implement efects on speech data (only tempo and pitch shift)
-        sample_data, sr, paras = audio_effector(sample_data,
-                                                tempo_change=True,
-                                                pitch_shift=True)
-
-        # Clean speech generated
-        torchaudio.save(f"./output/clean_samples/{i}.wav",
-                        src=sample_data,
-                        format="wav",
-                        encoding="PCM_S",
-                        sample_rate=sr,
-                        bits_per_sample=16)
-
-        # Log III-A Parameters:
-        parameters_log["original_speech_file"] = speech_file
-        parameters_log["sampling_rate"] = sr
-        parameters_log["sample_len"] = sample_data.shape[1]
-        parameters_log["generate_clean_speech"] = paras
-
-        torchaudio.save("test_preroom.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-B: Synthesising Speech with Room Reverberation 
-        # Convolve data with random room IR
-        sample_data, sr, size_orig, IR_applied, paras = ir_convolve(sample_data, sr,
-                                                                    mode="random_single",
-                                                                    ir_repo=room_ir_folder)
-
-        # Rightsize convolved data
-        sample_data = post_convo_sizer(audio_data=sample_data,
-                                       size_orig=size_orig,
-                                       convo_type="room",
-                                       IR_applied=IR_applied)
-
-        # Log III-B Parameters:
-        parameters_log["add_room_reverb"] = paras
-        torchaudio.save("test_postroom.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Stage III-C: Synthesising Noise
-        noise_stationary_data, sr, noise_stationary_paras = noise_builder(sample_data,
-                                                                          noise_stationary_folder,
-                                                                          echo=True,
-                                                                          no_of_audio=random.randint(1, 2),
-                                                                          low_pass=True,
-                                                                          mode="stationary")
-        noise_nonstationary_data, sr, noise_nonstationary_paras = noise_builder(sample_data,
-                                                                                noise_nonstationary_folder,
-                                                                                no_of_audio=random.randint(0, 2),
-                                                                                echo=True,
-                                                                                mode="non-stationary")
-
-        # Log III-C Parameters:
-        parameters_log["stationary_noise"] = noise_stationary_paras
-        parameters_log["nonstationary_noise"] = noise_nonstationary_paras
-
-        ## Stage III-D: Combining Speech and Noise
-        stationary_nonstationary_NNR = random.uniform(-5, 20)
-        speech_noise_SNR = random.uniform(-5, 20)
-
-        combined_noise_data = audio_noise_stack(noise_stationary_data,
-                                                noise_nonstationary_data,
-                                                stationary_nonstationary_NNR
-                                                )
-        sample_data = audio_noise_stack(sample_data,
-                                        combined_noise_data,
-                                        speech_noise_SNR
-                                        )
-
-        # Log III-D Parameters:
-        parameters_log["combine_speech_noise"] = {"stationary_nonstationary_NNR": stationary_nonstationary_NNR,
-                                                  "speech_noise_SNR":             speech_noise_SNR}
-
-        print(sample_data.shape)
-        print(type(sample_data))
-
-        torchaudio.save("test_postnoise.wav", sample_data, 16000, encoding="PCM_S", bits_per_sample=16)
-
-        ## Apply Low-Pass Filter to Simulate Fabric, Mobile, and Mobile Codec Encoding/Decoding
-        sample_data, sr = phone_augment(sample_data, sr)
-        print(sample_data.shape)
-        print(type(sample_data))
-
-        # Log phone_lowpass parameters
-        parameters_log["phone_lowpass"] = True
-
-        # Export file
-        torchaudio.save(os.path.join("./output/dirty_samples", f"phone_lowpass_sample_{i}.wav"),
-                        sample_data, sr, encoding="PCM_S", bits_per_sample=16)
-
-        # Append parameters to experiment log
-        experiment_log.append(parameters_log)
-
-    # Export parameters log as json
-    # Use datetime module to serialise log file
-    now = datetime.now()
-    timestamp = now.strftime("%y%m%d_%H%M%S")
-
-    with open(os.path.join("./output", f"experiment_log_{timestamp}.json"), "w") as f:
-        json.dump(experiment_log, f, indent=2)
+    """
+    Generates clean/dirty speech pairs, where the dirty speech is simulated with a telephone band-pass
+    instead of fabric, mobile and codec simulation.
+
+    Arguments:
+    - dict  phone_channel_config    : If None, the fixed 300-3400Hz phone_augment is applied
+                                    : Otherwise, the keyword arguments of src.phone_lowpass.phone_channel,
+                                    : e.g. {"narrowband": True, "companding": "random"}
+    - str   output_sink             : "loose" for loose clean/dirty files, "tar" for tar shards (see src.output_sink)
+    - str   output_folder           : The folder which the samples and the experiment log are written to
+    - float shard_size_mb           : For "tar", the size at which shards roll over
+    - int   async_writers           : The number of background threads writing files (see src.output_sink.AsyncWriter)
+                                    : 0 writes everything synchronously
+    - int   async_queue             : The number of writes which may be waiting before the pipeline blocks
+    - bool  debug_dumps             : If True, writes the intermediates as test_<point>.wav (see src.debug_taps.WavFileTap)
+    - list  debug_taps              : Taps to register for this run (see src.debug_taps), e.g. [MemoryTap()]
+    - str   speech_store            : A speech store to read speech from instead of speech_folder (see src.speech_store)
+    - float segment_seconds         : If given, only a random segment of this many seconds of each speech file is used
+                                    : (its start is logged, for regeneration)
+    """
+    # The stages, their probabilities and ranges are declared in the pipeline config (see src.pipeline)
+    config = simple_pipeline_config(speech_folder, room_ir_folder, noise_stationary_folder, noise_nonstationary_folder,
+                                    phone_channel_config=phone_channel_config,
+                                    output_sink=output_sink, output_folder=output_folder, shard_size_mb=shard_size_mb,
+                                    speech_store=speech_store, segment_seconds=segment_seconds)
+
+    run_pipeline(config,
+                 number_of_audios=number_of_audios,
+                 debug_taps=debug_taps,
+                 debug_dumps=debug_dumps,
+                 async_writers=async_writers,
+                 async_queue=async_queue)
 
     return None
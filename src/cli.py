@@ -0,0 +1,306 @@
+## AJS's FAST Command Line
+# This module is the command line entry point of the Far-Field Audio Synthesis Toolkit (FAST):
+#   python -m src.cli generate    : bulk generation of clean/dirty pairs (src.bulk_generation(_simple))
+#   python -m src.cli regenerate  : regeneration of a dataset from its experiment log (src.regenerate_dataset)
+#   python -m src.cli align       : time alignment of fabric recordings, or verification of clean/dirty pairs (src.time_alignment)
+#   python -m src.cli make-irs    : derivation of fabric IRs from aligned sweeps, or packing of an IR folder (src.ir_fr_generator, src.ir_archive)
+#   python -m src.cli energy-stats: energy statistics of noise/speech folders, for the "energy_stats" noise option (src.energy_stats)
+#   python -m src.cli bench       : import-time benchmark, guarding against import-time regressions
+
+# Short jobs (and every spawned worker) used to pay several seconds importing torch, torchaudio, scipy, librosa,
+# matplotlib, pyrubberband and the Opus/Ogg bindings, whether or not they were needed
+# This module therefore imports nothing heavy at the top; each subcommand imports what it needs when it runs,
+# and heavy dependencies within the pipeline (pyrubberband, the Opus/Ogg bindings, matplotlib) and the alignment and
+# IR tools (librosa) are imported on first use, so importing a module stays cheap (checked by `bench`)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules timed by the benchmark, and the modules each of them must NOT pull in at import time
+BENCH_MODULES = {"src.cli":                   ("numpy", "scipy", "torch", "torchaudio", "librosa", "matplotlib", "pyrubberband"),
+                 "src.output_sink":           ("torch", "torchaudio", "librosa", "matplotlib", "pyrubberband"),
+                 "src.debug_taps":            ("torch", "torchaudio", "librosa", "matplotlib", "pyrubberband"),
+                 "src.ir_archive":            ("torch", "librosa", "matplotlib"),
+                 "src.audio_index":           ("numpy", "torch", "soundfile"),
+                 "src.bulk_generation":       ("librosa", "matplotlib", "pyrubberband", "src.encoding_scripts.opus", "pyogg_encoder"),
+                 "src.bulk_generation_simple": ("librosa", "matplotlib", "pyrubberband", "src.encoding_scripts.opus", "pyogg_encoder"),
+                 "src.regenerate_dataset":    ("librosa", "matplotlib", "pyrubberband", "src.encoding_scripts.opus", "pyogg_encoder"),
+                 "src.pipeline":              ("librosa", "matplotlib", "pyrubberband", "yaml", "src.encoding_scripts.opus", "pyogg_encoder"),
+                 "src.time_alignment":        ("torch", "matplotlib", "librosa"),
+                 "src.ir_fr_generator":       ("torch", "matplotlib", "librosa")}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _generate(args):
+    if args.config:
+        from src.pipeline import run_pipeline
+        run_pipeline(args.config, number_of_audios=args.number, debug_dumps=args.debug_dumps)
+    elif args.simple:
+        from src.bulk_generation_simple import bulk_generation_simple
+        bulk_generation_simple(number_of_audios=args.number,
+                               speech_folder=args.speech_folder,
+                               room_ir_folder=args.room_ir_folder,
+                               noise_stationary_folder=args.noise_stationary_folder,
+                               noise_nonstationary_folder=args.noise_nonstationary_folder,
+                               output_sink=args.output_sink,
+                               output_folder=args.output_folder,
+                               shard_size_mb=args.shard_size_mb,
+                               debug_dumps=args.debug_dumps,
+                               speech_store=args.speech_store,
+                               segment_seconds=args.segment_seconds)
+    else:
+        from src.bulk_generation import bulk_generation
+        bulk_generation(number_of_audios=args.number,
+                        speech_folder=args.speech_folder,
+                        room_ir_folder=args.room_ir_folder,
+                        noise_stationary_folder=args.noise_stationary_folder,
+                        noise_nonstationary_folder=args.noise_nonstationary_folder,
+                        fabric_ir_folder=args.fabric_ir_folder,
+                        handphone_ir_folder=args.handphone_ir_folder,
+                        output_sink=args.output_sink,
+                        output_folder=args.output_folder,
+                        shard_size_mb=args.shard_size_mb,
+                        dirty_format=args.dirty_format,
+                        debug_dumps=args.debug_dumps,
+                        speech_store=args.speech_store,
+                        segment_seconds=args.segment_seconds)
+
+
+def _regenerate(args):
+    from src.regenerate_dataset import regenerate_dataset
+    regenerate_dataset(args.log_json,
+                       speech_folder=args.speech_folder,
+                       room_ir_folder=args.room_ir_folder,
+                       fabric_ir_folder=args.fabric_ir_folder,
+                       handphone_ir_folder=args.handphone_ir_folder,
+                       noise_stationary_folder=args.noise_stationary_folder,
+                       noise_nonstationary_folder=args.noise_nonstationary_folder,
+                       output_folder=args.output_folder,
+                       speech_store=args.speech_store)
+
+
+def _align(args):
+    if args.verify_pairs:
+        from src.time_alignment import verify_pair_alignment
+        _, misaligned, unmatched = verify_pair_alignment(clean_folder=args.clean_folder,
+                                                         dirty_folder=args.dirty_folder,
+                                                         log_path=args.log_path,
+                                                         shard_folder=args.shard_folder,
+                                                         tolerance_samples=args.tolerance_samples)
+        return 1 if misaligned or unmatched else 0
+
+    from src.time_alignment import time_aligner_batch
+    time_aligner_batch(reference_path=args.reference_path,
+                       input_folder=args.input_folder,
+                       output_folder=args.output_folder,
+                       hop_length=args.hop_length,
+                       coarse_hop_length=args.coarse_hop_length,
+                       workers=args.workers)
+
+
+def _make_irs(args):
+    if args.pack:
+        from src.ir_archive import pack_ir_folder
+        archive_path = args.archive_path or os.path.normpath(args.pack) + ".irpack"
+        archive = pack_ir_folder(args.pack, archive_path, sr=args.target_sr)
+        print(f"{len(archive['files'])} IRs packed into {archive_path}")
+        return
+
+    from src.ir_fr_generator import impulse_generator_batch
+    impulse_generator_batch(reference_path=args.reference_path,
+                            input_folder=args.input_folder,
+                            archive_path=args.archive_path or "./data/Impulse_Responses/fabric_IRs.irpack",
+                            target_sr=args.target_sr,
+                            workers=args.workers)
+
+
+def time_import(module, repeats=3):
+    """
+    Times the import of a module in fresh interpreters (so nothing is cached in sys.modules).
+
+    Arguments:
+    - str   module  : The module to import, e.g. "src.bulk_generation"
+    - int   repeats : The number of fresh interpreters; the fastest import is kept
+
+    Returns:
+    - dict with keys "seconds" (float, or None if the import failed), "modules" (list of modules loaded by the import)
+      and "error" (the last line of the error, if the import failed)
+    """
+    code = ("import json, sys, time\n"
+            "t = time.perf_counter()\n"
+            f"import {module}\n"
+            "t = time.perf_counter() - t\n"
+            "print(json.dumps({'seconds': t, 'modules': sorted(sys.modules)}))\n")
+
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+            return {"seconds": None, "modules": [], "error": error}
+        timing = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or timing["seconds"] < best["seconds"]:
+            best = timing
+
+    return best
+
+
+def import_benchmark(modules=None, baseline_path="./import_times.json", tolerance=1.5, update=False, repeats=3):
+    """
+    Benchmarks the import time of modules, and flags regressions:
+    (1) a module importing one of the heavy modules it must import lazily (see BENCH_MODULES)
+    (2) a module taking longer than tolerance x its baseline time (+50ms of slack) to import
+
+    Arguments:
+    - list  modules         : The modules to benchmark (defaults to all of BENCH_MODULES)
+    - str   baseline_path   : The json file of baseline import times
+    - float tolerance       : The ratio over the baseline beyond which an import counts as a regression
+    - bool  update          : If True, (over)writes the baseline with the times measured
+    - int   repeats         : The number of fresh interpreters per module (see time_import)
+
+    Returns:
+    - list of str describing each regression (empty if none)
+    """
+    modules = modules or list(BENCH_MODULES)
+    baseline = {}
+    if os.path.isfile(baseline_path) and not update:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+
+    regressions = []
+    times = {}
+    for module in modules:
+        timing = time_import(module, repeats=repeats)
+        if timing["seconds"] is None:
+            print(f"{module:<30} import failed: {timing['error']}")
+            regressions.append(f"{module} failed to import")
+            continue
+
+        times[module] = timing["seconds"]
+        print(f"{module:<30} {timing['seconds'] * 1000:8.1f} ms")
+
+        loaded = set(timing["modules"])
+        for heavy in BENCH_MODULES.get(module, ()):
+            if heavy in loaded:
+                regressions.append(f"{module} imports {heavy} at import time")
+
+        if module in baseline and timing["seconds"] > baseline[module] * tolerance + 0.05:
+            regressions.append(f"{module} imports in {timing['seconds']:.3f}s (baseline {baseline[module]:.3f}s)")
+
+    if update:
+        with open(baseline_path, "w") as f:
+            json.dump(times, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+
+    return regressions
+
+
+def _energy_stats(args):
+    from src.energy_stats import build_energy_stats
+    for folder in args.folders:
+        index = build_energy_stats(folder, sr=args.sr, frame_ms=args.frame_ms, refresh=args.refresh)
+        print(f"{len(index['files'])} files indexed in {folder}")
+
+
+def _bench(args):
+    regressions = import_benchmark(modules=args.modules,
+                                   baseline_path=args.baseline,
+                                   tolerance=args.tolerance,
+                                   update=args.update,
+                                   repeats=args.repeats)
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="fast", description="Far-Field Audio Synthesis Toolkit (FAST)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="Generate clean/dirty speech pairs")
+    generate.add_argument("--number", type=int, default=10, help="The number of pairs to generate")
+    generate.add_argument("--simple", action="store_true", help="Simulate a telephone band-pass instead of fabric, mobile and codec")
+    generate.add_argument("--config", type=str, default=None,
+                          help="Run the pipeline declared in this YAML/JSON config (see src.pipeline) instead")
+    generate.add_argument("--speech_folder", type=str, default="./data/00_raw_speech/")
+    generate.add_argument("--room_ir_folder", type=str, default="./data/Impulse_Responses/room_IRs/")
+    generate.add_argument("--noise_stationary_folder", type=str, default="./data/01_stationary_noise/")
+    generate.add_argument("--noise_nonstationary_folder", type=str, default="./data/02_non-stationary_noise/")
+    generate.add_argument("--fabric_ir_folder", type=str, default="./data/Impulse_Responses/fabric_IRs/")
+    generate.add_argument("--handphone_ir_folder", type=str, default="./data/Impulse_Responses/handphone_IRs/")
+    generate.add_argument("--output_sink", type=str, default="loose", choices=["loose", "tar"])
+    generate.add_argument("--output_folder", type=str, default="./output")
+    generate.add_argument("--shard_size_mb", type=float, default=1024)
+    generate.add_argument("--dirty_format", type=str, default="wav", choices=["wav", "opus"])
+    generate.add_argument("--debug_dumps", action="store_true", help="Write the intermediates as test_<point>.wav")
+    generate.add_argument("--speech_store", type=str, default=None, help="Read speech from this speech store (see src.speech_store)")
+    generate.add_argument("--segment_seconds", type=float, default=None, help="Use a random segment of this length of each speech file")
+    generate.set_defaults(handler=_generate)
+
+    regenerate = subparsers.add_parser("regenerate", help="Regenerate a dataset from its experiment log")
+    regenerate.add_argument("log_json", type=str, help="The experiment log of the dataset")
+    regenerate.add_argument("--speech_folder", type=str, default="./data/00_raw_speech/")
+    regenerate.add_argument("--room_ir_folder", type=str, default="./data/Impulse_Responses/room_IRs/")
+    regenerate.add_argument("--fabric_ir_folder", type=str, default="./data/Impulse_Responses/fabric_IRs/")
+    regenerate.add_argument("--handphone_ir_folder", type=str, default="./data/Impulse_Responses/handphone_IRs/")
+    regenerate.add_argument("--noise_stationary_folder", type=str, default="./data/01_stationary_noise/")
+    regenerate.add_argument("--noise_nonstationary_folder", type=str, default="./data/02_non-stationary_noise/")
+    regenerate.add_argument("--output_folder", type=str, default="./output/regenerated_samples")
+    regenerate.add_argument("--speech_store", type=str, default=None, help="Read speech from this speech store (see src.speech_store)")
+    regenerate.set_defaults(handler=_regenerate)
+
+    align = subparsers.add_parser("align", help="Time-align fabric recordings, or verify the alignment of clean/dirty pairs")
+    align.add_argument("--reference_path", type=str, default="./data/fabric_experiment/references/0Clean_0deg_NoCover_aligned.wav")
+    align.add_argument("--input_folder", type=str, default="./data/fabric_experiment/run2_recording")
+    align.add_argument("--output_folder", type=str, default="./data/fabric_experiment/aligned_run2_recordings")
+    align.add_argument("--hop_length", type=int, default=32)
+    align.add_argument("--coarse_hop_length", type=int, default=512)
+    align.add_argument("--workers", type=int, default=None)
+    align.add_argument("--verify_pairs", action="store_true", help="Verify generated clean/dirty pairs instead")
+    align.add_argument("--clean_folder", type=str, default="./output/clean_samples")
+    align.add_argument("--dirty_folder", type=str, default="./output/dirty_samples")
+    align.add_argument("--log_path", type=str, default=None, help="Pair clips by the file names in this experiment log")
+    align.add_argument("--shard_folder", type=str, default=None, help="Verify the pairs of these tar shards instead")
+    align.add_argument("--tolerance_samples", type=float, default=1.0)
+    align.set_defaults(handler=_align)
+
+    make_irs = subparsers.add_parser("make-irs", help="Derive fabric IRs from aligned sweeps into an IR archive")
+    make_irs.add_argument("--reference_path", type=str,
+                          default="./data/fabric_experiment/aligned_run2_recordings/ref_trimmed_0Clean_0deg_NoCover_aligned.wav")
+    make_irs.add_argument("--input_folder", type=str, default="./data/fabric_experiment/aligned_run2_recordings/")
+    make_irs.add_argument("--archive_path", type=str, default=None)
+    make_irs.add_argument("--target_sr", type=int, default=16000)
+    make_irs.add_argument("--workers", type=int, default=None)
+    make_irs.add_argument("--pack", type=str, default=None, help="Pack this folder of .npy IRs into an IR archive instead")
+    make_irs.set_defaults(handler=_make_irs)
+
+    energy_stats = subparsers.add_parser("energy-stats", help="Build (or refresh) the energy statistics of noise/speech folders")
+    energy_stats.add_argument("folders", type=str, nargs="+")
+    energy_stats.add_argument("--sr", type=int, default=16000)
+    energy_stats.add_argument("--frame_ms", type=int, default=10)
+    energy_stats.add_argument("--refresh", action="store_true", help="Decode every file again")
+    energy_stats.set_defaults(handler=_energy_stats)
+
+    bench = subparsers.add_parser("bench", help="Benchmark import times and flag regressions")
+    bench.add_argument("--modules", type=str, nargs="*", default=None)
+    bench.add_argument("--baseline", type=str, default="./import_times.json")
+    bench.add_argument("--tolerance", type=float, default=1.5)
+    bench.add_argument("--update", action="store_true", help="(Over)write the baseline with the times measured")
+    bench.add_argument("--repeats", type=int, default=3)
+    bench.set_defaults(handler=_bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
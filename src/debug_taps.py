@@ -0,0 +1,131 @@
+## AJS's Debug Taps
+# This module lets the stages of the pipeline emit their intermediate audio to registered taps, for inspection
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# src.bulk_generation used to write test_preroom.wav, test_postroom.wav, test_postnoise.wav, test_postfabric.wav
+# and test_postmobile.wav for every item (overwriting them every time), i.e. 5 wasted encodes and writes per clip
+# Stages now call emit(point, item, audio_data, sr) instead, which does nothing at all unless a tap is registered
+# A tap is any callable tap(point, item, audio_data, sr); those provided are:
+# (1) WavFileTap  : writes the intermediates as wav files (by default, as the test_*.wav files of old)
+# (2) EveryNthTap : passes on every nth item to another tap
+# (3) SampledTap  : passes on a random fraction of items to another tap (without touching the global RNG,
+#                 : so generation stays reproducible whether or not taps are registered)
+# (4) MemoryTap   : keeps the intermediates in memory, e.g. for tests or notebooks
+
+import os
+import random
+
+from src.output_sink import save_debug_wav
+
+# Points emitted by src.bulk_generation and src.bulk_generation_simple, in order
+TAP_POINTS = ("preroom", "postroom", "postnoise", "postfabric", "postmobile")
+
+_taps = []
+
+
+def register_tap(tap):
+    """
+    Registers a tap, i.e. a callable tap(point, item, audio_data, sr), to receive every emitted intermediate.
+
+    Returns:
+    - the tap, for convenience
+    """
+    _taps.append(tap)
+    return tap
+
+
+def unregister_tap(tap):
+    if tap in _taps:
+        _taps.remove(tap)
+
+
+def clear_taps():
+    _taps.clear()
+
+
+def emit(point, item, audio_data, sr):
+    """
+    Emits an intermediate to the registered taps; free when there are none.
+
+    Arguments:
+    - str           point       : The point of the pipeline, e.g. "postroom" (see TAP_POINTS)
+    - int           item        : The serial number of the item being generated
+    - torch tensor  audio_data  : The intermediate audio, of dimension (1, n_samples); taps must not modify it
+    - int           sr          : The sampling rate of the audio
+    """
+    if not _taps:
+        return
+    for tap in _taps:
+        tap(point, item, audio_data, sr)
+
+
+class WavFileTap:
+    """
+    Writes intermediates as wav files into folder, named by file_name (formatted with point and item).
+    The default file_name overwrites test_<point>.wav for every item, as bulk generation used to do.
+
+    Arguments:
+    - str           folder      : The folder which the files are written to
+    - str           file_name   : e.g. "test_{point}.wav", or "{item}_{point}.wav" to keep every item
+    - tuple         points      : Only these points are written (all points if None)
+    - AsyncWriter   writer      : If given, files are written in the background (see src.output_sink)
+    """
+
+    def __init__(self, folder=".", file_name="test_{point}.wav", points=None, writer=None):
+        self.folder = folder
+        self.file_name = file_name
+        self.points = points
+        self.writer = writer
+        os.makedirs(folder, exist_ok=True)
+
+    def __call__(self, point, item, audio_data, sr):
+        if self.points is not None and point not in self.points:
+            return
+        path = os.path.join(self.folder, self.file_name.format(point=point, item=item))
+        save_debug_wav(self.writer, path, audio_data, sr)
+
+
+class EveryNthTap:
+    """
+    Passes on the intermediates of every nth item (items 0, n, 2n, ...) to tap.
+    """
+
+    def __init__(self, tap, n=100):
+        self.tap = tap
+        self.n = n
+
+    def __call__(self, point, item, audio_data, sr):
+        if item % self.n == 0:
+            self.tap(point, item, audio_data, sr)
+
+
+class SampledTap:
+    """
+    Passes on the intermediates of a random fraction of items to tap.
+    Items are drawn from their own RNG seeded on (seed, item), so all points of a drawn item are passed on,
+    and the draws do not disturb the global RNG used for generation.
+    """
+
+    def __init__(self, tap, fraction=0.01, seed=0):
+        self.tap = tap
+        self.fraction = fraction
+        self.seed = seed
+
+    def __call__(self, point, item, audio_data, sr):
+        if random.Random(f"{self.seed}-{item}").random() < self.fraction:
+            self.tap(point, item, audio_data, sr)
+
+
+class MemoryTap:
+    """
+    Keeps copies of intermediates in memory, in captured, keyed on (item, point), with their sampling rates.
+    """
+
+    def __init__(self, points=None):
+        self.points = points
+        self.captured = {}
+
+    def __call__(self, point, item, audio_data, sr):
+        if self.points is not None and point not in self.points:
+            return
+        self.captured[(item, point)] = (audio_data.detach().clone(), sr)
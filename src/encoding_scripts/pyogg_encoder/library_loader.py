@@ -1,5 +1,6 @@
 import ctypes
 import ctypes.util
+import json
 import logging
 import os
 import platform
@@ -46,13 +47,129 @@ elif platform_ == "Windows":
         lib_dir = "libs/win_amd64"
 
 
+# FAST: Probing for a library (many file name styles, each through ctypes.util.find_library, which may spawn
+# ldconfig/gcc) is slow, and every process loading the codec (e.g. spawned workers) paid for it
+# The path found is therefore cached on disk, per environment (Python prefix, platform and architecture),
+# in $PYOGG_LIBRARY_CACHE (defaults to ~/.cache/fast/pyogg_libraries.json); a stale entry is simply probed again
+_CACHE_KEY = f"{sys.prefix}|{platform.system()}|{architecture}"
+
+
+def _library_cache_path() -> str:
+    return os.environ.get("PYOGG_LIBRARY_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "fast", "pyogg_libraries.json"))
+
+
+def _read_library_cache() -> Dict[str, Dict[str, str]]:
+    try:
+        with open(_library_cache_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _cached_library(name: str, tests) -> Optional[ctypes.CDLL]:
+    path = _read_library_cache().get(_CACHE_KEY, {}).get(name)
+    if path is None:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+    if tests and not all(run_tests(lib, tests)):
+        return None
+    return lib
+
+
+def _remember_library(name: str, path: str) -> None:
+    cache = _read_library_cache()
+    cache.setdefault(_CACHE_KEY, {})[name] = path
+    cache_path = _library_cache_path()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write aside and rename, as several processes may be loading the codec at once
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        logging.warning(f"[FAST DEBUG] Could not cache the path of library '{name}' in {cache_path}")
+
+
+class _LazySymbol:
+    """
+    FAST: Stands in for a function of a LazyLibrary until it is first called.
+    Assigning restype/argtypes only records them; the prototype is set on the bound function on the first call.
+    """
+
+    def __init__(self, library: "LazyLibrary", name: str):
+        self._library = library
+        self._name = name
+        self._prototype = {}
+
+    def __setattr__(self, attribute, value):
+        if attribute in ("restype", "argtypes", "errcheck"):
+            self._prototype[attribute] = value
+        else:
+            object.__setattr__(self, attribute, value)
+
+    def __getattr__(self, attribute):
+        if attribute in ("restype", "argtypes", "errcheck") and attribute in self._prototype:
+            return self._prototype[attribute]
+        return getattr(self._resolve(), attribute)
+
+    def _resolve(self):
+        function = getattr(self._library._lib, self._name)
+        for attribute, value in self._prototype.items():
+            setattr(function, attribute, value)
+        # From now on, the library hands out the bound function directly
+        self._library.__dict__[self._name] = function
+        return function
+
+    def __call__(self, *args):
+        return self._resolve()(*args)
+
+
+class LazyLibrary:
+    """
+    FAST: Wraps a loaded library, so that the hundreds of prototypes declared by ogg.py and opus.py at import
+    are only bound (per symbol) when a function is first called.
+    Symbols are still checked for at attribute access, so that a missing (optional) symbol raises AttributeError
+    there, as with a plain ctypes.CDLL; ogg.py and opus.py rely on this to skip functions of older libraries.
+    """
+
+    def __init__(self, lib: ctypes.CDLL):
+        self._lib = lib
+
+    def has_symbol(self, name: str) -> bool:
+        """
+        Returns True if the library exports the function name (a dlsym lookup; no prototype is bound).
+        """
+        return hasattr(self._lib, name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            return getattr(self._lib, name)
+        if not self.has_symbol(name):
+            raise AttributeError(f"{self._lib._name}: undefined symbol: {name}")
+        symbol = _LazySymbol(self, name)
+        self.__dict__[name] = symbol
+        return symbol
+
+    def __repr__(self):
+        return f"<LazyLibrary {self._lib!r}>"
+
+
 class Library:
     @staticmethod
-    def load(names: Dict[str, str], paths: Optional[List[str]] = None, tests=[]) -> Optional[ctypes.CDLL]:
-        lib = InternalLibrary.load(names, tests)
+    def load(names: Dict[str, str], paths: Optional[List[str]] = None, tests=[]) -> Optional[LazyLibrary]:
+        lib = _cached_library(names["external"], tests)
         if lib is None:
-            lib = ExternalLibrary.load(names["external"], paths, tests)
-        return lib
+            lib = InternalLibrary.load(names, tests)
+            if lib is None:
+                lib = ExternalLibrary.load(names["external"], paths, tests)
+            if lib is not None:
+                _remember_library(names["external"], lib._name)
+        return LazyLibrary(lib) if lib is not None else None
 
 
 class InternalLibrary:
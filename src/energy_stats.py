@@ -0,0 +1,223 @@
+## AJS's Energy Bookkeeper
+# This module precomputes energy statistics of audio clips, so that SNR/NNR scaling does not need a full pass
+# over every looped or padded noise clip (which is what torchaudio.functional.add_noise does on every call)
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# The same noise (and speech) files are reused again and again during bulk generation
+# An index of per-file statistics is therefore built once and stored alongside the audio folder:
+# (1) energy_stats.json : per valid audio file (see src.audio_index), its energy, RMS and active level
+# (2) energy_stats.npz  : per valid audio file, prefix sums of energy at frame resolution
+# The index is refreshed incrementally: only files which are new, or whose mtime or size changed, are decoded again
+
+# The energy of a noise after noise_sizer can then be worked out from the prefix sums:
+# (A) stationary (looped) noise    : q * E(full clip) + E(first r samples), where n_ref = q * n_clip + r
+# (B) non-stationary (padded) noise: E(first n_ref - pad_size samples), since the padding is all zeros
+# Within a frame, the prefix sums are interpolated, so these energies are close to (but not exactly) those of the
+# sized noise; they are therefore logged with the noise, and replay reuses the logged energies (see src.noise_builder)
+# Only noises which no effect has altered can be looked up; effects (echo, low-pass) change the energy
+
+# The active level (a simplified ITU-T P.56: the mean power over frames within dynamic_range_db of the loudest one)
+# gives a more meaningful NNR/SNR for sparse non-stationary noises than the mean power over the whole clip
+
+import json
+import os
+
+import numpy as np
+
+from src.audio_index import list_audio
+from src.utils.loader import load_audio_with_pytorch
+
+STATS_JSON = "energy_stats.json"
+STATS_NPZ = "energy_stats.npz"
+
+
+def energy_prefix(audio_data, frame_len=1):
+    """
+    Computes the prefix sums of energy of an audio clip (first channel), i.e. cumulative sum of squared samples.
+
+    Arguments:
+    - torch tensor  audio_data  : The audio data, of dimension (1, n_samples)
+    - int           frame_len   : The resolution of the prefix sums, in samples
+                                : 1 keeps every sample (exact), larger values keep 1 value per frame (for the index)
+
+    Returns:
+    - tuple of 2 numpy arrays (positions, cumulative energy), both starting at 0 and ending at n_samples
+    """
+    audio_np = np.asarray(audio_data[0], dtype=np.float64)
+    cumulative = np.concatenate(([0.0], np.cumsum(audio_np ** 2)))
+
+    positions = np.arange(0, len(audio_np) + 1, frame_len)
+    if positions[-1] != len(audio_np):
+        positions = np.append(positions, len(audio_np))
+
+    return positions, cumulative[positions]
+
+
+def prefix_energy(prefix, n_samples):
+    """
+    Returns the energy of the first n_samples of a clip, given its prefix sums.
+    Exact when the prefix sums are kept per sample; linearly interpolated within a frame otherwise.
+    """
+    positions, cumulative = prefix
+    return float(np.interp(n_samples, positions, cumulative))
+
+
+def active_level(audio_data, sr=16000, frame_ms=10, dynamic_range_db=40):
+    """
+    Estimates the active level of an audio clip, i.e. the mean power over frames which are not (near) silent:
+    frames quieter than dynamic_range_db below the loudest frame are treated as inactive.
+
+    Arguments:
+    - torch tensor  audio_data          : The audio data, of dimension (1, n_samples)
+    - int           sr                  : The sampling rate of audio_data
+    - int           frame_ms            : The frame size used to decide on activity, in milliseconds
+    - float         dynamic_range_db    : Frames quieter than this (relative to the loudest frame) are inactive
+
+    Returns:
+    - tuple (active power (float), fraction of frames that are active (float))
+    """
+    frame_len = max(1, int(sr * frame_ms / 1000))
+    audio_np = np.asarray(audio_data[0], dtype=np.float64)
+    n_frames = len(audio_np) // frame_len
+    if n_frames == 0:
+        power = float(np.mean(audio_np ** 2)) if len(audio_np) else 0.0
+        return power, 1.0
+
+    frame_power = np.mean(audio_np[:n_frames * frame_len].reshape(n_frames, frame_len) ** 2, axis=1)
+    threshold = np.max(frame_power) * 10 ** (-dynamic_range_db / 10)
+    active = frame_power > threshold
+    if not np.any(active):
+        return 0.0, 0.0
+
+    return float(np.mean(frame_power[active])), float(np.mean(active))
+
+
+def build_energy_stats(audio_repo, sr=16000, frame_ms=10, refresh=False):
+    """
+    Builds (or incrementally refreshes) the energy statistics index of a folder of audio files,
+    and stores it alongside the audio files as energy_stats.json and energy_stats.npz (if the folder is writable).
+
+    Arguments:
+    - str   audio_repo  : The folder containing the audio files, e.g. a noise or a speech folder
+    - int   sr          : The "enforced" sampling rate; statistics are computed after resampling to this rate
+                        : (as src.utils.loader.load_audio_with_pytorch does for the pipeline)
+    - int   frame_ms    : The resolution of the prefix sums of energy (and of the active level), in milliseconds
+    - bool  refresh     : If True, every file is decoded again
+
+    Returns:
+    - dict with keys "sampling_rate", "frame_ms", "files" (per-file statistics) and "prefix" (per-file prefix sums)
+    """
+    previous = None if refresh else load_energy_stats(audio_repo)
+    if previous is None or previous["sampling_rate"] != sr or previous["frame_ms"] != frame_ms:
+        previous = {"files": {}, "prefix": {}}
+
+    frame_len = max(1, int(sr * frame_ms / 1000))
+    index = {"sampling_rate": sr, "frame_ms": frame_ms, "files": {}, "prefix": {}}
+    changed = False
+
+    for audio in list_audio(audio_repo):
+        stat = os.stat(os.path.join(audio_repo, audio))
+
+        # Reuse the statistics of files which have not changed
+        known = previous["files"].get(audio)
+        if (known is not None and known["mtime"] == stat.st_mtime and known["size"] == stat.st_size
+                and audio in previous["prefix"]):
+            index["files"][audio] = known
+            index["prefix"][audio] = previous["prefix"][audio]
+            continue
+
+        changed = True
+        audio_data, _ = load_audio_with_pytorch(os.path.join(audio_repo, audio), target_freq=sr)
+        prefix = energy_prefix(audio_data, frame_len=frame_len)
+        energy = float(prefix[1][-1])
+        n_samples = audio_data.shape[1]
+        power_active, active_ratio = active_level(audio_data, sr=sr, frame_ms=frame_ms)
+
+        index["files"][audio] = {"size":         stat.st_size,
+                                 "mtime":        stat.st_mtime,
+                                 "n_samples":    n_samples,
+                                 "energy":       energy,
+                                 "rms":          float(np.sqrt(energy / max(n_samples, 1))),
+                                 "active_rms":   float(np.sqrt(power_active)),
+                                 "active_ratio": active_ratio}
+        index["prefix"][audio] = prefix
+
+    # Files which were removed also change the index
+    changed = changed or set(index["files"]) != set(previous["files"])
+    if changed:
+        try:
+            # Export index: scalars into json, prefix sums into npz
+            np.savez(os.path.join(audio_repo, STATS_NPZ),
+                     **{f"{audio}::positions": prefix[0] for audio, prefix in index["prefix"].items()},
+                     **{f"{audio}::cumulative": prefix[1] for audio, prefix in index["prefix"].items()})
+            with open(os.path.join(audio_repo, STATS_JSON), "w") as f:
+                json.dump({key: index[key] for key in ("sampling_rate", "frame_ms", "files")}, f, indent=2)
+        except OSError:
+            # A read-only folder is indexed all the same; the index just lives for the session
+            pass
+
+    return index
+
+
+def load_energy_stats(audio_repo):
+    """
+    Loads the energy statistics index stored alongside a folder of audio files (see build_energy_stats).
+
+    Returns:
+    - dict with keys "sampling_rate", "frame_ms", "files" (per-file statistics) and "prefix" (per-file prefix sums),
+      or None if no index has been built for this folder
+    """
+    json_path = os.path.join(audio_repo, STATS_JSON)
+    npz_path = os.path.join(audio_repo, STATS_NPZ)
+    if not (os.path.isfile(json_path) and os.path.isfile(npz_path)):
+        return None
+
+    with open(json_path, "r") as f:
+        index = json.load(f)
+
+    with np.load(npz_path) as npz:
+        index["prefix"] = {audio: (npz[f"{audio}::positions"], npz[f"{audio}::cumulative"])
+                           for audio in index["files"]
+                           if f"{audio}::positions" in npz.files}
+
+    return index
+
+
+def sized_noise_energy(stats_index, noise, n_ref, mode="stationary", pad_size=None, level="mean"):
+    """
+    Looks up the energy of a noise after it is sized by src.noise_sizer, without a pass over the sized noise.
+
+    Arguments:
+    - dict      stats_index : The energy statistics index of the noise folder (see build_energy_stats)
+    - str       noise       : The file name of the noise
+    - int       n_ref       : The size of the reference audio which the noise is sized against
+    - str       mode        : "stationary" (looped or truncated) or "non-stationary" (padded and truncated)
+    - int       pad_size    : For "non-stationary" mode, the number of leading zeros inserted ahead of the noise
+    - str       level       : "mean" (the energy of the sized noise) or "active" (the energy the sized noise would have,
+                            : were it as loud as its active level throughout), for an active-level NNR/SNR
+
+    Returns:
+    - float energy of the sized noise, or None if the noise is not in the index
+    """
+    if noise not in stats_index["prefix"]:
+        return None
+
+    if level == "active":
+        return stats_index["files"][noise]["active_rms"] ** 2 * n_ref
+    if level != "mean":
+        raise ValueError("Please indicate a valid level: 'mean' or 'active'")
+
+    prefix = stats_index["prefix"][noise]
+    n_source = int(prefix[0][-1])
+
+    if mode == "stationary":
+        if n_source >= n_ref:
+            return prefix_energy(prefix, n_ref)
+        loops, remainder = divmod(n_ref, n_source)
+        return loops * float(prefix[1][-1]) + prefix_energy(prefix, remainder)
+
+    if mode == "non-stationary":
+        samples_kept = max(0, min(n_source, n_ref - pad_size))
+        return prefix_energy(prefix, samples_kept)
+
+    raise ValueError("Please indicate a valid mode: 'stationary' or 'non-stationary'")
@@ -0,0 +1,274 @@
+## AJS's IR Archiver
+# This module packs a folder of IRs (1 .npy file per IR) into a single IR archive, and reads IRs back from it
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# Room, fabric and handphone IRs are stored as hundreds (or thousands) of tiny .npy files,
+# e.g. Room007-00001.wav.npy or ir_10BJ_0deg_aligned_smooth.npy, which every consumer lists and opens 1 by 1
+# An IR archive is a folder holding:
+# (1) ir_data.npy       : all IRs, as float32, concatenated into 1 flat array (memory-mapped when read)
+# (2) ir_metadata.json  : per-IR offset and length into ir_data.npy,
+#                       : plus kind, source, fabric code, angle, peak indices (argmax and robust envelope), energy and T60
+# IRs keep their original file names as keys, so experiment logs read the same whether IRs came from a folder or an archive
+
+# Functions taking an ir_repo (e.g. src.ir_convolve.ir_convolve) accept either a folder of .npy files,
+# the path of an IR archive, or an archive already opened with load_ir_archive
+
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from src.ir_interpolation import get_robust_peak_index
+
+IR_DATA = "ir_data.npy"
+IR_METADATA = "ir_metadata.json"
+
+# Peaks of IRs (and mixes of IRs) which are not in an archive's metadata, worked out once per session
+_peak_cache = {}
+
+
+def estimate_t60(ir, sr=16000):
+    """
+    Estimates the T60 of an IR from its Schroeder backward-integrated energy decay curve,
+    by extrapolating the decay between -5dB and -25dB (i.e. T20 * 3).
+
+    Returns:
+    - float T60 in seconds, or None if the IR does not decay by 25dB
+    """
+    energy = np.asarray(ir, dtype=np.float64) ** 2
+    decay = np.cumsum(energy[::-1])[::-1]
+    if decay[0] <= 0:
+        return None
+    decay_db = 10 * np.log10(np.maximum(decay / decay[0], 1e-30))
+
+    start = np.argmax(decay_db <= -5)
+    end = np.argmax(decay_db <= -25)
+    if decay_db[end] > -25 or end <= start:
+        return None
+
+    return float(3 * (end - start) / sr)
+
+
+def peak_indices(ir):
+    """
+    Locates the peak of an IR in 2 ways:
+    (1) the simple peak, i.e. the sample of highest magnitude, as used by src.post_convo_sizer
+    (2) the robust peak, i.e. the peak of the smoothed Hilbert envelope, as used by src.ir_interpolation
+
+    Returns:
+    - tuple (peak index (int), robust peak index (int))
+    """
+    return int(np.argmax(np.abs(ir))), int(get_robust_peak_index(ir))
+
+
+def describe_ir(file_name):
+    """
+    Works out the kind, source, fabric code and angle of an IR from its file name, where the naming allows:
+    - room IRs      : "Room007-00001.wav.npy"             >> kind "room", source "Room007"
+    - fabric IRs    : "ir_10BJ_0deg_aligned_smooth.npy"    >> kind "fabric", fabric "10BJ", angle 0
+    - handphone IRs : "IR_huawei_nova_9.npy"               >> kind "handphone", source "huawei_nova_9"
+
+    Returns:
+    - dict with keys "kind", "source", "fabric" and "angle" (None where unknown)
+    """
+    description = {"kind": None, "source": None, "fabric": None, "angle": None}
+    stem = file_name[:-4] if file_name.endswith(".npy") else file_name
+
+    room = re.match(r"(Room\d+)-", stem)
+    fabric = re.match(r"ir_([0-9A-Za-z]+)_(\d+)deg", stem)
+    if room:
+        description["kind"] = "room"
+        description["source"] = room.group(1)
+    elif fabric:
+        description["kind"] = "fabric"
+        description["fabric"] = fabric.group(1)
+        description["angle"] = int(fabric.group(2))
+    elif stem.startswith("IR_"):
+        description["kind"] = "handphone"
+        description["source"] = stem[3:]
+
+    return description
+
+
+def write_ir_archive(irs, archive_path, sr=16000):
+    """
+    Writes IRs into an IR archive, working out their metadata on the way.
+
+    Arguments:
+    - dict  irs             : IRs (1-D numpy arrays) keyed by name, e.g. {"ir_10BJ_0deg_aligned_smooth.npy": ir}
+    - str   archive_path    : The folder which the archive will be written to
+    - int   sr              : The sampling rate of the IRs; used for T60 estimation
+
+    Returns:
+    - dict archive, as returned by load_ir_archive
+    """
+    names = sorted(irs)
+    irs = [np.asarray(np.squeeze(irs[name]), dtype=np.float32) for name in names]
+
+    files = {}
+    offset = 0
+    for name, ir in zip(names, irs):
+        peak_index, robust_peak_index = peak_indices(ir)
+        files[name] = {"offset":            offset,
+                       "length":            len(ir),
+                       **describe_ir(name),
+                       "peak_index":        peak_index,
+                       "robust_peak_index": robust_peak_index,
+                       "energy":            float(np.sum(ir.astype(np.float64) ** 2)),
+                       "t60":               estimate_t60(ir, sr=sr)}
+        offset += len(ir)
+
+    if not os.path.isdir(archive_path):
+        os.makedirs(archive_path)
+
+    data = np.concatenate(irs) if irs else np.zeros(0, dtype=np.float32)
+    np.save(os.path.join(archive_path, IR_DATA), data)
+    with open(os.path.join(archive_path, IR_METADATA), "w") as f:
+        json.dump({"sampling_rate": sr, "files": files}, f, indent=2)
+
+    # Drop any stale handle of a previous archive at the same path
+    _open_ir_archive.cache_clear()
+
+    return load_ir_archive(archive_path)
+
+
+def pack_ir_folder(ir_repo, archive_path, sr=16000):
+    """
+    Converts a folder of IRs (1 .npy file per IR) into an IR archive.
+
+    Arguments:
+    - str   ir_repo         : The folder containing the IRs, e.g. "./data/Impulse_Responses/room_IRs/"
+    - str   archive_path    : The folder which the archive will be written to, e.g. "./data/Impulse_Responses/room_IRs.irpack"
+    - int   sr              : The sampling rate of the IRs; used for T60 estimation
+
+    Returns:
+    - dict archive, as returned by load_ir_archive
+    """
+    irs = {name: np.load(os.path.join(ir_repo, name)) for name in os.listdir(ir_repo) if name.endswith(".npy")}
+    return write_ir_archive(irs, archive_path, sr=sr)
+
+
+def is_ir_archive(ir_repo):
+    """
+    Returns True if ir_repo is an IR archive (opened, or the path of one), False if it is a plain folder.
+    """
+    if isinstance(ir_repo, dict):
+        return True
+    return os.path.isfile(os.path.join(ir_repo, IR_METADATA)) and os.path.isfile(os.path.join(ir_repo, IR_DATA))
+
+
+@lru_cache(maxsize=16)
+def _open_ir_archive(archive_path):
+    with open(os.path.join(archive_path, IR_METADATA), "r") as f:
+        archive = json.load(f)
+    # Memory-map the data; nothing is read from disk until an IR is sliced out
+    archive["data"] = np.load(os.path.join(archive_path, IR_DATA), mmap_mode="r")
+    archive["path"] = archive_path
+    return archive
+
+
+def load_ir_archive(archive_path):
+    """
+    Opens an IR archive. The IR data is memory-mapped, so this is O(1) in the number and size of IRs,
+    and handles are cached, so reopening the same archive is free.
+
+    Returns:
+    - dict with keys "sampling_rate", "files" (per-IR metadata), "data" (memory-mapped float32 array) and "path"
+    """
+    return _open_ir_archive(os.path.abspath(archive_path))
+
+
+def _as_archive(ir_repo):
+    return ir_repo if isinstance(ir_repo, dict) else load_ir_archive(ir_repo)
+
+
+def list_irs(ir_repo):
+    """
+    Lists the names of the IRs in a folder (its .npy files, as packed by pack_ir_folder) or an IR archive.
+    """
+    if is_ir_archive(ir_repo):
+        return list(_as_archive(ir_repo)["files"])
+    return [name for name in os.listdir(ir_repo) if name.endswith(".npy")]
+
+
+def has_ir(ir_repo, name):
+    """
+    Returns True if the IR called name is in a folder or an IR archive.
+    """
+    if is_ir_archive(ir_repo):
+        return name in _as_archive(ir_repo)["files"]
+    return os.path.isfile(os.path.join(ir_repo, name))
+
+
+def load_ir(ir_repo, name):
+    """
+    Reads the IR called name from a folder or an IR archive.
+    From an archive, this returns a read-only float32 view into the memory-mapped data.
+    """
+    if is_ir_archive(ir_repo):
+        archive = _as_archive(ir_repo)
+        entry = archive["files"][name]
+        return archive["data"][entry["offset"]:entry["offset"] + entry["length"]]
+    return np.load(os.path.join(ir_repo, name))
+
+
+def ir_peak_index(ir_repo, names, ir=None, mix_method="time"):
+    """
+    Returns the (simple) peak index of an IR, or of the mean of several IRs (as mixed by src.ir_convolve), in ir_repo,
+    i.e. the sample of highest magnitude, as used by src.post_convo_sizer.
+    For a single IR of an archive, this is read from the archive metadata;
+    anything else is worked out once and remembered for the rest of the session.
+    Only the argmax is computed here; the robust peak of archived IRs is in their metadata (see ir_metadata),
+    and src.ir_mix.mix_robust_peak_index memoises it for mixes of IRs.
+
+    Arguments:
+    - str/dict  ir_repo     : The folder or IR archive holding the IRs
+    - list      names       : The names of the IRs which are mixed; a single name (str) for a single IR
+    - numpy     ir          : Optionally, the mixed IR itself, if the caller has it at hand already
+                            : Required for mixes other than the "time" mean (see src.ir_mix)
+    - str       mix_method  : How the IRs were mixed (see src.ir_mix); part of the cache key
+
+    Returns:
+    - int peak index
+    """
+    names = [names] if isinstance(names, str) else list(names)
+
+    if len(names) == 1 and mix_method == "time" and is_ir_archive(ir_repo):
+        entry = _as_archive(ir_repo)["files"][names[0]]
+        if "peak_index" in entry:
+            return entry["peak_index"]
+
+    # The mean of IRs does not depend on the order they were drawn in
+    key = (ir_repo["path"] if isinstance(ir_repo, dict) else os.path.abspath(ir_repo), tuple(sorted(names)), mix_method)
+    if key not in _peak_cache:
+        if ir is None:
+            ir = np.mean([load_ir(ir_repo, name) for name in names], axis=0)
+        _peak_cache[key] = int(np.argmax(np.abs(ir)))
+
+    return _peak_cache[key]
+
+
+def ir_metadata(ir_repo, name):
+    """
+    Returns the metadata of the IR called name, or None if ir_repo is a plain folder.
+    """
+    if is_ir_archive(ir_repo):
+        return _as_archive(ir_repo)["files"][name]
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack a folder of .npy IRs into an IR archive")
+    parser.add_argument("--ir_repo", type=str, required=True, help="The folder of .npy IRs to pack")
+    parser.add_argument("--archive_path", type=str, default=None, help="Where to write the archive (defaults to <ir_repo>.irpack)")
+    parser.add_argument("--sr", type=int, default=16000, help="The sampling rate of the IRs")
+
+    args = parser.parse_args()
+
+    archive_path = args.archive_path or os.path.normpath(args.ir_repo) + ".irpack"
+    archive = pack_ir_folder(args.ir_repo, archive_path, sr=args.sr)
+    print(f"{len(archive['files'])} IRs packed into {archive_path}")
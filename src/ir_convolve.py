@@ -15,9 +15,48 @@ import os
 import random
 
 import numpy as np
+import scipy.fft
 import torch
 from scipy import signal
 
+from src.ir_archive import ir_peak_index
+from src.ir_archive import list_irs
+from src.ir_archive import load_ir
+from src.ir_mix import mix_irs
+from src.numeric_policy import to_numpy
+from src.numeric_policy import to_working
+
+
+def _fold(data, n):
+    # Wraps data around a circle of n samples (sums every n-th sample), for circular convolution of size n
+    if len(data) <= n:
+        return data
+    return np.pad(data, (0, -len(data) % n)).reshape(-1, n).sum(axis=0)
+
+
+def convolve_window(audio, ir, start, length):
+    """
+    Computes only samples [start, start + length) of the full convolution of audio with ir,
+    i.e. signal.convolve(audio, ir, mode="full")[start:start + length], zero-padded if the window runs past its end.
+    A circular convolution of size n_fft only aliases the full output's samples past n_fft onto its first
+    n_full - n_fft samples, so n_fft only needs to cover the window and push the aliasing ahead of start.
+
+    Arguments:
+    - numpy array   audio   : 1-D audio
+    - numpy array   ir      : 1-D IR; it is cast to the dtype of audio
+    - int           start   : The first sample of the full convolution to keep
+    - int           length  : The number of samples to keep
+
+    Returns:
+    - numpy array of dimension [length], in the (floating point) dtype of audio
+    """
+    dtype = audio.dtype if np.issubdtype(audio.dtype, np.floating) else np.float64
+    n_full = len(audio) + len(ir) - 1
+    n_fft = scipy.fft.next_fast_len(max(start + length, n_full - start, 1), real=True)
+    spectrum = scipy.fft.rfft(_fold(np.asarray(audio, dtype=dtype), n_fft), n_fft)
+    spectrum *= scipy.fft.rfft(_fold(np.asarray(ir, dtype=dtype), n_fft), n_fft)
+    return scipy.fft.irfft(spectrum, n_fft)[start:start + length]
+
 
 def ir_convolve(audio_data,
                 sr,
@@ -25,7 +64,9 @@ def ir_convolve(audio_data,
                 ir_repo=None,
                 no_of_ir=4,  # 10C4 for fabric, 18C4 for mobile: Ensure richness of IR samples
                 mix_ir_list=None,
-                specific_ir_path=None):
+                specific_ir_path=None,
+                output_window=None,
+                mix_method="time"):
     """
     Arguments:
     - torch tensor  audio_data  : The audio data to be convolved
@@ -38,9 +79,20 @@ def ir_convolve(audio_data,
                                 : Can be used even with just 1 ir in list
                                 : (4) "specific" uses the 1 x ir indicated in ir_path
     - str       ir_repo         : For "random_mix" and "random_single" modes, this is the repo to draw the random IRs from
+                                : Either a folder of .npy IRs, or an IR archive (path or opened; see src.ir_archive)
     - int       no_of_ir        : For "random_mix" mode, indicates the number of IRs to draw from ir_repo
     - list      mix_ir_list     : For "specific_mix" mode, indicates IRs to be drawn from ir_repo
     - str       specific_ir_path: For "specific mode, indicates the path of the ir to be used
+    - str       mix_method      : For "random_mix" and "specific_mix" modes, how IRs are mixed (see src.ir_mix)
+                                : "time" (sample-by-sample mean), "magnitude" (mean magnitude spectrum) or "min_phase"
+    - str/tuple output_window   : The span of the convolved audio to compute (and normalise over); nothing else is computed
+                                : (1) None computes the full len(audio) + len(IR) - 1 samples
+                                : (2) "peak" computes the size_orig samples from the IR peak on (for room and mobile IRs)
+                                : (3) "head" computes the first size_orig samples (for fabric IRs)
+                                : (4) (start, length) computes samples start to start + length
+                                : (2) and (3) are exactly what post_convo_sizer keeps; pass it peak_index=0 after "peak"
+
+    The peak index of the IR is logged in parameters as "peak_index" (see src.ir_archive.ir_peak_index)
 
     Returns:
     - wav_data (torch tensor), sampling_rate (int), size of original audio (int), parameters (dict)
@@ -60,37 +112,27 @@ def ir_convolve(audio_data,
     if mode == "random_mix":
         if not isinstance(no_of_ir, int):
             raise ValueError("Please indicate a valid no_of_ir (use integers)")
-        ## Choose no_of_irs in ir_repo and average them
-        chosen_ir = np.zeros_like(np.load(os.path.join(ir_repo, random.choice(os.listdir(ir_repo)))))
-
-        for i in range(no_of_ir):  # ??? is this ok
-            # hmmmm as you suspect i'm not sure if this is the correct way to interpolate RIRs
-            # might need to do some fft based merging instead
-            # TODO: look into the method in ir_interpolation.py instead
-            sampled_ir = random.choice(os.listdir(ir_repo))
+        ## Choose no_of_irs in ir_repo and mix them
+        ir_names = list_irs(ir_repo)
+
+        for i in range(no_of_ir):
+            sampled_ir = random.choice(ir_names)
             # Log parameters
             paras["RIRs_used"].append(sampled_ir)
 
-            chosen_ir += np.load(os.path.join(ir_repo, sampled_ir))
-
-        chosen_ir = chosen_ir / no_of_ir
+        # Mixes are memoised (see src.ir_mix), so a combination that was drawn before costs nothing
+        chosen_ir = mix_irs(ir_repo, paras["RIRs_used"], method=mix_method)
+        paras["mix_method"] = mix_method
 
     elif mode == "random_single":
-        sampled_ir = random.choice(os.listdir(ir_repo))
-        chosen_ir = np.load(os.path.join(ir_repo, sampled_ir))
+        sampled_ir = random.choice(list_irs(ir_repo))
+        chosen_ir = np.array(load_ir(ir_repo, sampled_ir))
 
         # Log parameters
         paras["RIRs_used"].append(sampled_ir)
 
     elif mode == "specific_mix":
-        for i in range(len(mix_ir_list)):
-            if i == 0:
-                mix_ir = np.load(os.path.join(ir_repo, mix_ir_list[i]))
-            else:
-                mix_ir = mix_ir + np.load(os.path.join(ir_repo, mix_ir_list[i]))
-        # Average out ir
-        chosen_ir = mix_ir / len(mix_ir_list)
-        # print(chosen_ir)
+        chosen_ir = mix_irs(ir_repo, mix_ir_list, method=mix_method)
 
     elif mode == "specific":
         chosen_ir = np.load(specific_ir_path)
@@ -101,21 +143,40 @@ def ir_convolve(audio_data,
     else:
         raise ValueError("Please indicate a valid mode: 'random_mix', 'random_single', 'specific_mix', or 'specific'")
 
+    ## Look up the peak of the IR; worked out once per IR (or mix of IRs), and read from the metadata of IR archives
+    if mode == "specific":
+        peak_index = ir_peak_index(os.path.dirname(specific_ir_path), os.path.basename(specific_ir_path), ir=chosen_ir)
+    else:
+        peak_index = ir_peak_index(ir_repo, mix_ir_list if mode == "specific_mix" else paras["RIRs_used"], ir=chosen_ir,
+                                   mix_method="time" if mode == "random_single" else mix_method)
+    paras["peak_index"] = peak_index
+
     ## II. Convolve audio with ir
-    # Only use full to capture every bit of IR details
-    size_orig = len(torch.squeeze(audio_data).numpy())
+    # In the working dtype (see src.numeric_policy); shares memory with audio_data, and the IR is cast to match
+    audio_np = to_numpy(torch.squeeze(audio_data))
+    size_orig = len(audio_np)
     # TODO: torch.squeeze returns different array shapes for mono and stereo audio
     # unclear whether the input audio is expected to be mono, we should probably document this
-    convolved_audio_data = signal.convolve(torch.squeeze(audio_data).numpy(), chosen_ir, mode="full")
-
-    # Normalise data as it will become much softer
+    if output_window is None:
+        # Only use full to capture every bit of IR details
+        convolved_audio_data = signal.convolve(audio_np, np.asarray(chosen_ir, dtype=audio_np.dtype), mode="full")
+    else:
+        # Only compute the samples which are kept; e.g. post_convo_sizer drops the pre-peak samples (the sound's travel time)
+        # of room and mobile convolutions, and the tail of fabric convolutions
+        if output_window == "peak":
+            output_window = (peak_index, size_orig)
+        elif output_window == "head":
+            output_window = (0, size_orig)
+        convolved_audio_data = convolve_window(audio_np, chosen_ir, *output_window)
+
+    # Normalise data as it will become much softer; over the computed window only
     max_value = np.max(np.abs(convolved_audio_data))
     if max_value > 0:
         # TODO: softer audio is an intended effect of rir convolution, is increasing the gain the right thing to do?
         # unless there's clipping of some sort, maybe we shouldn't normalize it up to 100%
-        convolved_audio_data = convolved_audio_data / max_value
+        convolved_audio_data /= max_value
 
     ## Repack into audio_data format as per pytorch
-    convolved_audio_data = torch.from_numpy(convolved_audio_data)
+    convolved_audio_data = to_working(convolved_audio_data)
 
     return convolved_audio_data, sr, size_orig, chosen_ir, paras
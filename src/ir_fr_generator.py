@@ -7,16 +7,231 @@
 #### This should probably be in the same py as ir_convolve
 # Purpose of this function? Isn't it mathematically equivalent to just multiplying by room RIR?
 
+# Batch mode (impulse_generator_batch) computes the reference spectrum once, processes all recordings
+# in float32 with a real FFT across a pool of processes, and writes a packed IR archive (see src.ir_archive)
+# matplotlib is only imported when a visualisation is requested, so both modes run headless
+
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-import librosa
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.fft import fft
 from scipy.fft import fftfreq
+from scipy.fft import rfft
 from scipy.signal import savgol_filter
 from scipy.signal.windows import tukey
 
+from src.ir_archive import write_ir_archive
+
+
+def reference_spectrum(reference_path, dtype=np.float64):
+    """
+    Computes the windowed, normalised and thresholded spectrum of the reference sweep,
+    which is shared by every recording it is compared against.
+
+    Arguments:
+    - str   reference_path  : The path to the reference audio (in wav), see impulse_generator
+    - dtype dtype           : The working precision of the FFTs (np.float32 halves memory and time)
+
+    Returns:
+    - dict with keys "window", "fft_N", "filtered_fft_ref", "sr" and "dtype"
+    """
+    import librosa
+
+    ## Load reference audio; Apply full window and perform fourier transform
+    ## The sweeps are real, so the real FFT holds every bin we need (the other half mirrors it)
+    ref_sweep, sr = librosa.load(reference_path, sr=None)
+    # Implement window - use a hanning or tukey window because it provides (Tukey is essentially hanning with steeper slopes)
+    # low alpha value is recommended for noisy signal to preserve energy of the signal ???
+    # When alpha = 0, window is rectangular; When alpha = 1, window is hanning
+    # The steep slopes will preserve energy magnitudes better, while avoiding sharp transitions ("wraparound effect")
+    # (1) Good sharpness reduction/transition properties - ultimately what we want to reduce wrap around and spectral leakages
+    # (2) symmetric - since low and high frequencies equally important???
+    # (3) strong main lobe and low side lobes allow good balance of time resolution and frequency resolution
+    # window = get_window('hann', len(ref_sweep),)
+    window = tukey(len(ref_sweep), alpha=0.05)
+    ref_sweep = (ref_sweep * window).astype(dtype)
+    # apply FFT with a smallest power of 2
+    fft_N = 2 ** int(np.ceil(np.log2(len(ref_sweep))))
+    fft_ref = rfft(ref_sweep, fft_N)
+
+    ## Normalise audio
+    ### Why normalise?
+    ### (1) Prevents clipping of loud noise to cause distortion
+    ### (2) Standardise input against imperfect experimental technique
+    ### (3) Little downstream issues since we are more interested in relative response among frequencies ???
+    fft_ref = librosa.util.normalize(fft_ref)
+
+    ## Threshold reference (see measure 1 in sweep_to_impulse_response); this is the same for every recording
+    magnitudes_ref = np.abs(fft_ref)
+    threshold_ref = 0.000001 * np.max(magnitudes_ref)
+    filtered_fft_ref = np.copy(fft_ref)
+    filtered_fft_ref[magnitudes_ref < threshold_ref] = 0
+
+    return {"window": window.astype(dtype), "fft_N": fft_N, "filtered_fft_ref": filtered_fft_ref, "sr": sr, "dtype": dtype}
+
+
+def sweep_to_impulse_response(output_sweep,
+                              sr_sweep,
+                              reference,
+                              target_sr=16000,
+                              truncate_imp_resp=True,
+                              suppress_low_freq_noise=True):
+    """
+    Calculates the impulse response of a medium from a sweep recorded through it, against the reference sweep.
+
+    Arguments:
+    - numpy array   output_sweep    : The sweep recorded after passing through the medium
+    - int           sr_sweep        : The sampling rate of output_sweep
+    - dict          reference       : The reference spectrum, as returned by reference_spectrum
+    - see impulse_generator for the rest
+
+    Returns:
+    - dict with keys "impulse_response_cleaned", "impulse_response_cleaned_smoothed" (the one that is exported),
+      and "freq_resp_downsampled", "freq_resp_cleaned", "N_downsampled" (for visualisation)
+    """
+    import librosa
+    window, fft_N, filtered_fft_ref = reference["window"], reference["fft_N"], reference["filtered_fft_ref"]
+
+    # Apply same tukey window to output_sweep
+    output_sweep = (output_sweep * window).astype(reference["dtype"])
+    fft_output = rfft(output_sweep, fft_N)
+    fft_output = librosa.util.normalize(fft_output)
+
+    # II. FREQ-DOMAIN Noise Management measure 1: IMPLEMENT THRESHOLD
+    ##  Calculates magnitude of points on the spectrum and implement threshold
+    ## This is a very blunt tool and we should not apply a big threshold factor here
+    ## (The reference is thresholded once, in reference_spectrum)
+    magnitudes_output = np.abs(fft_output)
+    threshold_output = 0.000001 * np.max(magnitudes_output)
+
+    ## Apply filter
+    filtered_fft_output = np.copy(fft_output)
+    filtered_fft_output[magnitudes_output < threshold_output] = 0
+
+    # III. ??? FREQ-DOMAIN Noise Management measure 2 >> Use Wiener Cross Spectral Density + Tikhonov Regularisation
+    # We apply (1) Wiener Cross Spectral Density (CSD)+ (2) Tikhonov Regularisation approach
+    # (1) Wiener Cross Spectral Density: Measures correlation of 2 signals IN THE FREQ DOMAIN
+    # "cross spectral density = A FT of a convolution between 2 signals"
+    # "transforms time-doamin cross-correlation function into the frequency domain"
+
+    # Layman explanation:
+    # "If a frequency is strong in the original signal and strongly correlated in the recorded signal"
+    # "Then it is probably a true part of the medium's effect"
+    # "If it doesn't match well, then it is probably just noise"
+
+    # Effectively separate noise from actual signals
+    # Numerator S_xy: Multiply fft_recorded and conjugate of FFT_reference to get cross-correlation
+    # Denominator S_xx: The magnitude (or power of the reference signal) for normalisation 
+
+    # Technique provides a robust IR in the presence of noise
+    # This is a big step up from naive division: freq_resp = fft_output/(fft_ref + 1e-12)
+    # It particularly avoid spikes due to division of a very low number, typically caused by noise
+    # i.e. small change in observed data can lead to large change in reconstructed signal
+
+    # (2) Tikhonov method introduces a "penalty for solutions that are too noisy or oscillate wildly"
+    # Thisis also Ridge Regularisation > the same techqniue to prevent coefficients from growing too wildly
+    # higher lambda = more smoothed out response curve
+    # !!!: This math minimises the Mean Squared Error between estimated original signal and actual original signal
+
+    # Calculate Wiener Regularised (with Tikhonov regularisation) frequency response:
+    lambda_reg = 1e-3  # arbitrary >> Low lambda: more details but amplifies noise; high lambda: more noise suppresison at expense of details???
+    freq_resp_raw = filtered_fft_output * np.conj(filtered_fft_ref) / (
+                np.abs(filtered_fft_ref) ** 2 + lambda_reg)
+
+    # IV. Keep relevant frequencies (up to target frequencies)
+    # Retain frequency axis up to nysquist of target frequency
+    nyquist_target = target_sr / 2
+    # Realign frequency axis: Compute length of original time domain, and determine size of each frequency b
+    N = fft_N * 2 - 1
+    freqs = np.fft.rfftfreq(N, d=1 / sr_sweep)
+    # The real FFT only holds the first fft_N // 2 + 1 bins; all kept bins must be among them
+    if np.sum(freqs <= nyquist_target) > len(freq_resp_raw):
+        raise ValueError("target_sr is too high for the sampling rate of the sweeps")
+    freqs = freqs[:len(freq_resp_raw)]
+    # Keep only frequency components under nyquist_target
+    freq_resp_downsampled = freq_resp_raw[freqs <= nyquist_target]
+    freqs_downsampled = freqs[freqs <= nyquist_target]
+    N_downsampled = len(freqs_downsampled)
+
+    # IV. FREQ-DOMAIN Noise Management measure 3: Implement spectral smoothing
+    # Create smoothed verison for freq response
+    # Savitzky-Golay Filter: Tries to fit a polynomial of certain order over window_length, and reduce least squared error
+    # One of most widely cited paper in Analytical Chemistry
+    # # We use a savgol filter - favoured in signal processing because it closely adapts to audio / sinusoid signals
+    # To note, we can only apply the savgol filter on the magnitude of the FFT, not on the complex values
+    # so we will need to reconstruct the impulse response using filtered magnitude and the original phase data
+    filter_window_size = 521
+    # Apply savgol fi l t e r on mag of freq_resp;mag_db_freq_resp_cleaned is used for visualisation
+    mag_db_freq_resp_downsampled = 20 * np.log10(np.abs(freq_resp_downsampled) + 1e-12)
+    mag_db_freq_resp_cleaned = savgol_filter(mag_db_freq_resp_downsampled,
+                                             window_length=filter_window_size,
+                                             polyorder=3)
+    # reconstruct phase data
+    phase = (np.angle(freq_resp_downsampled))
+    ## Convert back to linear magnitude and attach back phase information
+    freq_resp_cleaned = 10 ** (mag_db_freq_resp_cleaned / 20) * np.exp(1j * phase)
+
+    # V. ???FREQ-DOMAIN Noise Management Measure 4: Supprese low frequencies
+    # We note significont distortions with the frequency response at the 0 to 100kz range
+    # We set the frequency response of the band 0 to 300kz to 0.5 gain on linear magnitude scole
+    # but we are not using O directly to compensate for the drop in amplitude due to the fabric
+    # This is calibrated using hearing tests (Where, at unity gain, low frequencies were observed to be too noisy
+    # The impact is likely to be low since this ia the frequency band that will be muddled with noise in practice
+    # TODO: there are probably other ways to fix this artifact
+    # like we could use a high pass (butter) filter below instead of squashing everything down to 0.45
+    # impulse_response_cleaned = np.real(np.fft.ifft(freq_resp_cleaned))
+    # if suppress_low_freq_noise:
+    #     sos = butter(4, 150, 'hp', fs=target_sr, output='sos')
+    #     impulse_response_cleaned = sosfiltfilt(sos, impulse_response_cleaned)
+    # or we could use a dynamic `lambda_reg` above based on the reference signal strength
+
+    if suppress_low_freq_noise:
+        freq_to_suppress = 400
+        frequency_per_bin = target_sr / N_downsampled
+        # TODO: did you mean `*=` (make it smaller) instead of `=` (also deletes all complex phase)
+        # alternatively use a butter bandpass filter like in the workshop
+        freq_resp_cleaned[0:int(np.ceil(freq_to_suppress / frequency_per_bin))] = 0.45
+
+    # V. Perform inverse-FFT (and take real part) to get impulse response (in time domain)
+    impulse_response_cleaned = np.real(np.fft.ifft(freq_resp_cleaned))
+
+    # A technique that didn't work well ???
+    # RM VI. Resample obtained freq_resp and impulse response to target sample rate
+    # RM impulse_response_smooth_resampled = resample_poly(impulse_response_smooth, up=1, down=3)
+
+    # VI. TIME-DOMAIN Noise Management: Impulse Response (IR) Filter:
+    filter_window_size = 21
+    impulse_response_cleaned_smoothed = savgol_filter(impulse_response_cleaned,
+                                                      window_length=filter_window_size,
+                                                      polyorder=4)
+
+    ## Optional: Suppress spike at end of impulse response
+    # This is to remove spike due to downsampling effect
+    # We can remove large chunk of it since the most critical part is the initial impulse
+    # (i.e. will not require 5 whole sec of impulse, esp when the trailing end is prone to distortions like ringing
+    # in practice, unlikely for reverbs and time-shifts to last 5 seconds
+    if truncate_imp_resp:
+        samples_to_keep = 600  # about ~0.3s
+        impulse_response_cleaned = impulse_response_cleaned[:samples_to_keep,]
+        impulse_response_cleaned_smoothed = impulse_response_cleaned_smoothed[:samples_to_keep,]
+
+    ### Normalisation: Not necessary to implement here
+
+    ## Normalise by peak amplitude
+    # impulse_response_cleaned_norm = impulse_response_cleaned /пр. max (n.abs (impulse_response_cleaned))
+    # impulse_response_cleaned_smoothed_norm = impulse_response_cleaned_smoothed / np.max(np. abs(impulse_resi
+
+    ## Alternately, normalise impulse response by energy
+    # Mathematically, it scales the impulse response such that energy to 1, but it just reduces the energy ti
+    # impulse_response_cleaned = impulse_response_cleaned / np. Linalg.norm(impulse_response_cleaned)
+    # impulse_response_cleaned_smoothed = impulse_response_cleaned_smoothed / np. linalg.norm(impulse_responsi
+
+    return {"impulse_response_cleaned":          impulse_response_cleaned,
+            "impulse_response_cleaned_smoothed": impulse_response_cleaned_smoothed,
+            "freq_resp_downsampled":             freq_resp_downsampled,
+            "freq_resp_cleaned":                 freq_resp_cleaned,
+            "N_downsampled":                     N_downsampled}
+
 
 def impulse_generator(
         reference_path='./data/fabric_experiment/aligned_run2_recordings/ref_trimmed_0Clean_0deg_NoCover_aligned.wav',
@@ -59,37 +274,20 @@ For info; fabrics used in experiments
 9LC: Longchamp Bag
 10BJ: Blue Jeans
 """
+    import librosa
 
     print("GENERATING IMPULSE!!\n")
     print(f"{len(os.listdir(input_folder))} files detected in input folder {input_folder}")
 
-    ## Load reference audio; Apply full window and perform FULL fourier transform
-    ref_sweep, sr = librosa.load(reference_path, sr=None)
-    # Implement window - use a hanning or tukey window because it provides (Tukey is essentially hanning with steeper slopes)
-    # low alpha value is recommended for noisy signal to preserve energy of the signal ???
-    # When alpha = 0, window is rectangular; When alpha = 1, window is hanning
-    # The steep slopes will preserve energy magnitudes better, while avoiding sharp transitions ("wraparound effect")
-    # (1) Good sharpness reduction/transition properties - ultimately what we want to reduce wrap around and spectral leakages
-    # (2) symmetric - since low and high frequencies equally important???
-    # (3) strong main lobe and low side lobes allow good balance of time resolution and frequency resolution
-    # window = get_window('hann', len(ref_sweep),)
-    window = tukey(len(ref_sweep), alpha=0.05)
-    ref_sweep = ref_sweep * window
-    # apply FFT with a smallest power of 2
-    fft_N = 2 ** int(np.ceil(np.log2(len(ref_sweep))))
-    fft_ref = fft(ref_sweep, fft_N)
-
-    ## Normalise audio
-    ### Why normalise?
-    ### (1) Prevents clipping of loud noise to cause distortion
-    ### (2) Standardise input against imperfect experimental technique
-    ### (3) Little downstream issues since we are more interested in relative response among frequencies ???
-    fft_ref = librosa.util.normalize(fft_ref)
+    reference = reference_spectrum(reference_path)
 
     ## Create folder if not already there
     if not os.path.isdir(output_folder):
         os.mkdir(output_folder)
 
+    if visualise_freq_response or visualise_imp_response:
+        import matplotlib.pyplot as plt
+
     ## Loop through sine sweep folder and generate impulse response
     list_of_files = os.listdir(input_folder)
     list_of_files.sort()
@@ -100,139 +298,17 @@ For info; fabrics used in experiments
 
             # I. Load Calculated Impulse Response File
             output_sweep, sr_sweep = librosa.load(os.path.join(input_folder, file), sr=None)
-            # Apply same tukey window to output_sweep
-            output_sweep = output_sweep * window
-            fft_output = fft(output_sweep, fft_N)
-            fft_output = librosa.util.normalize(fft_output)
-
-            # II. FREQ-DOMAIN Noise Management measure 1: IMPLEMENT THRESHOLD
-            ##  Calculates magnitude of points on the spectrum and implement threshold
-            ## This is a very blunt tool and we should not apply a big threshold factor here
-            magnitudes_output = np.abs(fft_output)
-            threshold_output = 0.000001 * np.max(magnitudes_output)
-            magnitudes_ref = np.abs(fft_ref)
-            threshold_ref = 0.000001 * np.max(magnitudes_ref)
-
-            ## Apply filter
-            filtered_fft_output = np.copy(fft_output)
-            filtered_fft_output[magnitudes_output < threshold_output] = 0
-
-            filtered_fft_ref = np.copy(fft_ref)
-            filtered_fft_ref[magnitudes_ref < threshold_ref] = 0
-
-            # III. ??? FREQ-DOMAIN Noise Management measure 2 >> Use Wiener Cross Spectral Density + Tikhonov Regularisation
-            # We apply (1) Wiener Cross Spectral Density (CSD)+ (2) Tikhonov Regularisation approach
-            # (1) Wiener Cross Spectral Density: Measures correlation of 2 signals IN THE FREQ DOMAIN
-            # "cross spectral density = A FT of a convolution between 2 signals"
-            # "transforms time-doamin cross-correlation function into the frequency domain"
-
-            # Layman explanation:
-            # "If a frequency is strong in the original signal and strongly correlated in the recorded signal"
-            # "Then it is probably a true part of the medium's effect"
-            # "If it doesn't match well, then it is probably just noise"
-
-            # Effectively separate noise from actual signals
-            # Numerator S_xy: Multiply fft_recorded and conjugate of FFT_reference to get cross-correlation
-            # Denominator S_xx: The magnitude (or power of the reference signal) for normalisation 
-
-            # Technique provides a robust IR in the presence of noise
-            # This is a big step up from naive division: freq_resp = fft_output/(fft_ref + 1e-12)
-            # It particularly avoid spikes due to division of a very low number, typically caused by noise
-            # i.e. small change in observed data can lead to large change in reconstructed signal
-
-            # (2) Tikhonov method introduces a "penalty for solutions that are too noisy or oscillate wildly"
-            # Thisis also Ridge Regularisation > the same techqniue to prevent coefficients from growing too wildly
-            # higher lambda = more smoothed out response curve
-            # !!!: This math minimises the Mean Squared Error between estimated original signal and actual original signal
-
-            # Calculate Wiener Regularised (with Tikhonov regularisation) frequency response:
-            lambda_reg = 1e-3  # arbitrary >> Low lambda: more details but amplifies noise; high lambda: more noise suppresison at expense of details???
-            freq_resp_raw = filtered_fft_output * np.conj(filtered_fft_ref) / (
-                        np.abs(filtered_fft_ref) ** 2 + lambda_reg)
-
-            # IV. Keep relevant frequencies (up to target frequencies)
-            # Retain frequency axis up to nysquist of target frequency
-            nyquist_target = target_sr / 2
-            # Realign frequency axis: Compute length of original time domain, and determine size of each frequency b
-            N = len(freq_resp_raw) * 2 - 1
-            freqs = np.fft.rfftfreq(N, d=1 / sr_sweep)
-            # Keep only frequency components under nyquist_target
-            freq_resp_downsampled = freq_resp_raw[freqs <= nyquist_target]
-            freqs_downsampled = freqs[freqs <= nyquist_target]
-            N_downsampled = len(freqs_downsampled)
-
-            # IV. FREQ-DOMAIN Noise Management measure 3: Implement spectral smoothing
-            # Create smoothed verison for freq response
-            # Savitzky-Golay Filter: Tries to fit a polynomial of certain order over window_length, and reduce least squared error
-            # One of most widely cited paper in Analytical Chemistry
-            # # We use a savgol filter - favoured in signal processing because it closely adapts to audio / sinusoid signals
-            # To note, we can only apply the savgol filter on the magnitude of the FFT, not on the complex values
-            # so we will need to reconstruct the impulse response using filtered magnitude and the original phase data
-            filter_window_size = 521
-            # Apply savgol fi l t e r on mag of freq_resp;mag_db_freq_resp_cleaned is used for visualisation
-            mag_db_freq_resp_downsampled = 20 * np.log10(np.abs(freq_resp_downsampled) + 1e-12)
-            mag_db_freq_resp_cleaned = savgol_filter(mag_db_freq_resp_downsampled,
-                                                     window_length=filter_window_size,
-                                                     polyorder=3)
-            # reconstruct phase data
-            phase = (np.angle(freq_resp_downsampled))
-            ## Convert back to linear magnitude and attach back phase information
-            freq_resp_cleaned = 10 ** (mag_db_freq_resp_cleaned / 20) * np.exp(1j * phase)
-
-            # V. ???FREQ-DOMAIN Noise Management Measure 4: Supprese low frequencies
-            # We note significont distortions with the frequency response at the 0 to 100kz range
-            # We set the frequency response of the band 0 to 300kz to 0.5 gain on linear magnitude scole
-            # but we are not using O directly to compensate for the drop in amplitude due to the fabric
-            # This is calibrated using hearing tests (Where, at unity gain, low frequencies were observed to be too noisy
-            # The impact is likely to be low since this ia the frequency band that will be muddled with noise in practice
-            # TODO: there are probably other ways to fix this artifact
-            # like we could use a high pass (butter) filter below instead of squashing everything down to 0.45
-            # impulse_response_cleaned = np.real(np.fft.ifft(freq_resp_cleaned))
-            # if suppress_low_freq_noise:
-            #     sos = butter(4, 150, 'hp', fs=target_sr, output='sos')
-            #     impulse_response_cleaned = sosfiltfilt(sos, impulse_response_cleaned)
-            # or we could use a dynamic `lambda_reg` above based on the reference signal strength
-
-            if suppress_low_freq_noise:
-                freq_to_suppress = 400
-                frequency_per_bin = target_sr / N_downsampled
-                # TODO: did you mean `*=` (make it smaller) instead of `=` (also deletes all complex phase)
-                # alternatively use a butter bandpass filter like in the workshop
-                freq_resp_cleaned[0:int(np.ceil(freq_to_suppress / frequency_per_bin))] = 0.45
-
-            # V. Perform inverse-FFT (and take real part) to get impulse response (in time domain)
-            impulse_response_cleaned = np.real(np.fft.ifft(freq_resp_cleaned))
-
-            # A technique that didn't work well ???
-            # RM VI. Resample obtained freq_resp and impulse response to target sample rate
-            # RM impulse_response_smooth_resampled = resample_poly(impulse_response_smooth, up=1, down=3)
-
-            # VI. TIME-DOMAIN Noise Management: Impulse Response (IR) Filter:
-            filter_window_size = 21
-            impulse_response_cleaned_smoothed = savgol_filter(impulse_response_cleaned,
-                                                              window_length=filter_window_size,
-                                                              polyorder=4)
-
-            ## Optional: Suppress spike at end of impulse response
-            # This is to remove spike due to downsampling effect
-            # We can remove large chunk of it since the most critical part is the initial impulse
-            # (i.e. will not require 5 whole sec of impulse, esp when the trailing end is prone to distortions like ringing
-            # in practice, unlikely for reverbs and time-shifts to last 5 seconds
-            if truncate_imp_resp:
-                samples_to_keep = 600  # about ~0.3s
-                impulse_response_cleaned = impulse_response_cleaned[:samples_to_keep,]
-                impulse_response_cleaned_smoothed = impulse_response_cleaned_smoothed[:samples_to_keep,]
-
-            ### Normalisation: Not necessary to implement here
-
-            ## Normalise by peak amplitude
-            # impulse_response_cleaned_norm = impulse_response_cleaned /пр. max (n.abs (impulse_response_cleaned))
-            # impulse_response_cleaned_smoothed_norm = impulse_response_cleaned_smoothed / np.max(np. abs(impulse_resi
-
-            ## Alternately, normalise impulse response by energy
-            # Mathematically, it scales the impulse response such that energy to 1, but it just reduces the energy ti
-            # impulse_response_cleaned = impulse_response_cleaned / np. Linalg.norm(impulse_response_cleaned)
-            # impulse_response_cleaned_smoothed = impulse_response_cleaned_smoothed / np. linalg.norm(impulse_responsi
+
+            # II - VI. Work out the impulse response against the reference
+            response = sweep_to_impulse_response(output_sweep, sr_sweep, reference,
+                                                 target_sr=target_sr,
+                                                 truncate_imp_resp=truncate_imp_resp,
+                                                 suppress_low_freq_noise=suppress_low_freq_noise)
+            impulse_response_cleaned = response["impulse_response_cleaned"]
+            impulse_response_cleaned_smoothed = response["impulse_response_cleaned_smoothed"]
+            freq_resp_downsampled = response["freq_resp_downsampled"]
+            freq_resp_cleaned = response["freq_resp_cleaned"]
+            N_downsampled = response["N_downsampled"]
 
             # Note: everything after this is just for visualisation purposes
 
@@ -284,3 +360,63 @@ For info; fabrics used in experiments
     print("IMPULSE COMPLETED! \n\n'But you don't need to use the claw when you pick a pear of the big pawpaw'")
 
     return (None)
+
+
+def _batch_worker_init(reference):
+    # Each process receives the reference spectrum once, rather than once per recording
+    global _batch_reference
+    _batch_reference = reference
+
+
+def _batch_worker(sweep_path, target_sr, truncate_imp_resp, suppress_low_freq_noise):
+    import librosa
+    output_sweep, sr_sweep = librosa.load(sweep_path, sr=None)
+    response = sweep_to_impulse_response(output_sweep, sr_sweep, _batch_reference,
+                                         target_sr=target_sr,
+                                         truncate_imp_resp=truncate_imp_resp,
+                                         suppress_low_freq_noise=suppress_low_freq_noise)
+    return response["impulse_response_cleaned_smoothed"].astype(np.float32)
+
+
+def impulse_generator_batch(
+        reference_path='./data/fabric_experiment/aligned_run2_recordings/ref_trimmed_0Clean_0deg_NoCover_aligned.wav',
+        input_folder='./data/fabric_experiment/aligned_run2_recordings/',
+        archive_path='./data/Impulse_Responses/fabric_IRs.irpack',
+        target_sr=16000,
+        truncate_imp_resp=True,
+        suppress_low_freq_noise=True,
+        workers=None,
+        dtype=np.float32):
+    """
+    Batch version of impulse_generator, for re-deriving all IRs whenever measurement runs change:
+    the reference spectrum is computed once, recordings are processed in float32 across a pool of processes,
+    and the IRs are written into 1 IR archive (see src.ir_archive) instead of 1 .npy file per IR.
+    IRs are named as impulse_generator names its files (e.g. "ir_10BJ_0deg_aligned_smooth.npy").
+
+    Arguments:
+    - str   archive_path    : The folder which the IR archive will be written to
+    - int   workers         : The number of processes (defaults to 1 per core)
+    - dtype dtype           : The working precision of the FFTs
+    - see impulse_generator for the rest
+
+    Returns:
+    - dict archive, as returned by src.ir_archive.load_ir_archive
+    """
+    reference = reference_spectrum(reference_path, dtype=dtype)
+
+    list_of_files = sorted(file for file in os.listdir(input_folder)
+                           if file.lower().endswith(".wav") and file != reference_path.split("/")[-1])
+    print(f"Generating {len(list_of_files)} impulse responses from {input_folder}...")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init, initargs=(reference,)) as executor:
+        impulse_responses = executor.map(_batch_worker,
+                                         [os.path.join(input_folder, file) for file in list_of_files],
+                                         [target_sr] * len(list_of_files),
+                                         [truncate_imp_resp] * len(list_of_files),
+                                         [suppress_low_freq_noise] * len(list_of_files))
+        irs = {f"ir_{file[:-4]}_smooth.npy": ir for file, ir in zip(list_of_files, impulse_responses)}
+
+    archive = write_ir_archive(irs, archive_path, sr=target_sr)
+    print(f"{len(irs)} impulse responses packed into {archive_path}")
+
+    return archive
@@ -43,7 +43,8 @@ def magnitude_to_minimum_phase_ir(magnitude_spectrum, n_fft):
     
     # 3. Window the Cepstrum to force causality
     # Minimum phase = Causal Cepstrum
-    n_cep = len(cepstrum)
+    # (everything works along the last axis, so a stack of magnitude spectra is reconstructed in 1 go)
+    n_cep = cepstrum.shape[-1]
     window = np.zeros(n_cep)
     
     # Keep DC, Double positive frequencies, Zero negative frequencies
@@ -108,6 +109,53 @@ def interpolate_irs_robust(ir1, ir2, alpha=0.5):
         
     return final_ir
 
+def get_robust_peak_indices(irs):
+    """
+    Batched get_robust_peak_index: finds the Hilbert envelope peak of every row of a [n_irs, n_samples] array at once.
+    """
+    envelope = np.abs(scipy.signal.hilbert(irs, axis=-1))
+    envelope = scipy.signal.savgol_filter(envelope, 11, 3, axis=-1)
+    return np.argmax(envelope, axis=-1)
+
+def interpolate_irs_batch(ir_bank, morphs, chunk_size=1024):
+    """
+    Batched interpolate_irs_robust: produces many morphs between IRs of a bank in stacked FFTs.
+    The spectrum of each bank IR is computed once, however many morphs it takes part in.
+
+    Note: the alignment step of interpolate_irs_robust (rolling ir2 onto the peak of ir1) is a circular shift,
+    which leaves the magnitude spectrum untouched; as only magnitudes are interpolated, it is skipped here
+    (the peaks are still available from get_robust_peak_indices if needed)
+
+    Args:
+        ir_bank: list of 1D numpy arrays, or a 2D numpy array of [n_irs, n_samples]
+        morphs: array of [n_morphs, 3] rows of (i, j, alpha); morph = IR i and IR j mixed at alpha
+                (0.0 = ir_bank[i], 1.0 = ir_bank[j]), as in interpolate_irs_robust
+        chunk_size: number of morphs reconstructed per stack of FFTs (bounds memory use)
+
+    Returns:
+        2D numpy array of [n_morphs, n_fft], n_fft being the next power of 2 of the longest bank IR
+    """
+    max_len = max(len(ir) for ir in ir_bank)
+    n_fft = 2**int(np.ceil(np.log2(max_len)))
+
+    # Spectra of the bank, once
+    bank_padded = np.zeros((len(ir_bank), n_fft))
+    for index, ir in enumerate(ir_bank):
+        bank_padded[index, :len(ir)] = ir
+    bank_mag = np.abs(scipy.fft.rfft(bank_padded, n=n_fft, axis=-1))
+
+    morphs = np.asarray(morphs, dtype=np.float64).reshape(-1, 3)
+    first, second, alpha = morphs[:, 0].astype(np.int64), morphs[:, 1].astype(np.int64), morphs[:, 2:3]
+
+    morphed_irs = np.empty((len(morphs), n_fft))
+    for start in range(0, len(morphs), chunk_size):
+        end = start + chunk_size
+        # Linear Interpolation of Magnitude, for the whole chunk
+        mag_interp = bank_mag[first[start:end]] * (1 - alpha[start:end]) + bank_mag[second[start:end]] * alpha[start:end]
+        morphed_irs[start:end] = magnitude_to_minimum_phase_ir(mag_interp, n_fft)
+
+    return morphed_irs
+
 # --- Usage Example ---
 if __name__ == "__main__":
     # Create two dummy IRs (one sharp, one smeared/delayed)
@@ -0,0 +1,134 @@
+## AJS's IR Mixer
+# This module mixes several IRs of an IR bank (a folder or an IR archive; see src.ir_archive) into 1 IR
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# src.ir_convolve mixes fabric and handphone IRs ("random_mix" and "specific_mix" modes) to enrich the pool of IRs
+# Mixes can be made in 3 ways:
+# (1) "time"      : the sample-by-sample mean of the IRs (how src.ir_convolve has always mixed IRs)
+# (2) "magnitude" : the mean of the magnitude spectra, keeping the phase of the mean spectrum
+#                 : (so the mix does not lose high frequencies wherever the IRs are out of phase)
+# (3) "min_phase" : the mean of the magnitude spectra, reconstructed as a minimum phase IR (see src.ir_interpolation)
+
+# All 3 work on the rFFTs of the IRs, which are computed once per IR and cached
+# The same combinations of IRs are drawn again and again, so mixes are memoised too, keyed on the sorted names of the IRs
+# src.ir_convolve draws IRs with replacement, so a bank of n IRs mixed 4 at a time has (n + 3)C4 combinations
+# (e.g. 715 for a bank of 10 IRs); for banks small enough, precompute_mixes works out all of them up front
+# The robust (Hilbert envelope) peak of a mix is memoised alongside it, on first request (see mix_robust_peak_index)
+
+import itertools
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft
+
+from src.ir_archive import list_irs
+from src.ir_archive import load_ir
+from src.ir_interpolation import get_robust_peak_index
+from src.ir_interpolation import magnitude_to_minimum_phase_ir
+
+MIX_METHODS = ("time", "magnitude", "min_phase")
+# The number of mixes memoised; precompute_mixes refuses banks with more combinations than this
+MIX_CACHE_SIZE = 1024
+
+
+def _repo_key(ir_repo):
+    # Opened archives are dicts (unhashable); key the caches on their path instead
+    return ir_repo["path"] if isinstance(ir_repo, dict) else os.path.abspath(ir_repo)
+
+
+@lru_cache(maxsize=4096)
+def _ir_spectrum(repo_key, name, n_fft):
+    spectrum = scipy.fft.rfft(np.asarray(load_ir(repo_key, name), dtype=np.float64), n_fft)
+    spectrum.setflags(write=False)
+    return spectrum
+
+
+@lru_cache(maxsize=4096)
+def _ir_length(repo_key, name):
+    return len(load_ir(repo_key, name))
+
+
+def ir_spectrum(ir_repo, name, n_fft):
+    """
+    Returns the (cached, read-only) rFFT of size n_fft of the IR called name in ir_repo.
+    """
+    return _ir_spectrum(_repo_key(ir_repo), name, n_fft)
+
+
+@lru_cache(maxsize=MIX_CACHE_SIZE)
+def _cached_mix(repo_key, names, method):
+    length = max(_ir_length(repo_key, name) for name in names)
+    # Round up to the next power of 2 for FFT speed (and a shared FFT size across the bank)
+    n_fft = 2 ** int(np.ceil(np.log2(max(length, 2))))
+    spectra = np.stack([_ir_spectrum(repo_key, name, n_fft) for name in names])
+
+    if method == "time":
+        # The FFT is linear; the mean of the spectra is the spectrum of the mean IR
+        mix_ir = scipy.fft.irfft(spectra.mean(axis=0), n_fft)
+    elif method == "magnitude":
+        magnitude = np.abs(spectra).mean(axis=0)
+        phase = np.angle(spectra.mean(axis=0))
+        mix_ir = scipy.fft.irfft(magnitude * np.exp(1j * phase), n_fft)
+    elif method == "min_phase":
+        mix_ir = magnitude_to_minimum_phase_ir(np.abs(spectra).mean(axis=0), n_fft)
+    else:
+        raise ValueError(f"Please indicate a valid mix method: {', '.join(MIX_METHODS)}")
+
+    mix_ir = mix_ir[:length]
+    mix_ir.setflags(write=False)
+    return mix_ir
+
+
+def mix_irs(ir_repo, names, method="time"):
+    """
+    Mixes the IRs called names in ir_repo into 1 IR; mixes are memoised, so repeated combinations are free.
+
+    Arguments:
+    - str/dict  ir_repo : The folder or IR archive holding the IRs
+    - list      names   : The names of the IRs to mix; the order does not matter, repeats count as extra weight
+    - str       method  : "time", "magnitude" or "min_phase" (see top of module)
+
+    Returns:
+    - read-only numpy array of the mixed IR, as long as the longest IR in names
+    """
+    if method not in MIX_METHODS:
+        raise ValueError(f"Please indicate a valid mix method: {', '.join(MIX_METHODS)}")
+    return _cached_mix(_repo_key(ir_repo), tuple(sorted(names)), method)
+
+
+@lru_cache(maxsize=MIX_CACHE_SIZE)
+def _cached_mix_robust_peak(repo_key, names, method):
+    return int(get_robust_peak_index(_cached_mix(repo_key, names, method)))
+
+
+def mix_robust_peak_index(ir_repo, names, method="time"):
+    """
+    Returns the robust peak index (see src.ir_interpolation.get_robust_peak_index) of the mix of the IRs called names,
+    memoised with the mix; the simple (argmax) peak is src.ir_archive.ir_peak_index.
+    """
+    if method not in MIX_METHODS:
+        raise ValueError(f"Please indicate a valid mix method: {', '.join(MIX_METHODS)}")
+    return _cached_mix_robust_peak(_repo_key(ir_repo), tuple(sorted(names)), method)
+
+
+def precompute_mixes(ir_repo, no_of_ir=4, method="time"):
+    """
+    Works out every combination of no_of_ir IRs in ir_repo up front, repeats included, as src.ir_convolve draws IRs
+    with replacement (e.g. 13C4 = 715 for a bank of 10 IRs), so that mix_irs is a cache hit for the rest of the run.
+
+    Returns:
+    - int number of mixes computed
+    raises ValueError : if there are more combinations than the mix cache holds (MIX_CACHE_SIZE)
+    """
+    names = sorted(list_irs(ir_repo))
+    n_combinations = math.comb(len(names) + no_of_ir - 1, no_of_ir)
+    if n_combinations > MIX_CACHE_SIZE:
+        raise ValueError(f"{len(names)} IRs mixed {no_of_ir} at a time make {n_combinations} combinations, "
+                         f"more than the {MIX_CACHE_SIZE} mixes which are memoised; mixes are worked out as drawn instead")
+    count = 0
+    for combination in itertools.combinations_with_replacement(names, no_of_ir):
+        mix_irs(ir_repo, combination, method=method)
+        count += 1
+    return count
@@ -11,14 +11,16 @@
 # >0db means SNR > 1, which means P_signal > P_noise
 # Where P is average power
 
-import copy
 import os
 import random
 
 import torch
-import torchaudio.functional as F
 
 from src.audio_effects_new import audio_effector
+from src.audio_index import corpus_table
+from src.audio_index import draw_audio
+from src.audio_stacker import noise_layer_mix
+from src.energy_stats import sized_noise_energy
 from src.utils.loader import load_audio_with_pytorch
 from src.noise_sizer import noise_sizer
 
@@ -39,7 +41,10 @@ def noise_builder(reference_audio_data,
                   pitch_shift_range=(-4, 4),
                   low_pass_order=(2, 5),
                   low_pass_cutoff=(4000, 8000),
-                  mode="stationary"
+                  mode="stationary",
+                  noise_table=None,
+                  stats_index=None,
+                  level="mean"
                   ):
     """
     Randomly selects a certain quantity of audio files from a designated folder 
@@ -66,6 +71,12 @@ def noise_builder(reference_audio_data,
                         : - We will insert a (random quantity) of leading zeros to noise (audio_data_2)
                         : Then we will either (1) pad the trailing end of audio_data_2 if the padded audio is shorter than reference audio
                         : - (ii) or truncate audio_data_2 if padded audio_data_2 becomes longer than reference audio
+    - dict noise_table  : Optional sampling table to draw noises from (see src.audio_index.corpus_table),
+                        : e.g. weighted by duration; defaults to uniform draws over the valid audio files of audio_repo
+    - dict stats_index  : Optional energy statistics index of audio_repo (see src.energy_stats.build_energy_stats)
+                        : The energy of each layer no effect has altered is then looked up rather than computed,
+                        : and logged as "energy", so that replay scales the layers by the very same energies
+    - str level         : "mean" or "active" (the active level, for sparse noises); the level the looked up energies are at
     Returns
     - torch tensor of dimension (1,n_samples), sampling_rate (int)
     
@@ -86,29 +97,23 @@ def noise_builder(reference_audio_data,
     # Initialise list of noise parameters
     noise_paras_dict = {}
 
-    ## Prepare output data in the shape of reference_audio_data
-    noise_stack_data = torch.zeros_like(reference_audio_data) + 1e-14
-
-    ## I. Return zero array of same size with reference_audio_data if no_of_audio = 0
+    ## I. Return near-zero array of same size with reference_audio_data if no_of_audio = 0
     if no_of_audio == 0:
-        return noise_stack_data, sr, noise_paras_dict
+        return torch.zeros_like(reference_audio_data) + 1e-14, sr, noise_paras_dict
 
     ## II. If no_of_audio >= 1; Return data read from randomly-chosen wav file (after applying effect and/or correct-sizing)
-    audio_counter = no_of_audio
+    # All layers are sized into a single (no_of_audio, n_samples) tensor and mixed at the end in one weighted reduction
+    noise_layers = None
+    NNR_dbs = []
 
-    while audio_counter >= 1:
+    for layer in range(no_of_audio):
         # Initialise dict of noise parameters
         noise_paras = {"noise_name":         None,
                        "effects":            None,
                        "noise_to_stack_NNR": None}
 
-        # Build noise
-        noise = random.choice(os.listdir(audio_repo))
-        # guard against picking up some weird file
-        while "wav" not in noise:
-            # TODO: hangs permanently if noise folder is empty
-            # TODO: brittle; e.g., accepts `not-a-wav-file.txt`
-            noise = random.choice(os.listdir(audio_repo))
+        # Build noise; only valid audio files are drawn (see src.audio_index)
+        noise = draw_audio(noise_table if noise_table is not None else corpus_table(audio_repo))
         noise_path = os.path.join(audio_repo, noise)
         noise_data, sr_noise = load_audio_with_pytorch(noise_path)
 
@@ -128,42 +133,47 @@ def noise_builder(reference_audio_data,
                                                      )
 
         # Size data to match that of reference audio
-        noise_data, pad_size = noise_sizer(reference_audio_data, noise_data, mode=mode)
+        # With more than 1 layer, the sized noise is written straight into its row of the noise stack
+        if no_of_audio > 1 and noise_layers is None:
+            noise_layers = torch.empty((no_of_audio, reference_audio_data.shape[1]), dtype=noise_data.dtype)
+        noise_data, pad_size = noise_sizer(reference_audio_data, noise_data, mode=mode,
+                                           out=None if noise_layers is None else noise_layers[layer:layer + 1])
 
         # Log parameters
         noise_paras["noise_name"] = noise
         noise_paras["effects"] = paras
         noise_paras["pad_size"] = pad_size
+        if stats_index is not None:
+            # Only valid if no effect has altered the noise
+            noise_paras["energy"] = (sized_noise_energy(stats_index, noise, reference_audio_data.shape[1],
+                                                        mode=mode, pad_size=pad_size, level=level)
+                                     if not paras and stats_index["sampling_rate"] == sr_noise else None)
 
         # SCENARIO 1: no_of_audio == 1
-        ## if there is only 1 loop to begin with, we return noise_data and sr_noise directly
+        ## if there is only 1 layer to begin with, we return noise_data and sr_noise directly
         if no_of_audio == 1:
             # Log parameter
-            noise_paras_dict[f"noise_{no_of_audio - audio_counter + 1}"] = noise_paras
+            noise_paras_dict[f"noise_{layer + 1}"] = noise_paras
 
             return noise_data, sr, noise_paras_dict
 
         # SCENARIO 2: no_of_audio > 1
-        # if no_of_audio is > 1, then we perform loop the stacking of audio
-        ## for the first loop, we initialise noise_data as the "base" of the stack
-
-        if no_of_audio == audio_counter:  # checker for loop number 1, setting up "base" of the stack
-            noise_stack_data = copy.deepcopy(noise_data)
-
-        # for loops beyond the first, we stack the noise data onto the "base"
-        else:
-            # generate a random SNR
+        ## Layer 0 is the "base" of the stack; every other layer is stacked onto it at a random NNR
+        if layer > 0:
+            # generate a random NNR
             noise_to_stack_ratio_dbs = random.uniform(NNR_db_range[0], NNR_db_range[1])
-            # stack audio data
-            noise_stack_data = F.add_noise(noise_stack_data, noise_data, torch.tensor([noise_to_stack_ratio_dbs]))
+            NNR_dbs.append(noise_to_stack_ratio_dbs)
 
             # Log parameter
             noise_paras["noise_to_stack_NNR"] = noise_to_stack_ratio_dbs
 
         # Log noise_paras
-        noise_paras_dict[f"noise_{no_of_audio - audio_counter + 1}"] = noise_paras
+        noise_paras_dict[f"noise_{layer + 1}"] = noise_paras
 
-        audio_counter -= 1
+    ## III. Stack all layers in one go; equivalent to applying F.add_noise layer by layer
+    noise_stack_data = noise_layer_mix(noise_layers, NNR_dbs,
+                                       layer_energies=[noise_paras_dict[f"noise_{layer + 1}"].get("energy")
+                                                       for layer in range(no_of_audio)])
 
     ## Return noise stack when we are done!
     return noise_stack_data, sr, noise_paras_dict
@@ -7,14 +7,94 @@
 # a noise clip is longer than the audio to be overlaid, thereby creating indexing issues downstream
 
 import random
+from typing import NamedTuple
 
-import torch.nn.functional as F
+import torch
 
 
-def noise_sizer(audio_data_1,
+class PlacedSegment(NamedTuple):
+    """
+    A lazy description of a noise after sizing; nothing of length n_samples is materialised until it is rendered.
+    - torch tensor  source  : The noise data, of dimension (1, n_source)
+    - int           offset  : The number of leading zeros before the noise starts
+    - bool          loop    : If True, the noise is looped until length is filled
+    - int           length  : The size of the output (i.e. of the reference audio)
+    """
+    source: torch.Tensor
+    offset: int
+    loop: bool
+    length: int
+
+
+def place_noise(audio_data_1,
                 audio_data_2,
                 mode="stationary",
-                pad_size=None):  # "stationary" or "non-stationary"
+                pad_size=None):
+    """
+    Works out how noise data (audio_data_2) is to be sized against audio data (audio_data_1), see noise_sizer.
+
+    Returns:
+    - PlacedSegment, pad_size (int or None)
+    """
+    ## SCENARIO 1: Stationary Mode
+    ## Truncate the noise if it is longer than the reference, loop it otherwise
+    if mode == "stationary":
+        return PlacedSegment(audio_data_2, 0, True, audio_data_1.shape[1]), pad_size
+
+    ## SCENARIO 2: Non-Stationary Mode
+    ## Insert a random number of leading zeros; number is between 0 and the length of audio_data
+    if mode == "non-stationary":
+        # In practice, a None pad_size only happens when we are doing bulk generation
+        # It should be a determined figure when performing audio regeneration
+        if pad_size is None:
+            pad_size = random.randint(0, audio_data_1.shape[1])
+
+        # TODO: ensure that padding_front < len(audio_data), otherwise you've deleted the entire noise clip
+        return PlacedSegment(audio_data_2, pad_size, False, audio_data_1.shape[1]), pad_size
+
+    raise ValueError("Please indicate a valid mode: 'stationary' or 'non-stationary'")
+
+
+def render_segment(segment, out, gain=1.0, accumulate=False):
+    """
+    Writes a PlacedSegment directly into an output buffer, without intermediate full length copies.
+
+    Arguments:
+    - PlacedSegment segment     : The sized noise to render
+    - torch tensor  out         : The output buffer, of dimension (segment.length,) or (1, segment.length)
+    - float         gain        : Gain applied to the noise as it is written
+    - bool          accumulate  : If True, adds the noise onto the buffer (i.e. mixes); otherwise overwrites it
+
+    Returns:
+    - torch tensor out
+    """
+    out_1d = out.view(-1)
+    source = segment.source[0]
+    n_source = source.shape[0]
+
+    if not accumulate:
+        out_1d.zero_()
+
+    if segment.loop:
+        # Write the noise loop by loop; the last loop is truncated
+        start = segment.offset
+        while start < segment.length and n_source > 0:
+            chunk = min(n_source, segment.length - start)
+            out_1d[start:start + chunk].add_(source[:chunk], alpha=gain)
+            start += chunk
+    else:
+        # Write the noise once after the leading zeros; truncate it if it runs past the end
+        chunk = max(0, min(n_source, segment.length - segment.offset))
+        out_1d[segment.offset:segment.offset + chunk].add_(source[:chunk], alpha=gain)
+
+    return out
+
+
+def noise_sizer(audio_data_1,
+                audio_data_2,
+                mode="stationary",  # "stationary" or "non-stationary"
+                pad_size=None,
+                out=None):
     """
     Ensures that the length of noise data (audio_data_2) matches that of audio data (audio_data_1) by
     (A) for stationary noises: truncate or loop noise
@@ -32,52 +112,19 @@ def noise_sizer(audio_data_1,
                     : - Then we will either (1) pad the trailing end of audio_data_2 if the padded audio_data_2 is still shorter than the reference (audio_data_1)
                     : - (ii) or truncate audio_data_2 1f padded audio_dato_2 becomes longer then audio_data_1 after padding
     - int pad_size  : For "non-stationary" mode, this gives the zero-padding ahead of introducing the nonstationary noise
+    - torch_tensor out : Optional buffer of dimension (1, n_samples) to write the sized noise into (e.g. a row of a noise stack)
     
     Returns:
     - torch tensor of dimension (1, n_samples), sampling_rate (int)
 
     """
-    ## SCENARIO 1: Stationary Mode
-    if mode == "stationary":
-
-        # I. We consider what is the size of len(audio_data_1) relative to len(audio dato_2)
-        size_of_1_over_2 = len(audio_data_1[0]) / len(audio_data_2[0])
+    segment, pad_size = place_noise(audio_data_1, audio_data_2, mode=mode, pad_size=pad_size)
 
-        # II-A: If size_of_1_over_2 < 1; i.e. audio_data_2 is longer than audio_data_1
-        ## We will truncate audio_data_2 to match size of audio_data_1
-        if size_of_1_over_2 < 1:
-            looped_audio_data_2 = audio_data_2[:, :len(audio_data_1[0])]
+    # A stationary noise longer than the reference is simply truncated; return a view, no copy needed
+    if out is None and segment.loop and audio_data_2.shape[1] >= segment.length:
+        return audio_data_2[:, :segment.length], pad_size
 
-        # II-B: If size_of_1_over_2 > 1; i.e. audio_data_2 is shorter than audio_data_1
-        ## We will loop the audio_data_2 ceiling (size_of_1_over_2) times, 
-        ## then truncate it to match the size of audio_data_1
-        else:
-            looped_audio_data_2 = audio_data_2.repeat(1, (int(size_of_1_over_2) + 1))
-            looped_audio_data_2 = looped_audio_data_2[:, :len(audio_data_1[0])]
-
-        return looped_audio_data_2, pad_size
-
-    ## SCENARIO 2: Non-Stationary Mode
-    if mode == "non-stationary":
-        # I. Pad noise_data with random number of leading zeros; 
-        # random number is between 0 and the length of audio_data
-        ## generate random pad size
-        # In practice, a None pad_size only happens when we are doing bulk generation
-        # It should be a determined figure when performing audio regeneration
-        if pad_size is None:
-            pad_size = random.randint(0, audio_data_1.shape[1])
-        ## add trailing zeros
-        padding_front = (pad_size, 0)
-        padded_audio_data_2 = F.pad(audio_data_2, pad=padding_front, mode="constant", value=0)
+    if out is None:
+        out = torch.empty((1, segment.length), dtype=audio_data_2.dtype)
 
-        # TODO: ensure that padding_front < len(audio_data), otherwise you've deleted the entire noise clip
-        # II. Adjust size of noise-data to match audio data
-        ## If noise data ends up longer than audio data, truncate
-        if len(padded_audio_data_2[0]) > len(audio_data_1[0]):
-            padded_audio_data_2 = padded_audio_data_2[:, :len(audio_data_1[0])]
-        ## If padded_noise_data is shorter, then top up with trailing zeros
-        else:
-            padding_rear = (0, len(audio_data_1[0]) - len(padded_audio_data_2[0]))
-            padded_audio_data_2 = F.pad(padded_audio_data_2, pad=padding_rear, mode="constant", value=0)
-
-        return padded_audio_data_2, pad_size
+    return render_segment(segment, out), pad_size
@@ -0,0 +1,82 @@
+## AJS's Numeric Policy
+# This module sets the working precision of the pipeline, and converts audio into it at stage boundaries
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# Dtypes used to drift through the pipeline: IRs are float64 .npy files, so convolved audio came out as float64,
+# rubberband returned float64, and src.phone_lowpass cast back to float32; i.e. twice the memory and bandwidth
+# for no audible gain, plus a hidden copy at every cast
+# Every stage now works in 1 working dtype (float32 by default; float64 for numerical checks), so that:
+# (1) audio between stages is always a contiguous torch tensor of the working dtype
+# (2) numpy <> torch conversions (to_numpy / to_working) share memory whenever the audio is in that form already
+# IRs and IR mixes may stay float64 (they are small, and cached); they are cast when applied to audio
+
+import numpy as np
+import torch
+
+_WORKING_DTYPES = {"float32": (torch.float32, np.float32),
+                   "float64": (torch.float64, np.float64)}
+
+_working = {"dtype": "float32"}
+
+
+def set_working_dtype(dtype="float32"):
+    """
+    Sets the working precision of the pipeline: "float32" (default) or "float64".
+    """
+    if dtype not in _WORKING_DTYPES:
+        raise ValueError('please input a correct working dtype: "float32" or "float64"')
+    _working["dtype"] = dtype
+
+
+def working_dtype():
+    """
+    Returns the working precision of the pipeline, as a torch dtype.
+    """
+    return _WORKING_DTYPES[_working["dtype"]][0]
+
+
+def working_np_dtype():
+    """
+    Returns the working precision of the pipeline, as a numpy dtype.
+    """
+    return _WORKING_DTYPES[_working["dtype"]][1]
+
+
+def to_working(audio_data):
+    """
+    Converts audio (a numpy array or torch tensor) into a contiguous torch tensor of the working dtype.
+    Audio which is in that form already is returned as it is; contiguous numpy audio of the working dtype is shared, not copied.
+    """
+    if isinstance(audio_data, np.ndarray):
+        audio_data = np.ascontiguousarray(audio_data, dtype=working_np_dtype())
+        return torch.from_numpy(audio_data)
+    return audio_data.to(working_dtype()).contiguous()
+
+
+def to_numpy(audio_data):
+    """
+    Converts audio (a torch tensor or numpy array) into a contiguous numpy array of the working dtype.
+    CPU tensors which are contiguous and of the working dtype are shared (via .numpy()), not copied.
+    """
+    if isinstance(audio_data, torch.Tensor):
+        audio_data = audio_data.detach().cpu().numpy()
+    return np.ascontiguousarray(audio_data, dtype=working_np_dtype())
+
+
+def check_audio(audio_data, where="audio"):
+    """
+    Checks that audio follows the numeric policy: a contiguous torch tensor of the working dtype.
+
+    Arguments:
+    - torch tensor  audio_data  : The audio to check
+    - str           where       : Where the audio comes from, for the error message (e.g. "after stage room_reverb")
+
+    raises TypeError : if audio_data is not a torch tensor of the working dtype
+    raises ValueError : if audio_data is not contiguous
+    """
+    if not isinstance(audio_data, torch.Tensor):
+        raise TypeError(f"{where}: expected a torch tensor, got {type(audio_data).__name__}")
+    if audio_data.dtype != working_dtype():
+        raise TypeError(f"{where}: expected {working_dtype()}, got {audio_data.dtype}")
+    if not audio_data.is_contiguous():
+        raise ValueError(f"{where}: audio is not contiguous")
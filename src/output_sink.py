@@ -0,0 +1,374 @@
+## AJS's Output Sinks
+# This module decides where the generated clean/dirty pairs (and their parameters) end up on disk
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# src.bulk_generation has always written loose files, i.e. 2 files per item:
+# ./output/clean_samples/{i}.wav and ./output/dirty_samples/{i}_sample_audio_opus_decoded.wav
+# At millions of items, this cripples the filesystem (and listing the folders at training time)
+# 2 sinks are therefore available, with the same write(...) / close() interface:
+# (1) LooseFileSink   : the loose files, as before
+# (2) ShardedTarSink  : WebDataset-style tar shards, i.e. the files of an item are stored next to each other as
+#                     : {key}.clean.wav, {key}.dirty.wav (or {key}.dirty.opus) and {key}.params.json
+#                     : Shards roll over at shard_size_mb, and shard_index.json records which shard holds which item
+# Shards are read back sequentially (see read_tar_shards), which is what cluster storage is tuned for
+
+# Writing to disk should not stall the (CPU-bound) synthesis of the next item, so:
+# (3) AsyncWriter : a bounded queue feeding writer threads, which encode and flush files in the background
+#                 : submitting blocks once the queue is full (backpressure), and flush() is a barrier
+# (4) AsyncSink   : any of the sinks above, written to by 1 background thread (tar shards must be written in order)
+# Sinks take audio as (audio_data, sr) and encode it as wav within write(...), so behind an AsyncSink
+# the encoding happens on the writer thread too
+
+import io
+import json
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+SHARD_INDEX = "shard_index.json"
+
+
+def wav_bytes(audio_data, sr):
+    """
+    Encodes audio as a 16-bit PCM wav file, in memory.
+
+    Arguments:
+    - torch tensor  audio_data  : The audio data, of dimension (n_channels, n_samples)
+    - int           sr          : The sampling rate of the audio
+
+    Returns:
+    - bytes of the wav file
+    """
+    import torchaudio
+
+    buffer = io.BytesIO()
+    torchaudio.save(buffer, audio_data, sample_rate=sr, format="wav", encoding="PCM_S", bits_per_sample=16)
+    return buffer.getvalue()
+
+
+def _write_file(path, data):
+    ## Writes data to path and forces it to disk
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_file_atomic(path, audio_data, sr):
+    ## The same path may be written by 2 writer threads at once (e.g. debug files), so write aside and rename
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    _write_file(temp_path, wav_bytes(audio_data, sr))
+    os.replace(temp_path, path)
+
+
+def _as_bytes(data):
+    ## data is either bytes already, audio as a tuple (audio_data, sr) to be encoded as wav, or the path of a file
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    if isinstance(data, tuple):
+        return wav_bytes(*data)
+    with open(data, "rb") as f:
+        return f.read()
+
+
+class LooseFileSink:
+    """
+    Writes each item as loose files: the clean audio into clean_folder as {key}.wav,
+    and the dirty audio into dirty_folder under its own name. Parameters are left to the experiment log.
+    With clean_folder None, only the dirty audio is written (e.g. when regenerating a dataset).
+    """
+
+    def __init__(self,
+                 clean_folder="./output/clean_samples",
+                 dirty_folder="./output/dirty_samples"):
+        self.clean_folder = clean_folder
+        self.dirty_folder = dirty_folder
+        if clean_folder is not None:
+            os.makedirs(clean_folder, exist_ok=True)
+        os.makedirs(dirty_folder, exist_ok=True)
+
+    def write(self, key, clean, dirty, dirty_name, params=None):
+        """
+        Arguments:
+        - str/int         key         : The key of the item, e.g. its serial number
+        - tuple/bytes     clean       : The clean audio, as (audio_data, sr) or a wav file (see wav_bytes); None to skip it
+        - tuple/bytes/str dirty       : The dirty audio, as (audio_data, sr), bytes or the path of a file (wav or opus)
+                                      : A file is moved (not copied) into dirty_folder
+        - str             dirty_name  : The file name of the dirty audio, e.g. "3_sample_audio_opus_decoded.wav"
+        - dict            params      : Unused; kept for a common interface with ShardedTarSink
+
+        Returns:
+        - str path of the dirty audio
+        """
+        if self.clean_folder is not None and clean is not None:
+            _write_file(os.path.join(self.clean_folder, f"{key}.wav"), _as_bytes(clean))
+
+        dirty_path = os.path.join(self.dirty_folder, dirty_name)
+        if isinstance(dirty, str):
+            shutil.move(dirty, dirty_path)
+        else:
+            _write_file(dirty_path, _as_bytes(dirty))
+
+        return dirty_path
+
+    def close(self):
+        return None
+
+
+class ShardedTarSink:
+    """
+    Writes each item into rolling tar shards ({prefix}-000000.tar, {prefix}-000001.tar, ...) in output_folder,
+    as members {key}.clean.wav, {key}.dirty.<ext> and {key}.params.json.
+    Shards are written as .tar.tmp and renamed once complete, so a shard which exists is always whole.
+    close() must be called to complete the last shard and write the shard index.
+    """
+
+    def __init__(self,
+                 output_folder="./output/shards",
+                 shard_size_mb=1024,
+                 prefix="shard"):
+        self.output_folder = output_folder
+        self.shard_size = int(shard_size_mb * 1024 * 1024)
+        self.prefix = prefix
+        os.makedirs(output_folder, exist_ok=True)
+
+        self.index = {"shards": [], "items": {}}
+        self._tar = None
+        self._shard_name = None
+        self._shard_items = 0
+
+    def _open_shard(self):
+        self._shard_name = f"{self.prefix}-{len(self.index['shards']):06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.output_folder, self._shard_name + ".tmp"), "w")
+        self._shard_items = 0
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        shard_path = os.path.join(self.output_folder, self._shard_name)
+        # Force the whole shard (including the end-of-archive blocks written on close) to disk before it is renamed
+        with open(shard_path + ".tmp", "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(shard_path + ".tmp", shard_path)
+        self.index["shards"].append({"name":  self._shard_name,
+                                     "items": self._shard_items,
+                                     "bytes": os.path.getsize(shard_path)})
+        self._tar = None
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write(self, key, clean, dirty, dirty_name, params=None):
+        """
+        Arguments:
+        - str/int         key         : The key of the item, e.g. its serial number; must not contain "."
+        - tuple/bytes     clean       : The clean audio, as (audio_data, sr) or a wav file (see wav_bytes); None to skip it
+        - tuple/bytes/str dirty       : The dirty audio, as (audio_data, sr), bytes or the path of a file (wav or opus)
+        - str             dirty_name  : The file name of the dirty audio; its extension decides the member name
+        - dict            params      : The parameters of the item, stored as {key}.params.json
+
+        Returns:
+        - str "<shard>:<member>" of the dirty audio
+        """
+        key = str(key)
+        if "." in key:
+            raise ValueError("Keys of a sharded sink must not contain '.'")
+
+        # Roll over to a new shard once the current one is full (shards hold whole items)
+        if self._tar is not None and self._tar.offset >= self.shard_size:
+            self._close_shard()
+        if self._tar is None:
+            self._open_shard()
+
+        dirty_member = f"{key}.dirty{os.path.splitext(dirty_name)[1].lower()}"
+        if clean is not None:
+            self._add_member(f"{key}.clean.wav", _as_bytes(clean))
+        self._add_member(dirty_member, _as_bytes(dirty))
+        if params is not None:
+            self._add_member(f"{key}.params.json", json.dumps(params).encode("utf-8"))
+
+        self._shard_items += 1
+        self.index["items"][key] = self._shard_name
+
+        return f"{self._shard_name}:{dirty_member}"
+
+    def close(self):
+        self._close_shard()
+        with open(os.path.join(self.output_folder, SHARD_INDEX), "w") as f:
+            json.dump(self.index, f, indent=2)
+
+
+class AsyncWriter:
+    """
+    Runs writes (any callable) on a pool of background threads, fed by a bounded queue.
+    submit(...) blocks while the queue is full, so a slow disk slows the pipeline down rather than filling up memory.
+    Errors raised by a write are re-raised by the next submit(...) or flush().
+    """
+
+    def __init__(self, workers=2, max_queue=32):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._errors = []
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                fn, args, kwargs = task
+                fn(*args, **kwargs)
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _raise_errors(self):
+        if self._errors:
+            error = self._errors[0]
+            self._errors.clear()
+            raise error
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) to be run by a writer thread; blocks while the queue is full.
+        """
+        self._raise_errors()
+        self._queue.put((fn, args, kwargs))
+
+    def save_wav(self, path, audio_data, sr):
+        """
+        Writes audio to path as a 16-bit PCM wav file in the background (encoded by the writer thread, and fsync-ed).
+        The audio is copied first, so the caller is free to modify it afterwards.
+        """
+        audio_data = audio_data.detach().clone()
+        self.submit(_write_file_atomic, path, audio_data, sr)
+
+    def flush(self):
+        """
+        Barrier: returns once every write submitted so far is on disk; re-raises the first error of a write, if any.
+        """
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self):
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def save_debug_wav(writer, path, audio_data, sr):
+    """
+    Writes audio to path as a 16-bit PCM wav file; in the background if writer (an AsyncWriter) is given.
+    """
+    if writer is None:
+        import torchaudio
+
+        torchaudio.save(path, audio_data, sr, encoding="PCM_S", bits_per_sample=16)
+    else:
+        writer.save_wav(path, audio_data, sr)
+
+
+class AsyncSink:
+    """
+    Wraps a LooseFileSink or ShardedTarSink, so that items are encoded and written by a background thread (in order).
+    A dirty file is moved aside when submitted, so its folder may be deleted right after write(...) returns.
+    """
+
+    def __init__(self, sink, max_queue=32):
+        self.sink = sink
+        self._writer = AsyncWriter(workers=1, max_queue=max_queue)
+        self._scratch = tempfile.TemporaryDirectory()
+
+    def _write(self, key, clean, dirty, dirty_name, params):
+        try:
+            self.sink.write(key, clean, dirty, dirty_name, params=params)
+        finally:
+            # A file moved aside is gone once moved into place (LooseFileSink); otherwise it is deleted once read
+            if isinstance(dirty, str) and os.path.exists(dirty):
+                os.remove(dirty)
+
+    def write(self, key, clean, dirty, dirty_name, params=None):
+        """
+        See LooseFileSink.write / ShardedTarSink.write; audio and params are copied when submitted.
+
+        Returns:
+        - None, as the item is not written yet
+        """
+        params = json.loads(json.dumps(params)) if params is not None else None
+        if isinstance(clean, tuple):
+            clean = (clean[0].detach().clone(), clean[1])
+        if isinstance(dirty, tuple):
+            dirty = (dirty[0].detach().clone(), dirty[1])
+        elif isinstance(dirty, str):
+            dirty = shutil.move(dirty, os.path.join(self._scratch.name, f"{key}_{os.path.basename(dirty)}"))
+        self._writer.submit(self._write, key, clean, dirty, dirty_name, params)
+        return None
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        self.sink.close()
+        self._scratch.cleanup()
+
+
+def make_output_sink(kind="loose", output_folder="./output", shard_size_mb=1024, async_queue=0):
+    """
+    Arguments:
+    - str   kind            : "loose" (loose files under output_folder/clean_samples and output_folder/dirty_samples)
+                            : or "tar" (tar shards under output_folder/shards)
+    - str   output_folder   : The output folder
+    - float shard_size_mb   : For "tar", the size at which shards roll over
+    - int   async_queue     : If > 0, items are written in the background (see AsyncSink),
+                            : with up to async_queue items waiting to be written
+
+    Returns:
+    - LooseFileSink or ShardedTarSink (wrapped in an AsyncSink if async_queue > 0)
+    """
+    if kind == "loose":
+        sink = LooseFileSink(clean_folder=os.path.join(output_folder, "clean_samples"),
+                             dirty_folder=os.path.join(output_folder, "dirty_samples"))
+    elif kind == "tar":
+        sink = ShardedTarSink(output_folder=os.path.join(output_folder, "shards"), shard_size_mb=shard_size_mb)
+    else:
+        raise ValueError('please input a correct output sink kind: "loose" or "tar"')
+
+    return AsyncSink(sink, max_queue=async_queue) if async_queue > 0 else sink
+
+
+def read_tar_shards(shard_folder="./output/shards"):
+    """
+    Reads the items of tar shards back sequentially, shard by shard, in the order of shard_index.json.
+
+    Yields:
+    - tuple (key (str), dict of member contents (bytes) keyed on extension, e.g. "clean.wav", "dirty.wav", "params.json")
+    """
+    with open(os.path.join(shard_folder, SHARD_INDEX), "r") as f:
+        shards = json.load(f)["shards"]
+
+    for shard in shards:
+        with tarfile.open(os.path.join(shard_folder, shard["name"]), "r|") as tar:
+            key, item = None, {}
+            for member in tar:
+                member_key, extension = member.name.split(".", 1)
+                if member_key != key and item:
+                    yield key, item
+                    item = {}
+                key = member_key
+                item[extension] = tar.extractfile(member).read()
+            if item:
+                yield key, item
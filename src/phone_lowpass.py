@@ -1,8 +1,14 @@
 ## Materials obtained from public workshop with a simplified mean to simulate phone audio
 
+import random
+
 import numpy as np
 import torch
-from scipy import signal
+import torchaudio.functional as F
+
+from src.numeric_policy import working_np_dtype
+from src.sos_filter import design_sos
+from src.sos_filter import sos_filtfilt
 
 
 # --- Utility: normalize audio for listening without clipping ---
@@ -12,35 +18,169 @@ def peak_normalize(x, peak=0.99):
         return (x / m * peak)
     else:
         m = np.max(np.abs(x)) + 1e-12
-        return (x / m * peak).astype(np.float32)
+        return (x / m * peak).astype(working_np_dtype(), copy=False)
 
 
-def apply_zero_phase_filter(b, a, x):
+def apply_zero_phase_filter(sos, x):
     # filtfilt minimizes phase distortion — great for offline processing / preprocessing
-    return signal.filtfilt(b, a, x).astype(np.float32)
+    return sos_filtfilt(x, sos, dtype=working_np_dtype())
 
 
 def design_butter_bandpass(low_hz, high_hz, sr, order=6):
-    nyq = 0.5 * sr
-    Wn = [low_hz / nyq, high_hz / nyq]
-    b, a = signal.butter(order, Wn, btype="bandpass", analog=False)
-    return b, a
+    # Second-order sections; cached, since the same band is used for every clip
+    return design_sos(order, (low_hz, high_hz), sr, btype="bandpass")
 
 
 def phone_augment(audio, sr):
     """
     Apply a telephone-like band-pass filter and resample to 16 kHz.
+    This is phone_channel with a fixed 300-3400 Hz band, no narrowband resampling and no companding.
     """
+    x_phone, sr, _ = phone_channel(audio, sr,
+                                   low_hz_range=(300.0, 300.0),
+                                   high_hz_range=(3400.0, 3400.0),
+                                   narrowband=False,
+                                   companding=None)
+
+    return x_phone, sr
+
+
+# --- G.711-style companding (continuous mu-law / A-law curves with 8-bit quantisation) ---
+def mu_law_compand(x, quantization_channels=256):
+    # x in [-1, 1]; encode to 8-bit codes and decode back, i.e. the round trip through a mu-law codec
+    return F.mu_law_decoding(F.mu_law_encoding(x, quantization_channels), quantization_channels)
+
 
-    # Design band-pass to emulate telephone bandwidth
-    low_hz, high_hz = 300.0, 3400.0
-    b_bp, a_bp = design_butter_bandpass(low_hz, high_hz, sr, order=6)
+def a_law_compand(x, quantization_channels=256, A=87.6):
+    # x in [-1, 1]; compress with the A-law curve, quantise to 8-bit, then expand back
+    log_A = 1 + np.log(A)
+    abs_x = torch.abs(x)
+    compressed = torch.where(abs_x < 1 / A,
+                             A * abs_x / log_A,
+                             (1 + torch.log(torch.clamp(A * abs_x, min=1.0))) / log_A)
+    compressed = torch.sign(x) * compressed
 
-    # Apply zero-phase band-pass
-    x_phone = apply_zero_phase_filter(b_bp, a_bp, audio)
-    x_phone = peak_normalize(x_phone)
+    # Quantise into quantization_channels levels over [-1, 1]
+    levels = quantization_channels - 1
+    quantized = torch.round((compressed + 1) / 2 * levels) / levels * 2 - 1
 
-    # ## Repack x_phone into a torch tensor
+    abs_q = torch.abs(quantized)
+    expanded = torch.where(abs_q < 1 / log_A,
+                           abs_q * log_A / A,
+                           torch.exp(abs_q * log_A - 1) / A)
+    return torch.sign(quantized) * expanded
+
+
+def phone_channel(audio,
+                  sr,
+                  low_hz_range=(200.0, 400.0),
+                  high_hz_range=(3000.0, 3600.0),
+                  order=6,
+                  narrowband=True,
+                  narrowband_sr=8000,
+                  companding="mulaw",  # "mulaw", "alaw", "random" or None
+                  band_edge_step_hz=50.0,
+                  channel_params=None):
+    """
+    Simulates a telephone channel over a batch of clips in one call:
+    (1) band-pass with band edges sampled per clip, (2) downsample to narrowband (8 kHz),
+    (3) G.711-style mu-law/A-law companding with 8-bit quantisation, (4) upsample back to sr, (5) peak normalisation.
+
+    Arguments:
+    - torch tensor  audio               : The audio data, of dimension (n_samples,), (1, n_samples) or (B, n_samples)
+    - int           sr                  : The sampling rate of audio
+    - list          low_hz_range        : The lower and upper bounds of the lower band edge, in Hz
+    - list          high_hz_range       : The lower and upper bounds of the upper band edge, in Hz
+    - int           order               : The order of the Butterworth band-pass
+    - bool          narrowband          : If True, the clips go through narrowband_sr (and companding happens there)
+    - int           narrowband_sr       : The sampling rate of the narrowband channel
+    - str           companding          : "mulaw", "alaw", "random" (either, per clip) or None
+    - float         band_edge_step_hz   : Sampled band edges are rounded to this step, so that clips sharing a band
+                                        : are filtered together with 1 cached filter design; 0 disables rounding
+    - list          channel_params      : A prescribed list of per-clip parameters (as returned); Used for audio regeneration
+
+    Returns:
+    - torch tensor (of the working dtype, see src.numeric_policy) of the same dimension as audio,
+    - int           sampling_rate
+    - list          parameters, 1 dict per clip
+    """
+    # Work on a (B, n_samples) batch
+    audio = torch.as_tensor(audio)
+    squeeze = audio.dim() == 1
+    batch = audio.reshape(-1, audio.shape[-1])
+    n_clips, n_samples = batch.shape
+
+    ## I. Sample (or retrieve) per-clip channel parameters
+    if channel_params is None:
+        channel_params = []
+        for _ in range(n_clips):
+            low_hz = random.uniform(low_hz_range[0], low_hz_range[1])
+            high_hz = random.uniform(high_hz_range[0], high_hz_range[1])
+            if band_edge_step_hz:
+                low_hz = round(low_hz / band_edge_step_hz) * band_edge_step_hz
+                high_hz = round(high_hz / band_edge_step_hz) * band_edge_step_hz
+            clip_companding = random.choice(["mulaw", "alaw"]) if companding == "random" else companding
+            channel_params.append({"low_hz":        low_hz,
+                                   "high_hz":       high_hz,
+                                   "order":         order,
+                                   "narrowband_sr": narrowband_sr if narrowband else None,
+                                   "companding":    clip_companding})
+    elif len(channel_params) != n_clips:
+        raise ValueError("Please provide 1 set of channel parameters per clip")
+
+    for paras in channel_params:
+        channel_sr = paras["narrowband_sr"] or sr
+        if not 0 < paras["low_hz"] < paras["high_hz"] < channel_sr / 2:
+            raise ValueError(f"Invalid telephone band {paras['low_hz']}-{paras['high_hz']}Hz "
+                             f"for a channel sampled at {channel_sr}Hz")
+
+    ## II. Band-pass; clips sharing a band (and order) are filtered together in 1 batched call
+    x_phone = np.empty((n_clips, n_samples), dtype=working_np_dtype())
+    bands = {}
+    for index, paras in enumerate(channel_params):
+        bands.setdefault((paras["order"], paras["low_hz"], paras["high_hz"]), []).append(index)
+    for (band_order, low_hz, high_hz), indices in bands.items():
+        sos_bp = design_butter_bandpass(low_hz, high_hz, sr, order=band_order)
+        x_phone[indices] = apply_zero_phase_filter(sos_bp, batch[indices])
     x_phone = torch.from_numpy(x_phone)
 
-    return x_phone, sr
+    ## III. Narrowband channel and companding; clips sharing a channel are processed together
+    groups = {}
+    for index, paras in enumerate(channel_params):
+        groups.setdefault((paras["narrowband_sr"], paras["companding"]), []).append(index)
+
+    for (channel_sr, clip_companding), indices in groups.items():
+        if channel_sr is None and clip_companding is None:
+            continue
+        x_group = x_phone[indices]
+
+        if channel_sr is not None:
+            x_group = F.resample(x_group, orig_freq=sr, new_freq=channel_sr)
+
+        if clip_companding is not None:
+            # The codec only sees [-1, 1]; peak normalise each clip before companding
+            x_group = x_group / (torch.amax(torch.abs(x_group), dim=-1, keepdim=True) + 1e-12) * 0.99
+            if clip_companding == "mulaw":
+                x_group = mu_law_compand(x_group)
+            elif clip_companding == "alaw":
+                x_group = a_law_compand(x_group)
+            else:
+                raise ValueError("Please indicate a valid companding: 'mulaw', 'alaw', 'random' or None")
+
+        if channel_sr is not None:
+            x_group = F.resample(x_group, orig_freq=channel_sr, new_freq=sr)
+            # Resampling there and back may be off by a sample; right-size to the original length
+            if x_group.shape[-1] >= n_samples:
+                x_group = x_group[:, :n_samples]
+            else:
+                x_group = torch.nn.functional.pad(x_group, (0, n_samples - x_group.shape[-1]))
+
+        x_phone[indices] = x_group.to(x_phone.dtype)
+
+    ## IV. Peak normalise each clip
+    x_phone = x_phone / (torch.amax(torch.abs(x_phone), dim=-1, keepdim=True) + 1e-12) * 0.99
+
+    ## Repack into the dimension of the input
+    x_phone = x_phone.reshape(audio.shape) if not squeeze else x_phone[0]
+
+    return x_phone, sr, channel_params
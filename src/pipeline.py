@@ -0,0 +1,732 @@
+## AJS's Pipeline Engine
+# This module runs the FAST synthesis pipeline from a declarative config (a dict, or a YAML/JSON file)
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# src.bulk_generation, src.bulk_generation_simple and src.regenerate_dataset used to be 3 hand-written copies of
+# the same loop, with the stage order, probabilities (e.g. "random_mix" x 9 vs "random_single" x 1) and ranges hardcoded
+# They are now thin wrappers around 1 engine, run_pipeline, which runs a list of stages per item
+# A config looks like:
+#   {"output": {"sink": "loose", "folder": "./output", "shard_size_mb": 1024},
+#    "stages": [{"stage": "clean_speech", "folder": "./data/00_raw_speech/", "clean": True, "tap": "preroom"},
+#               {"stage": "ir", "log_key": "add_room_reverb", "folder": "./data/Impulse_Responses/room_IRs/",
+#                "modes": {"random_single": 1}, "convo_type": "room", "output_window": "peak", "tap": "postroom"},
+#               ...]}
+# Every stage entry names a stage type of the STAGES registry, plus its options; common options are:
+# - log_key : The key of the experiment log which the stage's parameters are logged under (and replayed from)
+# - clean   : If True, the audio after this stage is kept as the clean audio of the item
+# - tap     : The debug tap point emitted after this stage (see src.debug_taps)
+# Stages drawing audio files ("clean_speech" and "noise") also take "weight" (None or "duration"),
+# "min_duration_s" and "max_duration_s" (see src.audio_index.corpus_table)
+# "clean_speech" also takes "store" (a speech store to read speech from, see src.speech_store) and "segment_seconds"
+# (to use a random segment of each speech file; its start is logged under "generate_clean_speech" for regeneration)
+# "ir" stages mixing IRs also take "precompute_mixes" (True to work out every mix of a small IR bank up front, see src.ir_mix)
+# "noise" stages also take "energy_stats" (True to look up the energy of noises no effect has altered, see src.energy_stats;
+# the energies are logged with the noise and reused on replay) and "energy_level" ("mean", the default, or "active")
+
+# Each stage type declares:
+# (1) setup   : work done once per run (e.g. listing a folder, opening an IR archive, refreshing energy statistics)
+# (2) sample  : the random draws of the stage (generation only), e.g. the IR mix mode or the SNR
+# (3) execute : runs the stage on an item with the draws, and returns the parameters to be logged
+# (4) replay  : runs the stage again from its logged parameters, for exact regeneration of a dataset
+# Stages logged as None (e.g. "simulate_fabric" in a bulk_generation_simple log) are skipped on replay,
+# so 1 replay config (REPLAY_STAGES) regenerates the logs of both generators
+# Alternative (e.g. parallel, batched or cached) executors are plugged in with register_stage, under a new stage type
+# With a "batching" section in the config, items run in batches of similar duration (see src.batch_scheduler),
+# each stage over the whole batch, so that stages with an execute_batch (e.g. "phone_batched") vectorise over it
+# Audio is kept in 1 working dtype throughout (see src.numeric_policy): "dtype" in the config sets it ("float32", the default,
+# or "float64"), and with "check_numerics": True every stage's output is checked (dtype and contiguity) instead of converted
+
+import contextlib
+import json
+import os
+import random
+import tempfile
+from datetime import datetime
+
+import torch
+
+from src.audio_effects_new import audio_effector
+from src.audio_index import corpus_table
+from src.audio_index import draw_audio
+from src.audio_index import load_audio_index
+from src.audio_stacker import audio_noise_stack
+from src.audio_stacker import noise_layer_mix
+from src.batch_scheduler import padding_ratio
+from src.batch_scheduler import schedule_batches
+from src.debug_taps import WavFileTap
+from src.debug_taps import emit
+from src.debug_taps import register_tap
+from src.debug_taps import unregister_tap
+from src.energy_stats import build_energy_stats
+from src.ir_archive import has_ir
+from src.ir_archive import is_ir_archive
+from src.ir_archive import load_ir_archive
+from src.ir_convolve import ir_convolve
+from src.ir_mix import precompute_mixes
+from src.noise_builder import noise_builder
+from src.noise_sizer import noise_sizer
+from src.numeric_policy import check_audio
+from src.numeric_policy import set_working_dtype
+from src.numeric_policy import to_working
+from src.output_sink import AsyncWriter
+from src.output_sink import make_output_sink
+from src.phone_lowpass import phone_augment
+from src.phone_lowpass import phone_channel
+from src.post_convo_sizer import post_convo_sizer
+from src.speech_store import load_speech_store
+from src.speech_store import random_segment_start
+from src.speech_store import segment_audio
+from src.speech_store import store_table
+from src.utils.loader import load_audio_with_pytorch
+
+# The experiment log of every item starts from this template (key order included)
+LOG_TEMPLATE = {"serial":                None,
+                "file_name":             None,
+                "original_speech_file":  None,
+                "sampling_rate":         None,
+                "sample_len":            None,
+                "generate_clean_speech": None,
+                "add_room_reverb":       None,
+                "stationary_noise":      None,
+                "nonstationary_noise":   None,
+                "combine_speech_noise":  None,
+                "simulate_fabric":       None,
+                "simulate_mobile":       None,
+                "simulate_codec":        None,
+                "phone_lowpass":         None}
+
+STAGES = {}
+
+
+class SkipItem(Exception):
+    """
+    Raised by a stage to skip the current item (e.g. when a file needed to replay it is missing).
+    """
+    pass
+
+
+def register_stage(name, execute, replay=None, sample=None, setup=None, log_key=None, execute_batch=None, duration=None):
+    """
+    Registers a stage type, so that configs can refer to it by name.
+
+    Arguments:
+    - str       name            : The name of the stage type, e.g. "ir"
+    - callable  execute         : execute(item, options, context, draws) runs the stage on item; returns the parameters to log
+    - callable  replay          : replay(item, options, context, logged) runs the stage from its logged parameters
+    - callable  sample          : sample(options, context) makes the random draws of the stage; returns a dict of draws
+    - callable  setup           : setup(options) does the work needed once per run; returns a dict (the context of the stage)
+    - str       log_key         : The default log key of the stage (overridden by the "log_key" option)
+    - callable  execute_batch   : Optionally, execute_batch(items, options, context, draws) runs the stage on a batch
+                                : of items at once (see run_pipeline); returns the parameters to log, 1 per item
+    - callable  duration        : Optionally, duration(options, context, draws) returns the duration (in seconds) of the
+                                : item the draws will make, ahead of running it; required of the first stage to batch items
+    """
+    STAGES[name] = {"execute": execute, "replay": replay, "sample": sample, "setup": setup, "log_key": log_key,
+                    "execute_batch": execute_batch, "duration": duration}
+
+
+def load_pipeline_config(path):
+    """
+    Reads a pipeline config from a YAML (.yaml/.yml) or JSON file.
+    """
+    with open(path, "r") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+## Stage: clean speech (III-A)
+def _corpus_table(options):
+    # Only valid audio files are drawn (see src.audio_index), optionally weighted by duration or within a range of durations
+    return corpus_table(options["folder"],
+                        weight=options.get("weight"),
+                        min_duration_s=options.get("min_duration_s"),
+                        max_duration_s=options.get("max_duration_s"))
+
+
+def _clean_speech_setup(options):
+    # Speech may also come from a speech store (see src.speech_store), where segments are read without decoding
+    if options.get("store"):
+        store = load_speech_store(options["store"])
+        return {"store": store,
+                "sr":    store["sampling_rate"],
+                "table": store_table(store,
+                                     weight=options.get("weight"),
+                                     min_duration_s=options.get("min_duration_s"),
+                                     max_duration_s=options.get("max_duration_s"))}
+    return {"store": None, "sr": 16000, "table": _corpus_table(options)}
+
+
+def _speech_length(options, context, speech_file):
+    ## The length of a speech file in samples, at the sampling rate the pipeline loads it at
+    if context["store"] is not None:
+        return context["store"]["files"][speech_file]["length"]
+    entry = load_audio_index(options["folder"])["files"][speech_file]
+    return entry["frames"] * context["sr"] // entry["sampling_rate"]
+
+
+def _clean_speech_sample(options, context):
+    draws = {"speech_file": draw_audio(context["table"])}
+    # With segment_seconds, only a random segment of the speech file is used
+    if options.get("segment_seconds"):
+        segment_length = int(options["segment_seconds"] * context["sr"])
+        draws["segment_start"] = random_segment_start(_speech_length(options, context, draws["speech_file"]), segment_length)
+        draws["segment_length"] = segment_length
+    return draws
+
+
+def _clean_speech_duration(options, context, draws):
+    # Read from the corpus index (or store); close enough for scheduling, as tempo changes are within +/-20%
+    n_samples = _speech_length(options, context, draws["speech_file"]) - draws.get("segment_start", 0)
+    return min(n_samples, draws.get("segment_length", n_samples)) / context["sr"]
+
+
+def _load_speech(options, context, speech_file, segment_start=None, segment_length=None):
+    if context["store"] is not None:
+        return segment_audio(context["store"], speech_file, start=segment_start or 0, length=segment_length)
+
+    sample_data, sr = load_audio_with_pytorch(os.path.join(options["folder"], speech_file), target_freq=context["sr"])
+    if segment_start is not None:
+        sample_data = sample_data[:, segment_start:segment_start + segment_length]
+    return sample_data, sr
+
+
+def _clean_speech_execute(item, options, context, draws):
+    sample_data, sr = _load_speech(options, context, draws["speech_file"],
+                                   segment_start=draws.get("segment_start"),
+                                   segment_length=draws.get("segment_length"))
+    # Implement efects on speech data (only tempo and pitch shift)
+    sample_data, sr, paras = audio_effector(sample_data,
+                                            tempo_change=options.get("tempo_change", True),
+                                            pitch_shift=options.get("pitch_shift", True))
+    item["audio"], item["sr"] = sample_data, sr
+
+    # Log the segment (in samples at 16kHz), for regeneration
+    if "segment_start" in draws:
+        paras["segment_start"] = draws["segment_start"]
+        paras["segment_length"] = draws["segment_length"]
+
+    item["log"]["original_speech_file"] = draws["speech_file"]
+    item["log"]["sampling_rate"] = sr
+    item["log"]["sample_len"] = sample_data.shape[1]
+    return paras
+
+
+def _clean_speech_replay(item, options, context, logged):
+    speech_file = item["log"]["original_speech_file"]
+    if context["store"] is not None:
+        if speech_file not in context["store"]["files"]:
+            raise SkipItem(f"{speech_file} not found in {context['store']['path']}")
+    elif not os.path.isfile(os.path.join(options["folder"], speech_file)):
+        raise SkipItem(f"{os.path.join(options['folder'], speech_file)} not found")
+
+    tempo_change_rate = logged.get("tempo_change_rate")
+    pitch_shift = logged.get("pitch_shift")
+    sample_data, sr = _load_speech(options, context, speech_file,
+                                   segment_start=logged.get("segment_start"),
+                                   segment_length=logged.get("segment_length"))
+    item["audio"], item["sr"], _ = audio_effector(sample_data,
+                                                  tempo_change=tempo_change_rate is not None,
+                                                  tempo_range=(tempo_change_rate, tempo_change_rate),
+                                                  pitch_shift=pitch_shift is not None,
+                                                  pitch_shift_range=(pitch_shift, pitch_shift))
+
+
+## Stage: IR convolution (III-B room, III-E fabric, III-F mobile)
+def _ir_setup(options):
+    # The IR folders may also be IR archives (see src.ir_archive); open them once up front
+    folder = options["folder"]
+    ir_repo = load_ir_archive(folder) if is_ir_archive(folder) else folder
+    # Optionally, work out every mix of the bank up front (only for small banks, see src.ir_mix.precompute_mixes)
+    if options.get("precompute_mixes") and "random_mix" in options["modes"]:
+        count = precompute_mixes(ir_repo, no_of_ir=options.get("no_of_ir", 4), method=options.get("mix_method", "time"))
+        print(f"{count} mixes of {folder} precomputed")
+    return {"ir_repo": ir_repo,
+            # e.g. {"random_mix": 9, "random_single": 1} >> 90% chance of mixing IRs, 10% chance of a single random IR
+            "mode_pool": [mode for mode, weight in options["modes"].items() for _ in range(weight)]}
+
+
+def _ir_sample(options, context):
+    if len(options["modes"]) == 1:
+        return {"mode": context["mode_pool"][0]}
+    return {"mode": random.choice(context["mode_pool"])}
+
+
+def _ir_convolve_and_size(item, options, **kwargs):
+    sample_data, sr, size_orig, IR_applied, paras = ir_convolve(item["audio"], item["sr"],
+                                                                output_window=options["output_window"],
+                                                                **kwargs)
+    # Rightsize convolved data; with the "peak" window, the pre-peak samples were never computed
+    item["audio"] = post_convo_sizer(audio_data=sample_data,
+                                     size_orig=size_orig,
+                                     convo_type=options["convo_type"],
+                                     IR_applied=IR_applied,
+                                     peak_index=0 if options["output_window"] == "peak" else None)
+    item["sr"] = sr
+    return paras
+
+
+def _ir_execute(item, options, context, draws):
+    return _ir_convolve_and_size(item, options,
+                                 mode=draws["mode"],
+                                 ir_repo=context["ir_repo"],
+                                 no_of_ir=options.get("no_of_ir", 4),
+                                 mix_method=options.get("mix_method", "time"))
+
+
+def _ir_replay(item, options, context, logged):
+    # File check
+    missing = [ir for ir in logged["RIRs_used"] if not has_ir(context["ir_repo"], ir)]
+    if missing:
+        raise SkipItem(f"{', '.join(missing)} not found in {options['folder']}")
+
+    _ir_convolve_and_size(item, options,
+                          mode="specific_mix",
+                          ir_repo=context["ir_repo"],
+                          mix_ir_list=logged["RIRs_used"],
+                          mix_method=logged.get("mix_method", "time"))
+
+
+## Stage: noise (III-C)
+def _noise_setup(options):
+    # The energy statistics of the noise folder are refreshed incrementally (only new or changed files are decoded)
+    return {"table": _corpus_table(options),
+            "stats_index": build_energy_stats(options["folder"]) if options.get("energy_stats") else None}
+
+
+def _noise_sample(options, context):
+    return {"no_of_audio": random.randint(options["no_of_audio"][0], options["no_of_audio"][1])}
+
+
+def _noise_execute(item, options, context, draws):
+    noise_data, _, paras = noise_builder(item["audio"],
+                                         options["folder"],
+                                         no_of_audio=draws["no_of_audio"],
+                                         echo=options.get("echo", False),
+                                         low_pass=options.get("low_pass", False),
+                                         mode=options["mode"],
+                                         noise_table=context["table"],
+                                         stats_index=context["stats_index"],
+                                         level=options.get("energy_level", "mean"))
+    item[options["into"]] = noise_data
+    _noise_energy(item, options, paras)
+    return paras
+
+
+def _noise_energy(item, options, logged):
+    # A single noise which was looked up in the energy statistics keeps its energy, for the mix to stack it with
+    if len(logged) == 1 and logged["noise_1"].get("energy") is not None:
+        item[f"{options['into']}_energy"] = logged["noise_1"]["energy"]
+
+
+def _noise_replay(item, options, context, logged):
+    # File check
+    missing = [logged[f"noise_{serial + 1}"]["noise_name"] for serial in range(len(logged))
+               if not os.path.isfile(os.path.join(options["folder"], logged[f"noise_{serial + 1}"]["noise_name"]))]
+    if missing:
+        raise SkipItem(f"{', '.join(missing)} not found in {options['folder']}")
+
+    sample_data = item["audio"]
+    noise_layers = None
+    NNR_list = []
+
+    # a. Regenerate piecewise noise
+    for serial in range(len(logged)):
+        noise_paras = logged[f"noise_{serial + 1}"]
+        effects = noise_paras["effects"]
+
+        # The number of echos might be 0, in which case no delays/decays were logged
+        echo = "list_of_delays" in effects
+        low_pass = "low_pass" in effects
+
+        # Read audio file and rebuild noise
+        noise_data, _ = load_audio_with_pytorch(os.path.join(options["folder"], noise_paras["noise_name"]))
+        noise_data, _, _ = audio_effector(audio_wav=noise_data,
+                                          sr=item["sr"],
+                                          echo=echo,
+                                          low_pass=low_pass,
+                                          list_of_delays=effects.get("list_of_delays"),
+                                          list_of_decays=effects.get("list_of_decays"),
+                                          low_pass_order=(effects["low_pass"]["low_pass_order"],) * 2 if low_pass else None,
+                                          low_pass_cutoff=(effects["low_pass"]["low_pass_cutoff"],) * 2 if low_pass else None)
+
+        # Size data; with more than 1 noise, write it straight into its row of the noise stack
+        if len(logged) > 1 and noise_layers is None:
+            noise_layers = torch.empty((len(logged), sample_data.shape[1]), dtype=noise_data.dtype)
+        noise_data, _ = noise_sizer(sample_data, noise_data, mode=options["mode"], pad_size=noise_paras["pad_size"],
+                                    out=None if noise_layers is None else noise_layers[serial:serial + 1])
+
+        # Collect NNR data; the first noise is the "base" of the stack and has no NNR
+        if serial > 0:
+            NNR_list.append(noise_paras["noise_to_stack_NNR"])
+
+    # b. Stack noise using NNR data, in the same way as noise_builder
+    # Note that in the event where number of noise = 0, a near-zero array is passed on to the next stage
+    if len(logged) == 1:
+        item[options["into"]] = noise_data
+    elif len(logged) > 1:
+        # The layers are scaled by the energies logged (if looked up in the energy statistics), not computed ones
+        item[options["into"]] = noise_layer_mix(noise_layers, NNR_list,
+                                                layer_energies=[logged[f"noise_{serial + 1}"].get("energy")
+                                                                for serial in range(len(logged))])
+    else:
+        item[options["into"]] = torch.zeros_like(sample_data) + 1e-14
+    _noise_energy(item, options, logged)
+
+
+## Stage: combining speech and noise (III-D)
+def _mix_sample(options, context):
+    return {"stationary_nonstationary_NNR": random.uniform(options["NNR_range"][0], options["NNR_range"][1]),
+            "speech_noise_SNR":             random.uniform(options["SNR_range"][0], options["SNR_range"][1])}
+
+
+def _mix_execute(item, options, context, draws):
+    noise_1, noise_2 = options.get("noises", ("noise_stationary", "noise_nonstationary"))
+    # Noise files may be decoded in another dtype than the speech; no implicit upcast when stacking
+    combined_noise_data = audio_noise_stack(to_working(item.pop(noise_1)), to_working(item.pop(noise_2)),
+                                            draws["stationary_nonstationary_NNR"],
+                                            energy_1=item.pop(f"{noise_1}_energy", None),
+                                            energy_2=item.pop(f"{noise_2}_energy", None))
+    item["audio"] = audio_noise_stack(item["audio"], combined_noise_data, draws["speech_noise_SNR"])
+    return {"stationary_nonstationary_NNR": draws["stationary_nonstationary_NNR"],
+            "speech_noise_SNR":             draws["speech_noise_SNR"]}
+
+
+def _mix_replay(item, options, context, logged):
+    _mix_execute(item, options, context, logged)
+
+
+## Stage: codec (III-G)
+def _opus_round_trip(item):
+    from src.encoding_scripts.opus import decode_opus
+    from src.encoding_scripts.opus import encode_opus
+
+    import torchaudio
+
+    temp_file_path = os.path.join(item["tmpdir"], "sample_audio.wav")
+    torchaudio.save(temp_file_path, item["audio"], sample_rate=item["sr"], encoding="PCM_S", bits_per_sample=16)
+    ## Encode and Decode audio
+    opus_encoded_path = encode_opus(wav_path=temp_file_path, tmp_folder=item["tmpdir"])
+    return opus_encoded_path, decode_opus
+
+
+def _codec_execute(item, options, context, draws):
+    if options.get("codec", "opus") != "opus":
+        raise ValueError("codec not supported")
+
+    opus_encoded_path, decode_opus = _opus_round_trip(item)
+    if options.get("format", "wav") == "opus":
+        item["dirty"] = opus_encoded_path
+        item["dirty_name"] = f"{item['serial']}_sample_audio.opus"
+    else:
+        item["dirty"] = decode_opus(opus_encoded_path=opus_encoded_path, output_folder=item["tmpdir"], count=str(item["serial"]))
+        item["dirty_name"] = os.path.basename(item["dirty"])
+
+    # log parameters: file name
+    item["log"]["file_name"] = item["dirty_name"]
+    return "opus"
+
+
+def _codec_replay(item, options, context, logged):
+    if logged != "opus":
+        raise SkipItem("codec not supported")
+
+    opus_encoded_path, decode_opus = _opus_round_trip(item)
+    item["dirty"] = decode_opus(opus_encoded_path=opus_encoded_path,
+                                output_folder=item["tmpdir"],
+                                decoded_path="regenerated_sample_audio.wav")
+    item["dirty_name"] = item["log"]["file_name"]
+
+
+## Stage: telephone band-pass (III, instead of III-E, F and G)
+def _phone_execute(item, options, context, draws):
+    if options.get("channel") is None:
+        item["audio"], item["sr"] = phone_augment(item["audio"], item["sr"])
+        logged = True
+    else:
+        item["audio"], item["sr"], channel_paras = phone_channel(item["audio"], item["sr"], **options["channel"])
+        logged = channel_paras[0]
+
+    item["dirty"] = (item["audio"], item["sr"])
+    item["dirty_name"] = f"phone_lowpass_sample_{item['serial']}.wav"
+    item["log"]["file_name"] = item["dirty_name"]
+    return logged
+
+
+def _phone_execute_batch(items, options, context, draws):
+    # The telephone channel model runs over a (B, n_samples) batch in 1 call, clips zero-padded to the longest one
+    # The padding shifts the (zero-phase) filter transients at the end of shorter clips, so the padded length is logged
+    # with the channel parameters of each clip, and replay pads the same way
+    if options.get("channel") is None or len({item["sr"] for item in items}) > 1:
+        return [_phone_execute(item, options, context, item_draws) for item, item_draws in zip(items, draws)]
+
+    lengths = [item["audio"].shape[-1] for item in items]
+    batch = torch.zeros((len(items), max(lengths)), dtype=items[0]["audio"].dtype)
+    for row, item in enumerate(items):
+        batch[row, :lengths[row]] = item["audio"][0]
+
+    batch, sr, channel_paras = phone_channel(batch, items[0]["sr"], **options["channel"])
+    for row, item in enumerate(items):
+        item["audio"], item["sr"] = batch[row:row + 1, :lengths[row]].clone(), sr
+        item["dirty"] = (item["audio"], item["sr"])
+        item["dirty_name"] = f"phone_lowpass_sample_{item['serial']}.wav"
+        item["log"]["file_name"] = item["dirty_name"]
+    return [dict(paras, padded_length=max(lengths)) for paras in channel_paras]
+
+
+def _phone_replay(item, options, context, logged):
+    # A logged dict holds the parameters of the telephone channel model; True is the fixed band-pass
+    # Clips synthesised in a batch are zero-padded to the padded_length logged, as they were then (see _phone_execute_batch)
+    if isinstance(logged, dict):
+        n_samples = item["audio"].shape[-1]
+        padded = torch.zeros((1, logged.get("padded_length", n_samples)), dtype=item["audio"].dtype)
+        padded[0, :n_samples] = item["audio"][0]
+        padded, item["sr"], _ = phone_channel(padded, item["sr"], channel_params=[logged])
+        item["audio"] = padded[:, :n_samples].clone()
+    else:
+        item["audio"], item["sr"] = phone_augment(item["audio"], item["sr"])
+    item["dirty"] = (item["audio"], item["sr"])
+    item["dirty_name"] = f"phone_lowpass_sample_{item['serial']}.wav"
+
+
+register_stage("clean_speech", _clean_speech_execute, replay=_clean_speech_replay, sample=_clean_speech_sample,
+               setup=_clean_speech_setup, log_key="generate_clean_speech", duration=_clean_speech_duration)
+register_stage("ir", _ir_execute, replay=_ir_replay, sample=_ir_sample, setup=_ir_setup)
+register_stage("noise", _noise_execute, replay=_noise_replay, sample=_noise_sample, setup=_noise_setup)
+register_stage("mix", _mix_execute, replay=_mix_replay, sample=_mix_sample, log_key="combine_speech_noise")
+register_stage("codec", _codec_execute, replay=_codec_replay, log_key="simulate_codec")
+register_stage("phone", _phone_execute, replay=_phone_replay, log_key="phone_lowpass")
+register_stage("phone_batched", _phone_execute, replay=_phone_replay, log_key="phone_lowpass", execute_batch=_phone_execute_batch)
+
+
+def speech_noise_stages(speech_folder="./data/00_raw_speech/",
+                        room_ir_folder="./data/Impulse_Responses/room_IRs/",
+                        noise_stationary_folder="./data/01_stationary_noise/",
+                        noise_nonstationary_folder="./data/02_non-stationary_noise/",
+                        speech_store=None,
+                        segment_seconds=None):
+    """
+    Returns the stages shared by every pipeline: clean speech, room reverb, noise and speech/noise mixing (III-A to D).
+    """
+    return [{"stage": "clean_speech", "folder": speech_folder, "store": speech_store, "segment_seconds": segment_seconds,
+             "clean": True, "tap": "preroom"},
+            {"stage": "ir", "log_key": "add_room_reverb", "folder": room_ir_folder,
+             "modes": {"random_single": 1}, "convo_type": "room", "output_window": "peak", "tap": "postroom"},
+            {"stage": "noise", "log_key": "stationary_noise", "into": "noise_stationary", "folder": noise_stationary_folder,
+             "no_of_audio": [1, 2], "echo": True, "low_pass": True, "mode": "stationary"},
+            {"stage": "noise", "log_key": "nonstationary_noise", "into": "noise_nonstationary", "folder": noise_nonstationary_folder,
+             "no_of_audio": [0, 2], "echo": True, "mode": "non-stationary"},
+            {"stage": "mix", "NNR_range": [-5, 20], "SNR_range": [-5, 20], "tap": "postnoise"}]
+
+
+def device_stages(fabric_ir_folder="./data/Impulse_Responses/fabric_IRs/",
+                  handphone_ir_folder="./data/Impulse_Responses/handphone_IRs/",
+                  dirty_format="wav"):
+    """
+    Returns the stages simulating fabric, mobile phone and codec (III-E to G).
+    """
+    return [{"stage": "ir", "log_key": "simulate_fabric", "folder": fabric_ir_folder,
+             "modes": {"random_mix": 9, "random_single": 1}, "convo_type": "fabric", "output_window": "head", "tap": "postfabric"},
+            {"stage": "ir", "log_key": "simulate_mobile", "folder": handphone_ir_folder,
+             "modes": {"random_mix": 1}, "convo_type": "mobile", "output_window": "peak", "tap": "postmobile"},
+            {"stage": "codec", "codec": "opus", "format": dirty_format}]
+
+
+def _skip(item, e):
+    print(e)
+    print(f"Skipping regen of {item['log']['file_name']}")
+    item["skipped"] = True
+
+
+def _run_batch(items, stages, contexts, replaying, first_draws=None, check_numerics=False):
+    # Stages run 1 at a time over the whole batch, so that a stage with a batched executor sees every item at once
+    for position, ((stage, options), context) in enumerate(zip(stages, contexts)):
+        log_key = options.get("log_key", stage["log_key"])
+        live = [item for item in items if not item["skipped"]]
+
+        if replaying:
+            for item in live:
+                logged = item["log"].get(log_key)
+                # Stages which did not run when the item was generated are skipped
+                if logged is None:
+                    continue
+                try:
+                    stage["replay"](item, options, context, logged)
+                except SkipItem as e:
+                    _skip(item, e)
+        else:
+            # The draws of the first stage may have been made up front, to schedule the batches
+            if position == 0 and first_draws is not None:
+                draws = [first_draws[item["serial"]] for item in live]
+            else:
+                draws = [stage["sample"](options, context) if stage["sample"] is not None else {} for _ in live]
+
+            if stage["execute_batch"] is not None and len(live) > 1:
+                for item, logged in zip(live, stage["execute_batch"](live, options, context, draws)):
+                    item["log"][log_key] = logged
+            else:
+                for item, item_draws in zip(live, draws):
+                    try:
+                        item["log"][log_key] = stage["execute"](item, options, context, item_draws)
+                    except SkipItem as e:
+                        _skip(item, e)
+
+        for item in live:
+            if item["skipped"] or (replaying and item["log"].get(log_key) is None):
+                continue
+            # Stage boundary: audio goes on as a contiguous tensor of the working dtype (see src.numeric_policy)
+            if check_numerics:
+                check_audio(item["audio"], f"item {item['serial']}, after stage {options['stage']}")
+            else:
+                item["audio"] = to_working(item["audio"])
+            if options.get("clean") and not replaying:
+                # Copied, as later stages may work on the audio in place; encoded by the sink (see src.output_sink)
+                item["clean"] = (item["audio"].clone(), item["sr"])
+            if options.get("tap"):
+                emit(options["tap"], item["serial"], item["audio"], item["sr"])
+
+
+def _schedule(config, stages, contexts, number_of_audios):
+    ## Makes the draws of the first stage up front, and groups items into batches of similar duration
+    batching = config.get("batching")
+    if not batching:
+        return [[serial] for serial in range(number_of_audios)], None
+
+    stage, options = stages[0]
+    if stage["duration"] is None:
+        raise ValueError(f"Batching needs a first stage whose duration is known up front, not {options['stage']}")
+
+    first_draws = {serial: stage["sample"](options, contexts[0]) for serial in range(number_of_audios)}
+    durations = {serial: stage["duration"](options, contexts[0], draws) for serial, draws in first_draws.items()}
+    batches = schedule_batches(durations,
+                               max_batch_s=batching.get("max_batch_s", 600.0),
+                               bucket_ratio=batching.get("bucket_ratio", 1.25),
+                               max_batch_items=batching.get("max_batch_items"))
+    print(f"{number_of_audios} items scheduled into {len(batches)} batches "
+          f"({padding_ratio(batches, durations):.1%} padding)")
+    return batches, first_draws
+
+
+def run_pipeline(config,
+                 number_of_audios=10,
+                 replay_log=None,
+                 sink=None,
+                 debug_taps=None,
+                 debug_dumps=False,
+                 async_writers=2,
+                 async_queue=32):
+    """
+    Runs the stages of a pipeline config for every item, and writes each clean/dirty pair into an output sink.
+    With a "batching" section in config, e.g. {"max_batch_s": 600, "bucket_ratio": 1.25, "max_batch_items": 32},
+    items are synthesised in batches of similar duration (see src.batch_scheduler), for stages with batched executors.
+    Audio is kept in the working dtype of config ("dtype", float32 by default) from stage to stage (see src.numeric_policy).
+    Items keep their serial numbers either way, and the experiment log is in serial order.
+
+    Arguments:
+    - dict/str  config              : The pipeline config, or the path of a YAML/JSON file holding it (see top of module)
+    - int       number_of_audios    : The number of items to generate (ignored when replaying)
+    - list      replay_log          : An experiment log; if given, its items are replayed (regenerated) instead
+    - sink      sink                : The output sink (see src.output_sink); defaults to the "output" section of config
+    - list      debug_taps          : Taps to register for this run (see src.debug_taps)
+    - bool      debug_dumps         : If True, writes the intermediates as test_<point>.wav
+    - int       async_writers       : The number of background threads writing debug files; 0 writes synchronously
+    - int       async_queue         : The number of writes which may be waiting before the pipeline blocks
+
+    Returns:
+    - list experiment log (the replayed log, when replaying)
+    raises ValueError : if a stage type is not registered
+    raises TypeError : with "check_numerics" in config, if a stage outputs audio of another dtype than the working dtype
+    """
+    if isinstance(config, str):
+        config = load_pipeline_config(config)
+    set_working_dtype(config.get("dtype", "float32"))
+
+    unknown = [options["stage"] for options in config["stages"] if options["stage"] not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {', '.join(unknown)}; registered stages are {', '.join(STAGES)}")
+    stages = [(STAGES[options["stage"]], options) for options in config["stages"]]
+    contexts = [stage["setup"](options) if stage["setup"] is not None else {} for stage, options in stages]
+
+    replaying = replay_log is not None
+    output = config.get("output", {})
+    output_folder = output.get("folder", "./output")
+
+    # Replay runs item by item, in the order of the log
+    if replaying:
+        batches, first_draws = [[serial] for serial in range(len(replay_log))], None
+    else:
+        batches, first_draws = _schedule(config, stages, contexts, number_of_audios)
+
+    # Set up where the samples go (see src.output_sink); written in the background unless async_writers is 0
+    if sink is None:
+        sink = make_output_sink(output.get("sink", "loose"), output_folder=output_folder,
+                                shard_size_mb=output.get("shard_size_mb", 1024),
+                                async_queue=async_queue if async_writers > 0 else 0)
+    writer = AsyncWriter(workers=async_writers, max_queue=async_queue) if async_writers > 0 else None
+
+    # Intermediates are only encoded and written if a tap is registered (see src.debug_taps)
+    debug_taps = list(debug_taps or [])
+    if debug_dumps:
+        debug_taps.append(WavFileTap(writer=writer))
+    for tap in debug_taps:
+        register_tap(tap)
+
+    experiment_log = {}
+    done = 0
+    try:
+        for batch in batches:
+            # Each item gets a scratch folder, e.g. for the codec round trip
+            with contextlib.ExitStack() as stack:
+                items = [{"serial":     serial,
+                          "audio":      None,
+                          "sr":         None,
+                          "log":        replay_log[serial] if replaying else dict(LOG_TEMPLATE, serial=serial),
+                          "tmpdir":     stack.enter_context(tempfile.TemporaryDirectory()),
+                          "clean":      None,
+                          "dirty":      None,
+                          "dirty_name": None,
+                          "skipped":    False}
+                         for serial in batch]
+
+                _run_batch(items, stages, contexts, replaying, first_draws=first_draws,
+                           check_numerics=config.get("check_numerics", False))
+
+                for item in items:
+                    if item["skipped"]:
+                        continue
+
+                    # Pipelines without a codec or phone stage output the audio as it is after the last stage
+                    if item["dirty"] is None:
+                        item["dirty"] = (item["audio"], item["sr"])
+                        item["dirty_name"] = f"{item['serial']}_dirty.wav"
+                        item["log"]["file_name"] = item["dirty_name"]
+
+                    written_to = sink.write(item["serial"], item["clean"], item["dirty"], item["dirty_name"],
+                                            params=item["log"])
+                    print(f"audio {written_to or item['dirty_name']} generated!")  # None if written in the background
+                    experiment_log[item["serial"]] = item["log"]
+
+            done += len(batch)
+            if replaying and done % 100 == 0:
+                print(f"{done} files generated!")
+    finally:
+        # Barrier: every file is on disk before the log is finalised
+        for tap in debug_taps:
+            unregister_tap(tap)
+        if writer is not None:
+            writer.close()
+        sink.close()
+
+    if replaying:
+        return replay_log
+
+    # Export parameters log as json
+    # Use datetime module to serialise log file
+    timestamp = datetime.now().strftime("%y%m%d_%H%M%S")
+    # The log is in serial order, whatever order the batches ran in
+    experiment_log = [experiment_log[serial] for serial in sorted(experiment_log)]
+    with open(os.path.join(output_folder, f"experiment_log_{timestamp}.json"), "w") as f:
+        json.dump(experiment_log, f, indent=2)
+
+    return experiment_log
@@ -38,7 +38,8 @@ import torch
 def post_convo_sizer(audio_data,
                      size_orig,  # Fed in from previous synthesis step
                      convo_type,  # "room", "mobile", or "fabric",
-                     IR_applied=None):
+                     IR_applied=None,
+                     peak_index=None):
     """
     Arguments:
     - torch tensor  audio_data  : The convolved audio data, to be correct-sized
@@ -46,19 +47,25 @@ def post_convo_sizer(audio_data,
     - str           convo_type  : The type of convolution performed on the audio
                                 : Either "room", "mobile", or "fabric" 
     - numpy_array   IR_applied  : The IR that was convolved onto the audio
+    - int           peak_index  : For "room" and "mobile", the peak index of IR_applied, if already known
+                                : (src.ir_convolve logs it in its parameters as "peak_index")
+                                : If None, it is located in IR_applied
 
     Returns:
     - torch tensor of dimension [len(adjusted_audio_data), 1]
     """
-    ## Numpify torch tensor for following operations
-    audio_data = np.squeeze(audio_data.numpy())
+    ## Work on the torch tensor directly; slicing returns views, so audio that is already sized
+    ## (e.g. convolved with an output_window in src.ir_convolve) is not copied at all
+    audio_data = torch.squeeze(audio_data)
 
     ## For Room IR and mobile IR, detect initial peak in IR and deduct the time gap from front of convolved audio
     if convo_type == "room" or convo_type == "mobile":
 
-        # Detect 1st (and logically highest peak in the room IR)
-        peak_index = np.argmax(np.abs(IR_applied))
-        print(f"IR peak detected at sample #{peak_index}")
+        # Detect 1st (and logically highest peak in the room IR), unless it was passed in
+        # (a peak_index of 0 means the pre-peak samples were never computed, see output_window in src.ir_convolve)
+        if peak_index is None:
+            peak_index = np.argmax(np.abs(IR_applied))
+            print(f"IR peak detected at sample #{peak_index}")
 
         # Truncate front-end of convolved audio
         audio_data = audio_data[peak_index:]
@@ -69,10 +76,10 @@ def post_convo_sizer(audio_data,
 
         # if audio_data ends up being shorter than original audio, pad with zeros
         else:
-            audio_data = np.pad(audio_data,
-                                (0, size_orig - len(audio_data)),
-                                mode="constant",
-                                constant_values=0)
+            audio_data = torch.nn.functional.pad(audio_data,
+                                                 (0, size_orig - len(audio_data)),
+                                                 mode="constant",
+                                                 value=0)
 
     ## Return audio to original size directly if convolving with fabric IR
     elif convo_type == "fabric":
@@ -81,7 +88,7 @@ def post_convo_sizer(audio_data,
     else:
         raise ValueError("please input a correct convo_type")
 
-    ## Repack numpy array into a torch tensor
-    audio_data = torch.from_numpy(np.expand_dims(audio_data, axis=0))
+    ## Repack into audio_data format as per pytorch
+    audio_data = audio_data.unsqueeze(0)
 
     return audio_data
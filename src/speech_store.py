@@ -0,0 +1,193 @@
+## AJS's Speech Store
+# This module packs a folder of speech files into a single speech store, and reads segments of speech back from it
+
+# Use Case: This was developed for the Far-Field Audio Synthesis Toolkit (FAST)
+# load_audio_with_pytorch decodes (and resamples) a whole speech file on every pick,
+# even when only a few seconds of it are used; long sources (e.g. a feature-length film) are decoded over and over
+# A speech store is a folder holding:
+# (1) speech_data.bin       : all speech files, decoded and resampled once (to 16kHz by default),
+#                           : concatenated into 1 flat float32 (or int16, for half the size) array, memory-mapped when read
+# (2) speech_metadata.json  : sampling rate, dtype, and per-file offset and length into speech_data.bin
+#                           : (plus the sampling rate and channels of the source file)
+# Files keep their original names as keys, so experiment logs read the same whether speech came from a folder or a store
+# Speech is stored as mono (the first channel of the source), as the pipeline works on (1, n_samples) audio
+
+# segment(store, file, start, length) then returns a view into the memory map, i.e. nothing is read from disk
+# until the samples are used, and nothing is decoded at all
+# The map is copy-on-write, so a stage modifying its audio in place never touches the store on disk
+
+import json
+import os
+import random
+from functools import lru_cache
+
+import numpy as np
+import torch
+
+from src.audio_index import list_audio
+from src.audio_index import load_audio_index
+from src.audio_index import sampling_table
+from src.utils.loader import load_audio_with_pytorch
+
+SPEECH_DATA = "speech_data.bin"
+SPEECH_METADATA = "speech_metadata.json"
+INT16_SCALE = 32768.0
+
+
+def pack_speech_folder(speech_folder, store_path=None, sr=16000, dtype="float32"):
+    """
+    Converts a folder of speech files into a speech store; files are decoded and resampled 1 at a time.
+
+    Arguments:
+    - str   speech_folder   : The folder containing the speech files, e.g. "./data/00_raw_speech/"
+    - str   store_path      : The folder which the store will be written to (defaults to <speech_folder>.speechstore)
+    - int   sr              : The sampling rate of the store
+    - str   dtype           : "float32", or "int16" (speech scaled by 32768, i.e. 16-bit PCM)
+
+    Returns:
+    - dict store, as returned by load_speech_store
+    """
+    if dtype not in ("float32", "int16"):
+        raise ValueError('please input a correct dtype: "float32" or "int16"')
+    store_path = store_path or os.path.normpath(speech_folder) + ".speechstore"
+    os.makedirs(store_path, exist_ok=True)
+
+    files = {}
+    offset = 0
+    data_path = os.path.join(store_path, SPEECH_DATA)
+    # Written aside and renamed, so that a store which exists is always whole
+    with open(data_path + ".tmp", "wb") as f:
+        index = load_audio_index(speech_folder)
+        for name in list_audio(speech_folder):
+            # Resampled exactly as the pipeline does when it loads speech from the folder
+            waveform, _ = load_audio_with_pytorch(os.path.join(speech_folder, name), target_freq=sr)
+
+            speech = waveform[0].numpy().astype(np.float32, copy=False)
+            if dtype == "int16":
+                speech = np.clip(np.round(speech * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+            f.write(np.ascontiguousarray(speech).tobytes())
+
+            files[name] = {"offset":          offset,
+                           "length":          len(speech),
+                           "source_sr":       index["files"][name]["sampling_rate"],
+                           "source_channels": index["files"][name]["channels"]}
+            offset += len(speech)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(data_path + ".tmp", data_path)
+
+    with open(os.path.join(store_path, SPEECH_METADATA), "w") as f:
+        json.dump({"sampling_rate": sr, "dtype": dtype, "files": files}, f, indent=2)
+
+    # Drop any stale handle of a previous store at the same path
+    _open_speech_store.cache_clear()
+
+    return load_speech_store(store_path)
+
+
+def is_speech_store(store_path):
+    """
+    Returns True if store_path is a speech store (opened, or the path of one).
+    """
+    if isinstance(store_path, dict):
+        return True
+    return os.path.isfile(os.path.join(store_path, SPEECH_METADATA)) and os.path.isfile(os.path.join(store_path, SPEECH_DATA))
+
+
+@lru_cache(maxsize=4)
+def _open_speech_store(store_path):
+    with open(os.path.join(store_path, SPEECH_METADATA), "r") as f:
+        store = json.load(f)
+    # Memory-map the data, copy-on-write; nothing is read from disk until a segment is used
+    store["data"] = np.memmap(os.path.join(store_path, SPEECH_DATA), dtype=store["dtype"], mode="c")
+    store["path"] = store_path
+    return store
+
+
+def load_speech_store(store_path):
+    """
+    Opens a speech store. The speech data is memory-mapped, so this is O(1) in the size of the corpus,
+    and handles are cached, so reopening the same store is free.
+
+    Returns:
+    - dict with keys "sampling_rate", "dtype", "files" (per-file offset and length), "data" (memory map) and "path"
+    """
+    if isinstance(store_path, dict):
+        return store_path
+    return _open_speech_store(os.path.abspath(store_path))
+
+
+def segment(store, file, start=0, length=None):
+    """
+    Returns a segment of a speech file as a view into the store (no copy, nothing decoded).
+
+    Arguments:
+    - dict/str  store   : The speech store (opened, or its path)
+    - str       file    : The name of the speech file, e.g. "speech_001.wav"
+    - int       start   : The first sample of the segment, at the sampling rate of the store
+    - int       length  : The number of samples of the segment; None (or past the end of the file) runs to the end
+
+    Returns:
+    - numpy array of dimension (n_samples,), of the dtype of the store
+    raises KeyError : if the file is not in the store
+    """
+    store = load_speech_store(store)
+    entry = store["files"][file]
+    if not 0 <= start <= entry["length"]:
+        raise ValueError(f"Segment start {start} is outside of {file} ({entry['length']} samples)")
+
+    end = entry["length"] if length is None else min(entry["length"], start + length)
+    return store["data"][entry["offset"] + start:entry["offset"] + end]
+
+
+def segment_audio(store, file, start=0, length=None):
+    """
+    Returns a segment of a speech file as audio, in the format of load_audio_with_pytorch.
+    From a float32 store, the tensor shares memory with the store (zero-copy); from an int16 store, only the segment is converted.
+
+    Returns:
+    - torch tensor (float32) of dimension (1, n_samples), sampling_rate (int)
+    """
+    store = load_speech_store(store)
+    speech = segment(store, file, start=start, length=length)
+    if speech.dtype == np.int16:
+        speech = speech.astype(np.float32) / INT16_SCALE
+    return torch.from_numpy(speech).unsqueeze(0), store["sampling_rate"]
+
+
+def store_table(store, weight=None, min_duration_s=None, max_duration_s=None):
+    """
+    Returns a sampling table over the files of a speech store, as src.audio_index.corpus_table does for a folder.
+    """
+    store = load_speech_store(store)
+    durations = {name: entry["length"] / store["sampling_rate"] for name, entry in sorted(store["files"].items())}
+    durations = {name: duration for name, duration in durations.items()
+                 if (min_duration_s is None or duration >= min_duration_s)
+                 and (max_duration_s is None or duration <= max_duration_s)}
+    if not durations:
+        raise ValueError(f"No speech files to draw from in {store['path']}")
+    return sampling_table(durations, weight=weight)
+
+
+def random_segment_start(n_samples, segment_length, rng=random):
+    """
+    Draws the start of a segment of segment_length samples, uniformly within a file of n_samples samples.
+    Files shorter than the segment are used whole (start 0).
+    """
+    return rng.randint(0, max(0, n_samples - segment_length))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack a folder of speech files into a memory-mapped speech store")
+    parser.add_argument("--speech_folder", type=str, default="./data/00_raw_speech/", help="The folder of speech files to pack")
+    parser.add_argument("--store_path", type=str, default=None, help="Where to write the store (defaults to <speech_folder>.speechstore)")
+    parser.add_argument("--sr", type=int, default=16000, help="The sampling rate of the store")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "int16"])
+
+    args = parser.parse_args()
+
+    store = pack_speech_folder(args.speech_folder, args.store_path, sr=args.sr, dtype=args.dtype)
+    hours = sum(entry["length"] for entry in store["files"].values()) / store["sampling_rate"] / 3600
+    print(f"{len(store['files'])} speech files ({hours:.2f} h) packed into {store['path']}")
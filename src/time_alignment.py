@@ -20,14 +20,18 @@
 # The absence of a ready package doing this already is so surprising!
 # Perhaps publish a python package for it?
 
+import io
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-import librosa
-import matplotlib.pyplot as plt
 import numpy as np
+import scipy.fft
 import soundfile as sf  # to export librosa arrays into wav
 from scipy.signal import correlate
 
+from src.audio_index import list_audio
+
 
 def time_aligner(reference_path="./data/fabric_experiment/references/0Clean_0deg_NoCover_aligned.wav",
                  input_folder="./data/fabric_experiment/run2_recording",
@@ -62,6 +66,8 @@ def time_aligner(reference_path="./data/fabric_experiment/references/0Clean_0deg
     - default stft frame size is 2048.    
     """
 
+    import librosa
+
     # A. Read Reference audio (in this case will be the sine sweep recorded without passing through without any fabric)
     data_ref, sr1 = librosa.load(reference_path, sr=None)
 
@@ -130,6 +136,8 @@ def time_aligner(reference_path="./data/fabric_experiment/references/0Clean_0deg
             # (i.e. There isn't a need to perform corelation along the y-axis, since the time misalignment only occurs along time or x-axis)
             # Not sure how to only do a "full" correlation only along x-axis
             if preview_spec == True:
+                import matplotlib.pyplot as plt
+                import librosa.display
                 print(f"\nPreview Spec Mode is: ON. Displaying spectrograms for slice {index}...")
                 print(f"LHS: Reference, RHS: Audio to be Aligned")
 
@@ -214,3 +222,444 @@ def time_aligner(reference_path="./data/fabric_experiment/references/0Clean_0deg
 
         if just_preview_1:
             break
+
+
+## Batch alignment
+# time_aligner recomputes the STFT of the reference for every file, and correlates spectrograms at hop_length=32 throughout
+# time_aligner_batch instead:
+# (1) computes the sub-band spectra of the reference once
+# (2) searches coarsely (large hop) over the whole clip, correlating along the time axis only
+# (3) refines at hop_length, on a short excerpt around the loudest part of the reference, within a few coarse hops of (2)
+# Files are processed in parallel across a pool of processes
+
+def sub_band_spectra(data, hop_length, n_bands=5, n_fft=2048):
+    """
+    Computes the thresholded magnitude spectrogram of an audio clip, split into n_bands frequency bands;
+    the same pre-processing as time_aligner (F2 to F4). The last band is dropped, as in time_aligner.
+
+    Returns:
+    - list of n_bands - 1 numpy arrays of dimension (n_rows, n_frames)
+    """
+    import librosa
+    spec = np.abs(librosa.stft(data, n_fft=n_fft, hop_length=hop_length))
+
+    # F2: Removing rows before time-aligning (same rows as time_aligner)
+    n_rows_to_remove = int(2000 / (8000 / 2048))
+    spec = spec[:(len(spec) - n_rows_to_remove)]
+
+    # F3: Thresholding to reduce noise
+    arbitrary_noise_coefficient = 2
+    spec[spec < np.mean(spec) * arbitrary_noise_coefficient] = 0
+
+    # F4: Multiple points alignment
+    return np.array_split(spec, n_bands, axis=0)[:-1]
+
+
+def band_lags(bands_audio, bands_ref, max_lag=None):
+    """
+    Cross-correlates sub-band spectrograms along the time axis only (i.e. no shift across frequency),
+    with the rows of each band correlated in 1 stack of FFTs.
+
+    Arguments:
+    - list  bands_audio : Sub-band spectrograms of the audio to be aligned (see sub_band_spectra)
+    - list  bands_ref   : Sub-band spectrograms of the reference
+    - tuple max_lag     : Optionally, (lowest, highest) lag in frames to search within
+
+    Returns:
+    - numpy array of the lag (in frames) by which the audio lags behind the reference, per band
+      (NaN for a band where no lag within max_lag is possible, e.g. on very short audio)
+    """
+    lags = []
+    for band_audio, band_ref in zip(bands_audio, bands_ref):
+        n_audio, n_ref = band_audio.shape[1], band_ref.shape[1]
+        n = scipy.fft.next_fast_len(n_audio + n_ref - 1, real=True)
+        # Sum of the per-row correlations = correlation of the whole band at a frequency shift of 0
+        cross_spectrum = np.sum(scipy.fft.rfft(band_audio, n, axis=1) * np.conj(scipy.fft.rfft(band_ref, n, axis=1)), axis=0)
+        correlation = scipy.fft.irfft(cross_spectrum, n)
+
+        # correlation[lag] for lag >= 0, correlation[n + lag] for lag < 0
+        candidate_lags = np.arange(-(n_ref - 1), n_audio)
+        if max_lag is not None:
+            candidate_lags = candidate_lags[(candidate_lags >= max_lag[0]) & (candidate_lags <= max_lag[1])]
+        if candidate_lags.size == 0:
+            lags.append(np.nan)
+            continue
+        lags.append(candidate_lags[np.argmax(correlation[candidate_lags % n])])
+
+    return np.array(lags)
+
+
+def _reject_outliers(list_of_lags):
+    ## Reject any outliers in the list of lags, as time_aligner does
+    selection_boolean = abs(list_of_lags - np.mean(list_of_lags)) < 1.2 * (np.std(list_of_lags) + 1e-4)
+    return list_of_lags[selection_boolean]
+
+
+def _reference_excerpt(data_ref, bands_ref_coarse, coarse_hop_length, refine_duration_s, sr):
+    ## The excerpt of the reference used in the refined search: refine_duration_s around its loudest coarse frame
+    frame_energy = np.sum([np.sum(band ** 2, axis=0) for band in bands_ref_coarse], axis=0)
+    centre = int(np.argmax(frame_energy)) * coarse_hop_length
+    half_excerpt = int(refine_duration_s * sr / 2)
+    ref_start = max(0, centre - half_excerpt)
+    return ref_start, data_ref[ref_start:centre + half_excerpt]
+
+
+def reference_bands(data_ref, hop_length=32, coarse_hop_length=512, refine_duration_s=1.0, sr=48000):
+    """
+    Computes the sub-band spectra of the reference used by estimate_lag, which do not depend on the audio to be aligned;
+    computed once, they can be passed to estimate_lag for every file.
+
+    Returns:
+    - tuple (bands_ref_coarse, bands_ref_fine), as taken by estimate_lag
+    """
+    bands_ref_coarse = sub_band_spectra(data_ref, coarse_hop_length)
+    _, ref_excerpt = _reference_excerpt(data_ref, bands_ref_coarse, coarse_hop_length, refine_duration_s, sr)
+    return bands_ref_coarse, sub_band_spectra(ref_excerpt, hop_length)
+
+
+def estimate_lag(data_audio, data_ref, hop_length=32, coarse_hop_length=512, refine_duration_s=1.0, sr=48000,
+                 bands_ref_coarse=None, bands_ref_fine=None):
+    """
+    Estimates by how many samples data_audio lags behind data_ref, coarse-to-fine:
+    (1) a search over the whole clip at coarse_hop_length
+    (2) a refined search at hop_length, over refine_duration_s of audio around the loudest part of the reference,
+        within 2 coarse hops of (1)
+
+    Arguments:
+    - numpy array   data_audio          : The audio to be aligned
+    - numpy array   data_ref            : The reference audio
+    - int           hop_length          : The hop of the refined search, i.e. the resolution of the lag
+    - int           coarse_hop_length   : The hop of the coarse search
+    - float         refine_duration_s   : The duration of the excerpt used in the refined search
+    - int           sr                  : The sampling rate of both audio
+    - list          bands_ref_coarse    : Optionally, sub_band_spectra(data_ref, coarse_hop_length), if already computed
+    - list          bands_ref_fine      : Optionally, the sub-band spectra of the reference excerpt, if already computed
+                                        : (see reference_bands)
+
+    Returns:
+    - int lag in samples
+    """
+    # (1) Coarse search
+    if bands_ref_coarse is None:
+        bands_ref_coarse = sub_band_spectra(data_ref, coarse_hop_length)
+    coarse_lags = _reject_outliers(band_lags(sub_band_spectra(data_audio, coarse_hop_length), bands_ref_coarse))
+    coarse_lag = int(np.mean(coarse_lags) * coarse_hop_length)
+
+    # (2) Refined search on an excerpt around the loudest coarse frame of the reference
+    ref_start, ref_excerpt = _reference_excerpt(data_ref, bands_ref_coarse, coarse_hop_length, refine_duration_s, sr)
+    if bands_ref_fine is None:
+        bands_ref_fine = sub_band_spectra(ref_excerpt, hop_length)
+    margin = 2 * coarse_hop_length
+    audio_start = min(max(0, ref_start + coarse_lag - margin), max(0, len(data_audio) - 1))
+    audio_excerpt = data_audio[audio_start:ref_start + coarse_lag + len(ref_excerpt) + margin]
+
+    # lag (samples) = lag between excerpts (frames) * hop_length + offset between excerpts
+    offset = audio_start - ref_start
+    max_lag = ((coarse_lag - margin - offset) // hop_length, (coarse_lag + margin - offset) // hop_length + 1)
+    fine_lags = band_lags(sub_band_spectra(audio_excerpt, hop_length), bands_ref_fine, max_lag=max_lag)
+    fine_lags = fine_lags[np.isfinite(fine_lags)]
+    # No lag within the window (e.g. the audio ends too soon after the excerpt): keep the coarse lag
+    if fine_lags.size == 0:
+        return coarse_lag
+
+    return int(np.mean(_reject_outliers(fine_lags)) * hop_length) + offset
+
+
+def _batch_worker_init(data_ref, bands_ref_coarse, bands_ref_fine):
+    # Each process receives the reference (and its sub-band spectra) once, rather than once per file
+    global _batch_ref
+    _batch_ref = (data_ref, bands_ref_coarse, bands_ref_fine)
+
+
+def _batch_worker(audio_path, output_path, sr_ref, hop_length, coarse_hop_length, refine_duration_s,
+                  trim, trim_duration_s, gcc_phat_refine):
+    import librosa
+
+    # Each file is aligned and written within its worker, so only its lag travels back, and at most 1 clip per
+    # process is held in memory, however large the folder
+    data_audio, sr = librosa.load(audio_path, sr=None)
+    if sr != sr_ref:
+        raise ValueError("The sampling rates of the clips are not the same.")
+    data_ref, bands_ref_coarse, bands_ref_fine = _batch_ref
+    lag = estimate_lag(data_audio, data_ref, hop_length=hop_length, coarse_hop_length=coarse_hop_length,
+                       refine_duration_s=refine_duration_s, sr=sr,
+                       bands_ref_coarse=bands_ref_coarse, bands_ref_fine=bands_ref_fine)
+    if gcc_phat_refine:
+        lag = refine_lags([data_audio], data_ref, [lag], search_radius=2 * hop_length, sr=sr)[0]
+
+    ## Align audio: This is achieved by removing the front part of the "lagging" audio
+    aligned_data_audio = data_audio[max(int(round(lag)), 0):]
+
+    ## Trim audio: Now we trim the end of the aligned audio
+    if trim:
+        aligned_data_audio = aligned_data_audio[:int(trim_duration_s * sr)]
+
+    sf.write(output_path, aligned_data_audio, samplerate=sr)
+    return float(lag)
+
+
+def time_aligner_batch(reference_path="./data/fabric_experiment/references/0Clean_0deg_NoCover_aligned.wav",
+                       input_folder="./data/fabric_experiment/run2_recording",
+                       output_folder="./data/fabric_experiment/aligned_run2_recordings",
+                       hop_length=32,
+                       coarse_hop_length=512,
+                       refine_duration_s=1.0,
+                       trim=True,
+                       trim_duration_s=4.5,
+                       gcc_phat_refine=True,
+                       workers=None):
+    """
+    Batch version of time_aligner: aligns a folder of wav audio clips against a reference wav clip coarse-to-fine
+    (see estimate_lag), in parallel across files, and exports the aligned audio-s into a designated folder.
+    Every file is loaded, aligned and written by its worker, so memory use does not grow with the size of the folder.
+
+    Arguments:
+    - int   coarse_hop_length   : The hop of the coarse search over the whole clip
+    - float refine_duration_s   : The duration of the excerpt used to refine the lag at hop_length
+    - bool  gcc_phat_refine     : If True, refines the lags to a fraction of a sample on the waveforms (see refine_lags)
+                                : Aligned audio-s are cut to the nearest sample
+    - int   workers             : The number of processes (defaults to 1 per core)
+    - see time_aligner for the rest
+
+    Returns:
+    - dict of lag (in samples; fractional if gcc_phat_refine) per file
+    raises ValueError : if the sampling rates for both audio do not match
+    """
+    import librosa
+    data_ref, sr1 = librosa.load(reference_path, sr=None)
+    # The spectra of the reference are the same for every file; computed once here
+    bands_ref_coarse, bands_ref_fine = reference_bands(data_ref, hop_length=hop_length, coarse_hop_length=coarse_hop_length,
+                                                       refine_duration_s=refine_duration_s, sr=sr1)
+
+    files = list_audio(input_folder, extensions=(".wav",))
+    print(f" {len(files)} files found in folder {input_folder}\n")
+
+    if not os.path.isdir(output_folder):
+        os.mkdir(output_folder)
+
+    ## Will trim reference too; This will just output the trimmed reference into the output folder
+    path_name = (f"ref_trimmed_{reference_path.split('/')[-1]}")
+    if not os.path.isfile(os.path.join(output_folder, path_name)):
+        sf.write(os.path.join(output_folder, path_name), data_ref[:int(trim_duration_s * sr1)], samplerate=sr1)
+
+    lags = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init,
+                             initargs=(data_ref, bands_ref_coarse, bands_ref_fine)) as executor:
+        results = executor.map(_batch_worker,
+                               [os.path.join(input_folder, audio) for audio in files],
+                               [os.path.join(output_folder, audio[:-4] + "_aligned.wav") for audio in files],
+                               [sr1] * len(files),
+                               [hop_length] * len(files),
+                               [coarse_hop_length] * len(files),
+                               [refine_duration_s] * len(files),
+                               [trim] * len(files),
+                               [trim_duration_s] * len(files),
+                               [gcc_phat_refine] * len(files))
+
+        # Only the lags come back, in the order of files
+        for audio, fractional_lag in zip(files, results):
+            print(f"Clip {audio} lags behind reference by {fractional_lag / sr1}s")
+            if int(round(fractional_lag)) < 0:
+                print("WARNING: You are seemingly removing non-empty portion of the audio you are trying to align")
+            lags[audio] = fractional_lag
+
+    return lags
+
+
+## Waveform refinement (GCC-PHAT)
+# Spectrogram alignment resolves the lag only to a hop; the lag is then refined on the waveform itself with GCC-PHAT
+# (generalised cross-correlation with phase transform), within search_radius samples of the spectrogram estimate,
+# and parabolic interpolation around the peak gives a fractional delay
+# Only an excerpt of each clip around the loudest part of the reference is correlated, so the FFTs stay short;
+# excerpts of many files are stacked and correlated in 1 batch of FFTs
+# The same machinery verifies the alignment of generated clean/dirty pairs (see verify_pair_alignment)
+
+def loudest_sample(data, frame_length=2048):
+    """
+    Returns the centre sample of the loudest frame (of frame_length samples) of an audio clip.
+    """
+    n_frames = max(len(data) // frame_length, 1)
+    frame_energy = np.sum(np.square(data[:n_frames * frame_length].reshape(n_frames, -1)), axis=1)
+    return int(np.argmax(frame_energy)) * frame_length + frame_length // 2
+
+
+def _excerpt(data, start, length):
+    ## Slices data[start:start + length], zero-padding wherever the slice runs off either end of data
+    excerpt = np.zeros(length, dtype=np.float64)
+    lo, hi = max(start, 0), min(start + length, len(data))
+    if hi > lo:
+        excerpt[lo - start:hi - start] = data[lo:hi]
+    return excerpt
+
+
+def gcc_phat_lags(audio_excerpts, ref_excerpts, search_radius):
+    """
+    Batched GCC-PHAT: finds, per row, the shift k in [0, 2 * search_radius] at which audio_excerpts[i, k:] best matches
+    ref_excerpts[i], refined to a fraction of a sample by parabolic interpolation around the peak.
+
+    Arguments:
+    - numpy array   audio_excerpts  : Excerpts of the audio to be aligned, of dimension (n_files, excerpt_length + 2 * search_radius)
+    - numpy array   ref_excerpts    : Excerpts of the references, of dimension (n_files, excerpt_length)
+    - int           search_radius   : The search window is +/- search_radius samples around the centre of audio_excerpts
+
+    Returns:
+    - numpy array of fractional shifts, minus search_radius (i.e. 0 when the excerpts are aligned on their centres)
+    """
+    audio_excerpts, ref_excerpts = np.atleast_2d(audio_excerpts), np.atleast_2d(ref_excerpts)
+    n = scipy.fft.next_fast_len(audio_excerpts.shape[1] + ref_excerpts.shape[1] - 1, real=True)
+
+    cross_spectrum = scipy.fft.rfft(audio_excerpts, n, axis=1) * np.conj(scipy.fft.rfft(ref_excerpts, n, axis=1))
+    # Phase transform: whiten the cross spectrum, so the correlation peak is sharp regardless of the spectra of the signals
+    cross_spectrum /= np.abs(cross_spectrum) + 1e-12
+    correlation = scipy.fft.irfft(cross_spectrum, n, axis=1)[:, :2 * search_radius + 1]
+
+    peaks = np.argmax(correlation, axis=1)
+    rows = np.arange(len(peaks))
+    # Parabolic interpolation through the peak and its neighbours (not at the edges of the window)
+    inner = (peaks > 0) & (peaks < 2 * search_radius)
+    left = correlation[rows, np.clip(peaks - 1, 0, None)]
+    centre = correlation[rows, peaks]
+    right = correlation[rows, np.clip(peaks + 1, None, 2 * search_radius)]
+    curvature = left - 2 * centre + right
+    fraction = np.where(inner & (curvature < 0), 0.5 * (left - right) / np.where(curvature < 0, curvature, -1), 0)
+
+    return peaks + fraction - search_radius
+
+
+def refine_lags(data_audios, data_refs, coarse_lags, search_radius=64, excerpt_duration_s=0.5, sr=48000):
+    """
+    Refines the lags (in samples) by which each of data_audios lags behind its reference in data_refs,
+    with GCC-PHAT on the waveforms within search_radius samples of coarse_lags (see gcc_phat_lags).
+
+    Arguments:
+    - list          data_audios         : The audio clips to be aligned
+    - list          data_refs           : The reference of each clip; a single numpy array is used for every clip
+    - list          coarse_lags         : The estimated lag of each clip, e.g. by estimate_lag (0 for clips expected to be aligned)
+    - int           search_radius       : The lag is searched within +/- search_radius samples of the coarse lag
+                                        : Should be at least the hop_length of the coarse estimate
+    - float         excerpt_duration_s  : The duration of the excerpts which are correlated
+    - int           sr                  : The sampling rate of the clips
+
+    Returns:
+    - numpy array of fractional lags in samples
+    """
+    if isinstance(data_refs, np.ndarray):
+        data_refs = [data_refs] * len(data_audios)
+    excerpt_length = int(excerpt_duration_s * sr)
+
+    audio_excerpts = np.zeros((len(data_audios), excerpt_length + 2 * search_radius))
+    ref_excerpts = np.zeros((len(data_audios), excerpt_length))
+    for i, (data_audio, data_ref, coarse_lag) in enumerate(zip(data_audios, data_refs, coarse_lags)):
+        ref_start = max(0, min(loudest_sample(data_ref) - excerpt_length // 2, len(data_ref) - excerpt_length))
+        ref_excerpts[i] = _excerpt(data_ref, ref_start, excerpt_length)
+        audio_excerpts[i] = _excerpt(data_audio, ref_start + int(round(coarse_lag)) - search_radius,
+                                     excerpt_length + 2 * search_radius)
+
+    return np.round(coarse_lags) + gcc_phat_lags(audio_excerpts, ref_excerpts, search_radius)
+
+
+def _pair_sources(clean_folder, dirty_folder, log_path=None, shard_folder=None):
+    """
+    Matches clean clips with dirty clips, by (in order of preference):
+    (1) shard_folder : the clean and dirty members of each item of the tar shards (see read_tar_shards)
+    (2) log_path     : the dirty file_name logged for each serial in the experiment log, with clean clip "{serial}.wav"
+    (3) otherwise    : the serial within the dirty file name, i.e. "{serial}_*.wav" (as named by
+                       src.encoding_scripts.opus.decode_opus) or "phone_lowpass_sample_{serial}.wav"
+
+    Returns:
+    - list of tuple (dirty name, clean source, dirty source); sources are paths, or file objects for shards
+    - list of str describing each clip which could not be paired (e.g. a dirty clip still encoded, or a missing clean clip)
+    """
+    pairs, unmatched = [], []
+    if shard_folder is not None:
+        from src.output_sink import read_tar_shards
+        for key, item in read_tar_shards(shard_folder):
+            dirty_member = next((extension for extension in item if extension.startswith("dirty.")), None)
+            if "clean.wav" not in item or dirty_member != "dirty.wav":
+                unmatched.append(f"{key} (members: {', '.join(sorted(item))})")
+                continue
+            pairs.append((f"{key}.{dirty_member}", io.BytesIO(item["clean.wav"]), io.BytesIO(item["dirty.wav"])))
+        return pairs, unmatched
+
+    if log_path is not None:
+        with open(log_path, "r") as f:
+            names = [(str(entry["serial"]), entry["file_name"]) for entry in json.load(f)]
+    else:
+        names = []
+        for file in sorted(os.listdir(dirty_folder)):
+            stem = os.path.splitext(file)[0]
+            serial = stem[len("phone_lowpass_sample_"):] if stem.startswith("phone_lowpass_sample_") else stem.split("_")[0]
+            names.append((serial, file))
+
+    for serial, dirty_file in names:
+        clean_path = os.path.join(clean_folder, f"{serial}.wav")
+        dirty_path = os.path.join(dirty_folder, dirty_file)
+        if not dirty_file.lower().endswith(".wav"):
+            unmatched.append(f"{dirty_file} (not a wav file)")
+        elif not os.path.isfile(dirty_path):
+            unmatched.append(f"{dirty_file} (not found in {dirty_folder})")
+        elif not os.path.isfile(clean_path):
+            unmatched.append(f"{dirty_file} (no clean clip {serial}.wav)")
+        else:
+            pairs.append((dirty_file, clean_path, dirty_path))
+
+    return pairs, unmatched
+
+
+def verify_pair_alignment(clean_folder="./output/clean_samples",
+                          dirty_folder="./output/dirty_samples",
+                          log_path=None,
+                          shard_folder=None,
+                          search_radius=64,
+                          excerpt_duration_s=0.5,
+                          tolerance_samples=1.0,
+                          batch_size=256):
+    """
+    Verifies that generated clean/dirty pairs are aligned, by measuring the lag of each dirty clip behind its clean clip
+    with GCC-PHAT (see refine_lags). Pairs are matched on the experiment log or the tar shards if given
+    (see _pair_sources); dirty clips are resampled to the sampling rate of their clean clip if needed.
+
+    Arguments:
+    - str   clean_folder        : The folder of clean clips
+    - str   dirty_folder        : The folder of dirty clips
+    - str   log_path            : The experiment log of the run, whose file_name pairs each dirty clip with its serial
+    - str   shard_folder        : The folder of tar shards to verify instead of loose files
+    - int   search_radius       : The largest misalignment (in samples) which can be detected
+    - float excerpt_duration_s  : The duration of the excerpts which are correlated
+    - float tolerance_samples   : Pairs whose absolute lag exceeds this are reported as misaligned
+    - int   batch_size          : The number of pairs correlated in 1 batch of FFTs
+
+    Returns:
+    - dict of fractional lag (in samples) per dirty clip, list of misaligned dirty clips,
+      and list of clips which could not be paired (and hence were not verified)
+    """
+    import librosa
+
+    pairs, unmatched = _pair_sources(clean_folder, dirty_folder, log_path=log_path, shard_folder=shard_folder)
+    print(f" {len(pairs)} clean/dirty pairs found\n")
+    if unmatched:
+        print(f"{len(unmatched)} clips could not be paired, and are not verified:")
+        for description in unmatched:
+            print(f"  {description}")
+
+    lags = {}
+    for batch_start in range(0, len(pairs), batch_size):
+        batch = pairs[batch_start:batch_start + batch_size]
+        data_cleans, data_dirties, srs = [], [], set()
+        for _, clean_source, dirty_source in batch:
+            data_clean, sr = librosa.load(clean_source, sr=None)
+            data_dirty, _ = librosa.load(dirty_source, sr=sr)
+            data_cleans.append(data_clean)
+            data_dirties.append(data_dirty)
+            srs.add(sr)
+        if len(srs) > 1:
+            raise ValueError("The sampling rates of the clean clips are not the same.")
+
+        batch_lags = refine_lags(data_dirties, data_cleans, np.zeros(len(batch)),
+                                 search_radius=search_radius, excerpt_duration_s=excerpt_duration_s, sr=srs.pop())
+        lags.update({dirty_name: float(lag) for (dirty_name, _, _), lag in zip(batch, batch_lags)})
+
+    misaligned = [file for file, lag in lags.items() if abs(lag) > tolerance_samples]
+    print(f"{len(misaligned)} of {len(lags)} pairs misaligned by more than {tolerance_samples} samples")
+
+    return lags, misaligned, unmatched
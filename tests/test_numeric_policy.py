@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
+from src.debug_taps import MemoryTap
+from src.numeric_policy import check_audio
+from src.numeric_policy import set_working_dtype
+from src.numeric_policy import to_numpy
+from src.numeric_policy import to_working
+from src.output_sink import LooseFileSink
+from src.pipeline import device_stages
+from src.pipeline import run_pipeline
+from src.pipeline import speech_noise_stages
+
+SR = 16000
+
+
+@pytest.fixture(autouse=True)
+def reset_working_dtype():
+    yield
+    set_working_dtype("float32")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    ## Synthetic speech, noise and IR folders, laid out as under ./data
+    rng = np.random.default_rng(0)
+    folders = {name: tmp_path / name for name in ("speech", "stationary", "nonstationary", "room", "fabric", "handphone")}
+    for folder in folders.values():
+        folder.mkdir()
+
+    for i in range(2):
+        sf.write(folders["speech"] / f"speech_{i}.wav", 0.3 * rng.standard_normal(SR * (i + 1)), SR, subtype="PCM_16")
+        sf.write(folders["stationary"] / f"noise_{i}.wav", 0.1 * rng.standard_normal(SR // 2), SR, subtype="PCM_16")
+        sf.write(folders["nonstationary"] / f"noise_{i}.wav", 0.1 * rng.standard_normal(SR // 4), SR, subtype="PCM_16")
+
+    # IRs are float64 on disk (as are most of ./data/Impulse_Responses), the source of the upcasts of old
+    for name in ("room", "fabric", "handphone"):
+        for i in range(3):
+            ir = rng.standard_normal(400) * np.exp(-np.arange(400) / 50)
+            np.save(folders[name] / f"ir_{i}.npy", ir.astype(np.float64))
+
+    return {name: str(folder) for name, folder in folders.items()}
+
+
+def _config(corpus, dtype, output_folder):
+    stages = (speech_noise_stages(corpus["speech"], corpus["room"], corpus["stationary"], corpus["nonstationary"])
+              + device_stages(corpus["fabric"], corpus["handphone"])[:-1]  # no codec: libopus may not be installed
+              + [{"stage": "phone"}])
+    # rubberband may not be installed either
+    stages[0].update(tempo_change=False, pitch_shift=False)
+    # Tap every stage boundary
+    for position, options in enumerate(stages):
+        options["tap"] = f"{position}_{options['stage']}"
+
+    return {"output": {"folder": output_folder}, "stages": stages, "dtype": dtype, "check_numerics": True}
+
+
+@pytest.mark.parametrize("dtype, torch_dtype", [("float32", torch.float32), ("float64", torch.float64)])
+def test_stage_boundaries_keep_working_dtype(corpus, tmp_path, dtype, torch_dtype):
+    config = _config(corpus, dtype, str(tmp_path))
+    tap = MemoryTap()
+    # check_numerics raises at the first stage handing on audio of another dtype, or non-contiguous audio
+    log = run_pipeline(config,
+                       number_of_audios=4,
+                       sink=LooseFileSink(clean_folder=str(tmp_path / "clean"), dirty_folder=str(tmp_path / "dirty")),
+                       debug_taps=[tap],
+                       async_writers=0)
+
+    assert len(log) == 4
+    points = {point for _, point in tap.captured}
+    assert points == {options["tap"] for options in config["stages"]}
+    for (item, point), (audio_data, _) in tap.captured.items():
+        assert audio_data.dtype == torch_dtype, f"item {item}, {point}"
+        assert audio_data.is_contiguous(), f"item {item}, {point}"
+
+
+def test_conversions_share_memory():
+    audio_np = np.zeros(16, dtype=np.float32)
+    audio_data = to_working(audio_np)
+    assert audio_data.dtype == torch.float32
+    assert np.shares_memory(to_numpy(audio_data), audio_np)
+
+    # Other dtypes are converted (a copy is unavoidable then)
+    assert to_working(np.zeros(16, dtype=np.float64)).dtype == torch.float32
+    assert to_numpy(torch.zeros(16, dtype=torch.float64)).dtype == np.float32
+
+
+def test_check_audio():
+    check_audio(torch.zeros(1, 16))
+    with pytest.raises(TypeError):
+        check_audio(torch.zeros(1, 16, dtype=torch.float64))
+    with pytest.raises(TypeError):
+        check_audio(np.zeros((1, 16), dtype=np.float32))
+    with pytest.raises(ValueError):
+        check_audio(torch.zeros(16, 2).T)